@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+''' Benchmark for the GEFS scripts. Writes a run of synthetic GEFS GRIB2 files (syntheticgrib.py)
+    and times each stage of the pipeline on them: decoding each file, pulling out the values at
+    the locations, the ensemble statistics, the cube file and CSV writes, htmlbuilder.py's daily
+    aggregation, the HTML pages, and the render of every plot. The timings are written to a JSON
+    report so runs on different commits can be compared (--compare OLDREPORT prints the change for
+    each stage).
+    The synthetic files are kept in the work directory and reused as long as the member count,
+    lead count, resolution, and sampling don't change.
+
+    It also reports the ingest throughput (files and MB decoded per second) and projects how long
+    a whole cycle would take at the configured size against the cycle budget, so a bigger layout
+    (31 members, 0.25 degree grids, leads out to 840 hours) can be checked before it goes live.
+    A full 0.25 degree run is far too big to write out just for a benchmark, so --sample N writes
+    and decodes only every Nth file. The rest of the cube is filled with copies of the decoded
+    files, so the later stages still run at full size, and the ingest time is projected from the
+    per-file timings.
+
+    usage: python benchmark.py [--members 20|31] [--leads 65] [--resolution 1.0] [--sample 1]
+                               [--workers 1] [--budget 60]
+                               [--report benchmark.json] [--compare OLDREPORT]
+'''
+
+import argparse
+import json
+import numpy as np
+import os
+import platform
+import pygrib
+import subprocess
+import time
+
+import ensemblemeans
+import htmlbuilder
+from cubestore import openCube,writeCube
+from dailyaggregate import siteDaily
+from ensemblestats import EnsembleStats
+from gefsingest import convertPoints,extractPoints,gridMessage,pointfields,units,validTimes,\
+    variables
+from gribindex import MessageIndex
+from gridindex import siteWeights
+from htmlpages import SitePages
+from renderpool import renderJob
+from runlayout import RunLayout
+from stations import loadSites
+from syntheticgrib import memberNumbers,writeRun
+
+__author__ = 'Jason Godwin'
+__license__ = 'GPL'
+__maintainer__ = 'Jason Godwin'
+__email__ = 'jasonwgodwin@gmail.com'
+__status__ = 'Production'
+
+### USER SETTINGS BLOCK ###
+workdir = '/tmp/gefs-benchmark'     # synthetic GRIB files and benchmark products go here
+stationfile = os.path.join(os.path.dirname(os.path.abspath(__file__)),'examples','stations.csv')
+members = 20                        # ensemble members (20, or 31 with the control run)
+leads = 65                          # 6-hourly lead times (65 = out to 384 hours, 141 = 840 hours)
+resolution = 1.0                    # grid spacing of the synthetic files (degrees)
+sample = 1                          # write and decode only every Nth file (1 = the whole run)
+workers = 1                         # ingest and render processes assumed in the projection
+budget = 60.0                       # minutes a cycle has to finish in
+interpolation = 'nearest'           # 'nearest' or 'bilinear' (see ensemblemeans.py)
+season = 'warm'                     # season for the temperature plots (see htmlbuilder.py)
+report = 'benchmark.json'           # where the timings are written
+### END OF USER SETTINGS BLOCK ###
+
+# count, total, mean, median, and max of a list of timings (seconds)
+def summarize(samples):
+    if len(samples) == 0:
+        return {'count':0,'total':0.0,'mean':0.0,'median':0.0,'max':0.0}
+    return {'count':len(samples),'total':float(np.sum(samples)),'mean':float(np.mean(samples)),\
+        'median':float(np.median(samples)),'max':float(np.max(samples))}
+
+# current git commit of the scripts (None outside of a git checkout)
+def gitCommit():
+    try:
+        commit = subprocess.check_output(['git','rev-parse','HEAD'],\
+            cwd=os.path.dirname(os.path.abspath(__file__)),stderr=subprocess.DEVNULL)
+        return commit.decode('utf-8').strip()
+    except (OSError,subprocess.CalledProcessError):
+        return None
+
+# makes sure gribdir holds synthetic files for the given configuration, writing them if not (only
+# every stride-th file). Returns the sorted file names and the seconds spent writing them (0 if
+# they were reused).
+def prepareFixtures(gribdir,nmembers,nleads,resolution,stride=1):
+    config = {'members':nmembers,'leads':nleads,'resolution':resolution,'sample':stride}
+    configfile = os.path.join(gribdir,'fixtures.json')
+    if os.path.isfile(configfile):
+        with open(configfile) as f:
+            if json.load(f) == config:
+                return sorted(x for x in os.listdir(gribdir) if x.startswith('grib_gefs_')),0.0
+
+    if os.path.isdir(gribdir):
+        for filename in os.listdir(gribdir):
+            os.remove(os.path.join(gribdir,filename))
+    start = time.perf_counter()
+    filenames = writeRun(gribdir,nmembers=nmembers,nleads=nleads,resolution=resolution,\
+        stride=stride)
+    elapsed = time.perf_counter() - start
+    with open(configfile,'w') as f:
+        json.dump(config,f)
+    return sorted(filenames),elapsed
+
+# name of a plot job for the report, e.g. 'tempPlot' or 'plotter:highs.png'
+def jobName(job):
+    function,args = job
+    pngs = [os.path.basename(x) for x in args if isinstance(x,str) and x.endswith('.png')]
+    return ':'.join([function.__name__] + pngs)
+
+# runs every stage on the synthetic run and returns the timings (seconds) for each one, plus the
+# number of bytes decoded. With stride only every stride-th file is decoded (see prepareFixtures).
+def runBenchmark(workdir,sites,nmembers,nleads,resolution,method='nearest',season='warm',\
+    stride=1):
+    gribdir = os.path.join(workdir,'grib')
+    filenames,generate = prepareFixtures(gribdir,nmembers,nleads,resolution,stride)
+    sitelats = [site['lat'] for site in sites]
+    sitelons = [site['lon'] for site in sites]
+    layout = RunLayout(memberNumbers(nmembers),range(0,6 * nleads,6))
+    timings = {'generate':[generate],'decode':[],'extract':[]}
+
+    # decode the fields the enabled variables need (see derivedvars.py) in every file, then pull
+    # the values out at the locations
+    cube = np.empty([len(sites)] + list(layout.shape) + [len(variables)])
+    cube[:,:,:,:] = np.nan
+    initinfo = None
+    decoded = []
+    nbytes = 0
+    for filename in filenames:
+        nbytes += os.path.getsize(os.path.join(gribdir,filename))
+        start = time.perf_counter()
+        grbs = pygrib.open(os.path.join(gribdir,filename))
+        index = MessageIndex(grbs)
+        analysis = '_000_' in filename
+        for shortname,level in pointfields[analysis]:
+            index.values(shortname,level)
+        timings['decode'].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        cells = siteWeights(gridMessage(index,analysis),sitelats,sitelons,method)
+        values = convertPoints(extractPoints(index,analysis,cells),analysis,len(sites))
+        timings['extract'].append(time.perf_counter() - start)
+
+        initinfo = (str(grbs.message(1).dataDate),str(grbs.message(1).dataTime))
+        grbs.close()
+        member,lead = layout.indices(filename)
+        cube[:,member,lead,:] = np.transpose(values)
+        decoded.append((member,lead))
+    vtimes = validTimes(*initinfo,hours=layout.hours)
+
+    # fill the files that weren't sampled with copies of the ones that were, so everything after
+    # the ingest works on a full-size cube
+    if stride > 1:
+        have = np.zeros(layout.shape,dtype=bool)
+        have[tuple(np.transpose(decoded))] = True
+        members,leads = np.nonzero(~have)
+        source = np.resize(np.asarray(decoded),(len(members),2))
+        cube[:,members,leads,:] = cube[:,source[:,0],source[:,1],:]
+
+    # ensemble statistics for every location at once (plus the percentiles and exceedance
+    # probabilities, which nothing plots yet)
+    start = time.perf_counter()
+    ensemble = EnsembleStats(cube,memberaxis=1)
+    stats = ensemble.summary()
+    ensemble.percentiles([10,25,50,75,90])
+    ensemble.exceedance([0.0])
+    timings['statistics'] = [time.perf_counter() - start]
+
+    # cube file and CSVs (the CSV stage also builds the ensemble mean plot jobs)
+    cubefile = os.path.join(workdir,'gefs_cube.bin')
+    start = time.perf_counter()
+    writeCube(cubefile,cube,vtimes,sites,variables,units,layout.columns())
+    timings['storewrite'] = [time.perf_counter() - start]
+
+    jobs = []
+    timings['csvwrite'] = []
+    for ix,site in enumerate(sites):
+        if not os.path.isdir(site['savedir']):
+            os.makedirs(site['savedir'])
+        start = time.perf_counter()
+        jobs += ensemblemeans.siteProducts(cube[ix],vtimes,site['name'],site['savedir'],True,\
+            dict((key,value[ix]) for key,value in stats.items()),layout.columns())
+        timings['csvwrite'].append(time.perf_counter() - start)
+
+    # htmlbuilder.py's daily aggregation from the cube file, and the web pages
+    timings['aggregate'] = []
+    timings['html'] = []
+    header,data = openCube(cubefile)
+    pages = SitePages(os.path.join(workdir,'products'))
+    # every site is aggregated to days in one go, so that counts as one timing
+    start = time.perf_counter()
+    daily = siteDaily(data,header['variables'],header['validtimes'],\
+        [htmlbuilder.daytimezone] * len(sites),header['members'])
+    timings['aggregate'].append(time.perf_counter() - start)
+    for ix,site in enumerate(sites):
+        start = time.perf_counter()
+        jobs += htmlbuilder.buildSite(daily[ix],header['validtimes'][0],site['savedir'],\
+            site['name'],season)
+        timings['aggregate'].append(time.perf_counter() - start)
+        frames = htmlbuilder.cubeFrames(data[ix],header['variables'],header['validtimes'],\
+            header['members'])
+        start = time.perf_counter()
+        pages.add(site,frames)
+        timings['html'].append(time.perf_counter() - start)
+    pages.close()
+
+    # every plot, grouped by plot type
+    for job in jobs:
+        timings.setdefault('render:' + jobName(job),[]).append(renderJob(job))
+    return timings,nbytes
+
+# ingest throughput and the projected time (seconds) of a whole cycle at the benchmark's size.
+# The ingest is projected from the per-file decode and extract timings over every file in the
+# run, and it and the plot rendering are split over nworkers processes. Everything else ran at
+# full size, so its timings are used as they are.
+def projectCycle(stages,nbytes,nfiles,nworkers=1,budget=budget):
+    ingest = stages['decode']['total'] + stages['extract']['total']
+    sampled = stages['decode']['count']
+    render = sum(stage['total'] for name,stage in stages.items() if name.startswith('render:'))
+    other = sum(stage['total'] for name,stage in stages.items() \
+        if name not in ('generate','decode','extract') and not name.startswith('render:'))
+    projected = {'ingest':ingest / max(sampled,1) * nfiles / nworkers,\
+        'render':render / nworkers,'other':other}
+    total = sum(projected.values())
+    return {'files':sampled,'runfiles':nfiles,'bytes':nbytes,\
+        'filespersecond':sampled / ingest if ingest > 0 else 0.0,\
+        'mbpersecond':nbytes / 1048576.0 / ingest if ingest > 0 else 0.0,'workers':nworkers,\
+        'stages':projected,'total':total,'budget':budget * 60.0,\
+        'fraction':total / (budget * 60.0)}
+
+# prints the change in total time for every stage between two reports
+def compareReports(old,new):
+    if old['config'] != new['config']:
+        print('note: the reports are for different configurations (%s vs %s)' % \
+            (old['config'],new['config']))
+    print('%-50s %10s %10s %8s' % ('stage','old (s)','new (s)','change'))
+    for stage in sorted(set(old['stages']) | set(new['stages'])):
+        before = old['stages'].get(stage,{}).get('total')
+        after = new['stages'].get(stage,{}).get('total')
+        if before is None or after is None:
+            print('%-50s %10s %10s %8s' % (stage,'-' if before is None else '%.3f' % before,\
+                '-' if after is None else '%.3f' % after,'-'))
+        else:
+            change = '%+.1f%%' % (100.0 * (after - before) / before) if before > 0 else '-'
+            print('%-50s %10.3f %10.3f %8s' % (stage,before,after,change))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the GEFS scripts on synthetic GRIB files.')
+    parser.add_argument('--members',type=int,default=members,choices=[20,31],\
+        help='number of ensemble members')
+    parser.add_argument('--leads',type=int,default=leads,help='number of 6-hourly lead times')
+    parser.add_argument('--resolution',type=float,default=resolution,help='grid spacing (degrees)')
+    parser.add_argument('--sample',type=int,default=sample,\
+        help='write and decode only every Nth file (the rest is projected)')
+    parser.add_argument('--workers',type=int,default=workers,\
+        help='ingest and render processes assumed in the cycle projection')
+    parser.add_argument('--budget',type=float,default=budget,help='minutes a cycle has')
+    parser.add_argument('--workdir',default=workdir,help='directory for the files and products')
+    parser.add_argument('--report',default=report,help='JSON file to write the timings to')
+    parser.add_argument('--compare',help='earlier report to compare the timings against')
+    args = parser.parse_args()
+    # htmlbuilder.py drops the last two days of highs or lows, so there have to be at least three
+    # (and 141 lead times reach 840 hours, as far as the GEFS goes)
+    if not 13 <= args.leads <= 141:
+        parser.error('--leads must be between 13 and 141')
+    if args.sample < 1 or args.workers < 1:
+        parser.error('--sample and --workers have to be at least 1')
+
+    sites = loadSites(stationfile,os.path.join(args.workdir,'products'),None)
+    start = time.perf_counter()
+    timings,nbytes = runBenchmark(args.workdir,sites,args.members,args.leads,args.resolution,\
+        interpolation,season,args.sample)
+    elapsed = time.perf_counter() - start
+
+    results = {'commit':gitCommit(),'date':time.strftime('%Y-%m-%dT%H:%M:%SZ',time.gmtime()),\
+        'python':platform.python_version(),'numpy':np.__version__,'platform':platform.platform(),\
+        'config':{'members':args.members,'leads':args.leads,'resolution':args.resolution,\
+        'sample':args.sample,'sites':len(sites),'interpolation':interpolation},'elapsed':elapsed,\
+        'stages':dict((stage,summarize(samples)) for stage,samples in timings.items())}
+    results['projection'] = projectCycle(results['stages'],nbytes,args.members * args.leads,\
+        args.workers,args.budget)
+    with open(args.report,'w') as f:
+        json.dump(results,f,indent=2,sort_keys=True)
+
+    for stage in sorted(results['stages']):
+        summary = results['stages'][stage]
+        print('%-50s %4d x %8.4f s = %8.3f s' % (stage,summary['count'],summary['mean'],\
+            summary['total']))
+    print('finished in %.1f s, report written to %s' % (elapsed,args.report))
+
+    projection = results['projection']
+    print('ingest throughput: %.2f files/s, %.1f MB/s (%d of %d files decoded)' % \
+        (projection['filespersecond'],projection['mbpersecond'],projection['files'],\
+        projection['runfiles']))
+    print('projected cycle with %d worker(s): ingest %.1f min, render %.1f min, other %.1f min' % \
+        (args.workers,projection['stages']['ingest'] / 60.0,projection['stages']['render'] / 60.0,\
+        projection['stages']['other'] / 60.0))
+    print('projected total %.1f min of the %.0f min budget (%.0f%%)%s' % \
+        (projection['total'] / 60.0,args.budget,100.0 * projection['fraction'],\
+        '' if projection['fraction'] <= 1.0 else ' - OVER BUDGET'))
+
+    if args.compare:
+        with open(args.compare) as f:
+            compareReports(json.load(f),results)
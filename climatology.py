@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+''' Climatology for the GEFS daily products. A historical record of daily station (or reanalysis)
+    values is read once and boiled down to an index of normals and percentiles for every site,
+    daily variable, and day of the year, which is saved as a float32 [site, variable, day,
+    statistic] array (statistic 0 is the normal, then one for each of percentiles). The index is
+    memory-mapped when it is opened, so htmlbuilder.py can look up the normals for any site and
+    days and turn every member's daily values into anomalies and percentile ranks with a few
+    array operations, without going back to the history each cycle.
+
+    Each day of the year is built from every year's values within window days of it, so a 30
+    year record gives about 900 values per day. February 29 uses the same window as every other
+    day, and March 1 on is the same day of the year in leap and common years.
+
+    The history is a CSV file with a header row: id, date (YYYY-MM-DD), and any of max_temp,
+    min_temp, dpt, and precip (F and inches, the same daily values htmlbuilder.py makes). The ids
+    have to match the ids in the station list (or the default location's id, e.g.
+    dallas_fort_worth_tx). Blank values are skipped.
+
+    usage: python climatology.py HISTORYCSV OUTPUT [--window DAYS] [--minsamples N]
+'''
+
+import argparse
+import numpy as np
+import pandas
+
+from cubestore import openArray,writeArray
+from dailyaggregate import dailyvariables
+
+__author__ = 'Jason Godwin'
+__license__ = 'GPL'
+__maintainer__ = 'Jason Godwin'
+__email__ = 'jasonwgodwin@gmail.com'
+__status__ = 'Production'
+
+### USER SETTINGS BLOCK ###
+percentiles = [0,5,10,25,50,75,90,95,100]   # percentiles kept for each site and day of the year
+window = 15                         # days either side of each day of the year to take values from
+minsamples = 60                     # fewer values than this in a window = no climatology that day
+chunksize = 32                      # sites worked on at once (bounds the memory used)
+### END OF USER SETTINGS BLOCK ###
+
+magic = b'GEFSCLIM'
+units = {'max_temp':'F','min_temp':'F','dpt':'F','precip':'in'}
+
+# day of the year (0-365) of each date, with March 1 on counted as in a leap year so the same
+# date is always the same day
+def dayIndex(dates):
+    dates = pandas.DatetimeIndex(dates)
+    return np.asarray(dates.dayofyear - 1 + ((~dates.is_leap_year) & (dates.month > 2)))
+
+# percentiles of samples along axis 1, skipping NANs. The samples are sorted once and each
+# percentile is interpolated between the two values around it (like numpy.percentile), which is
+# much quicker than numpy.nanpercentile on arrays with NANs in them. NAN where there are fewer than
+# minsamples values.
+def samplePercentiles(samples,pcts,minsamples=minsamples):
+    samples = np.sort(samples,axis=1)
+    counts = np.sum(~np.isnan(samples),axis=1)
+    result = np.full((samples.shape[0],len(pcts)) + samples.shape[2:],np.nan,dtype=np.float32)
+    for n,pct in enumerate(pcts):
+        position = pct / 100.0 * np.maximum(counts - 1,0)
+        lower = np.floor(position).astype(int)
+        upper = np.minimum(lower + 1,np.maximum(counts - 1,0))
+        below = np.take_along_axis(samples,lower[:,np.newaxis],axis=1)[:,0]
+        above = np.take_along_axis(samples,upper[:,np.newaxis],axis=1)[:,0]
+        result[:,n] = below + (position - lower) * (above - below)
+    result[np.broadcast_to((counts < minsamples)[:,np.newaxis],result.shape)] = np.nan
+    return result
+
+# normals and percentiles for a [site, year, day of the year] array of daily values. Returns a
+# [site, day of the year, statistic] array (the normal, then each percentile).
+def dayStatistics(values,pcts=percentiles,halfwidth=window,minsamples=minsamples):
+    # every year's values within halfwidth days of each day of the year (wrapping around the end
+    # of the year), as [site, sample, day of the year]
+    samples = np.concatenate([np.roll(values,shift,axis=2) \
+        for shift in range(-halfwidth,halfwidth + 1)],axis=1)
+    counts = np.sum(~np.isnan(samples),axis=1)
+    with np.errstate(invalid='ignore',divide='ignore'):
+        normals = np.nansum(samples,axis=1) / counts
+    normals[counts < minsamples] = np.nan
+    stats = np.concatenate([normals[:,np.newaxis],\
+        samplePercentiles(samples,pcts,minsamples)],axis=1)
+    return np.transpose(stats,(0,2,1))
+
+# reads the history CSV and builds the climatology index for every site in it. Returns the
+# header and the [site, variable, day of the year, statistic] array.
+def buildClimatology(historyfile,pcts=percentiles,halfwidth=window,minsamples=minsamples):
+    history = pandas.read_csv(historyfile,dtype={'id':str},parse_dates=['date'])
+    variables = [var for var in dailyvariables if var in history.columns]
+    if not variables:
+        raise ValueError('%s has none of the columns %s' % (historyfile,','.join(dailyvariables)))
+    ids,siteixs = np.unique(history['id'].str.strip(),return_inverse=True)
+    years = history['date'].dt.year.values
+    yearixs = years - years.min()
+    days = dayIndex(history['date'])
+
+    data = np.full((len(ids),len(variables),366,1 + len(pcts)),np.nan,dtype=np.float32)
+    for v,var in enumerate(variables):
+        # [site, year, day of the year] array of the history, filled in one go
+        values = np.full((len(ids),yearixs.max() + 1,366),np.nan,dtype=np.float32)
+        values[siteixs,yearixs,days] = history[var].values
+        for start in range(0,len(ids),chunksize):
+            data[start:start + chunksize,v] = dayStatistics(values[start:start + chunksize],\
+                pcts,halfwidth,minsamples)
+
+    header = {'dims':['site','variable','day','statistic'],'variables':variables,\
+        'units':[units[var] for var in variables],'sites':list(ids),\
+        'statistics':['normal'] + ['p%g' % pct for pct in pcts],'percentiles':list(pcts),\
+        'years':[int(years.min()),int(years.max())],'window':halfwidth}
+    return header,data
+
+# percentile rank (0-100) of each value against the percentiles of its day. values are
+# [..., day] and edges are the matching [..., day, percentile] values. A value between two
+# percentiles is interpolated between them, and a value that ties several percentiles (like no
+# precipitation on most days) gets the middle of their ranks. NAN where either is missing.
+def percentileRank(values,edges,pcts=percentiles):
+    pcts = np.asarray(pcts,dtype=float)
+    values = np.asarray(values,dtype=float)[...,np.newaxis]
+    def interpolate(count):
+        upper = np.minimum(count,len(pcts) - 1)[...,np.newaxis]
+        lower = np.maximum(count - 1,0)[...,np.newaxis]
+        below = np.take_along_axis(edges,lower,axis=-1)[...,0]
+        above = np.take_along_axis(edges,upper,axis=-1)[...,0]
+        with np.errstate(invalid='ignore',divide='ignore'):
+            fraction = np.clip((values[...,0] - below) / (above - below),0.0,1.0)
+        rank = pcts[lower[...,0]] + np.nan_to_num(fraction) * (pcts[upper[...,0]] - \
+            pcts[lower[...,0]])
+        return np.where(count == 0,pcts[0],np.where(count == len(pcts),pcts[-1],rank))
+    rank = 0.5 * (interpolate(np.sum(edges < values,axis=-1)) + \
+        interpolate(np.sum(edges <= values,axis=-1)))
+    return np.where(np.isnan(values[...,0]) | np.isnan(edges).any(axis=-1),np.nan,rank)
+
+class Climatology(object):
+    ''' A climatology index file opened for lookups. The index is memory-mapped, so only the
+        sites and days that get looked up are read from disk.
+    '''
+
+    def __init__(self,filename):
+        self.header,self.data = openArray(filename,filemagic=magic)
+        self.sites = dict((siteid,ix) for ix,siteid in enumerate(self.header['sites']))
+        self.percentiles = self.header['percentiles']
+
+    # whether the climatology has a site and variable
+    def has(self,siteid,var):
+        return siteid in self.sites and var in self.header['variables']
+
+    # [day, statistic] array of the normal and percentiles for a site and variable on days
+    def lookup(self,siteid,var,days):
+        return np.asarray(self.data[self.sites[siteid],self.header['variables'].index(var)]\
+            [dayIndex(days)],dtype=float)
+
+    # normals for a site and variable on days
+    def normals(self,siteid,var,days):
+        return self.lookup(siteid,var,days)[:,0]
+
+    # anomalies and percentile ranks of [..., day] values (e.g. [member, day]) for a site and
+    # variable on days
+    def compare(self,siteid,var,days,values):
+        stats = self.lookup(siteid,var,days)
+        values = np.asarray(values,dtype=float)
+        edges = np.broadcast_to(stats[:,1:],values.shape + (stats.shape[1] - 1,))
+        return values - stats[:,0],percentileRank(values,edges,self.percentiles)
+
+# writes a climatology index built by buildClimatology
+def writeClimatology(filename,header,data):
+    writeArray(filename,header,np.asarray(data,dtype='<f4'),filemagic=magic)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the climatology index from a history file.')
+    parser.add_argument('history',help='CSV file of daily values (id,date,max_temp,...)')
+    parser.add_argument('output',help='climatology index file to write')
+    parser.add_argument('--window',type=int,default=window,\
+        help='days either side of each day of the year to take values from')
+    parser.add_argument('--minsamples',type=int,default=minsamples,\
+        help='fewest values needed for a day of the year')
+    args = parser.parse_args()
+
+    header,data = buildClimatology(args.history,percentiles,args.window,args.minsamples)
+    writeClimatology(args.output,header,data)
+    print('%d sites, %s, %d-%d: %d of %d site days have a climatology' % (len(header['sites']),\
+        ','.join(header['variables']),header['years'][0],header['years'][1],\
+        np.sum(~np.isnan(data[...,0])),data[...,0].size))
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+''' Binary store for the ensemble data handed from ensemblemeans.py to htmlbuilder.py. Every
+    variable for every location goes in a single float32 [site, variable, member, lead] array
+    behind a small JSON header holding the variable names, units, locations, and valid times.
+    The array is opened with numpy.memmap, so reading a location's data is just a view into the
+    file (no parsing), and nothing gets dropped along the way like it did with the CSVs.
+
+    File layout: 8 byte magic ('GEFSCUBE'), 4 byte little-endian header length, the JSON header,
+    padding out to a multiple of 64 bytes, then the array in C order. writeArray/openArray handle
+    that layout for any array and magic (climatology.py uses them too).
+'''
+
+import datetime
+import json
+import numpy as np
+import os
+import struct
+
+__author__ = 'Jason Godwin'
+__license__ = 'GPL'
+__maintainer__ = 'Jason Godwin'
+__email__ = 'jasonwgodwin@gmail.com'
+__status__ = 'Production'
+
+magic = b'GEFSCUBE'
+alignment = 64
+
+# writes a [site, member, lead, variable] array from the ingest (converted to the store's
+# [site, variable, member, lead] float32 layout) along with its metadata. members are the member
+# names (see runlayout.RunLayout.columns).
+def writeCube(filename,cube,vtimes,sites,variables,units,members=None):
+    data = np.ascontiguousarray(np.transpose(cube,(0,3,1,2)),dtype='<f4')
+    header = {'dims':['site','variable','member','lead'],'variables':list(variables),\
+        'units':[units[var] for var in variables],\
+        'sites':[dict((key,site[key]) for key in ['id','name','lat','lon']) for site in sites],\
+        'validtimes':[datetime.datetime.strftime(t,'%Y-%m-%dT%H:%M:%S') for t in vtimes],\
+        'members':list(members) if members is not None else memberNames(data.shape[2])}
+    writeArray(filename,header,data)
+
+# member names of a cube file (cube files from before the names were kept always had gep1 on)
+def memberNames(count,header=None):
+    if header is not None and 'members' in header:
+        return header['members']
+    return ['gep%d' % (member + 1) for member in range(count)]
+
+# writes an array behind a JSON header (plus its dtype and shape) with the given magic. The file
+# is written under a temporary name and renamed so readers never see a partial file.
+def writeArray(filename,header,data,filemagic=magic):
+    header = dict(header,dtype=data.dtype.str,shape=list(data.shape))
+    text = json.dumps(header).encode('utf-8')
+    offset = len(filemagic) + 4 + len(text)
+    padding = (alignment - offset % alignment) % alignment
+
+    tmpname = '%s.%d.tmp' % (filename,os.getpid())
+    with open(tmpname,'wb') as f:
+        f.write(filemagic)
+        f.write(struct.pack('<I',len(text)))
+        f.write(text)
+        f.write(b' ' * padding)
+        f.write(np.ascontiguousarray(data).tobytes())
+    os.replace(tmpname,filename)
+
+# reads just the header of a file written by writeArray. Returns the header dictionary and the
+# byte offset of the array.
+def readArrayHeader(filename,filemagic=magic):
+    with open(filename,'rb') as f:
+        if f.read(len(filemagic)) != filemagic:
+            raise ValueError('%s is not a %s file' % (filename,filemagic.decode('ascii')))
+        length = struct.unpack('<I',f.read(4))[0]
+        header = json.loads(f.read(length).decode('utf-8'))
+    offset = len(filemagic) + 4 + length
+    return header,offset + (alignment - offset % alignment) % alignment
+
+# opens a file written by writeArray and returns the header plus the array memory-mapped from
+# disk (mode 'r' for read only, 'r+' to change values in place)
+def openArray(filename,mode='r',filemagic=magic):
+    header,offset = readArrayHeader(filename,filemagic)
+    data = np.memmap(filename,dtype=header['dtype'],mode=mode,offset=offset,\
+        shape=tuple(header['shape']))
+    return header,data
+
+# reads just the header of a cube file. Returns the header dictionary (valid times converted to
+# datetimes) and the byte offset of the array.
+def readHeader(filename):
+    header,offset = readArrayHeader(filename)
+    header['validtimes'] = [datetime.datetime.strptime(t,'%Y-%m-%dT%H:%M:%S') \
+        for t in header['validtimes']]
+    return header,offset
+
+# opens a cube file and returns the header plus the [site, variable, member, lead] array memory-
+# mapped from disk (mode 'r' for read only, 'r+' to change values in place)
+def openCube(filename,mode='r'):
+    header,data = openArray(filename,mode)
+    header['validtimes'] = [datetime.datetime.strptime(t,'%Y-%m-%dT%H:%M:%S') \
+        for t in header['validtimes']]
+    return header,data
+
+# index of a location in a cube file's header by its id
+def siteIndex(header,siteid):
+    ids = [site['id'] for site in header['sites']]
+    if siteid not in ids:
+        raise KeyError('no location %s in the cube file' % siteid)
+    return ids.index(siteid)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+''' Rolling store of the last few cycles' cube files. Each run writes over its CSVs and plots,
+    and get_grib.sh deletes the GRIB files before the next one, so comparing runs used to mean
+    downloading and decoding them again. Instead, ensemblemeans.py and gefsstream.py add every
+    finished cycle's cube file (see cubestore.py) to a directory as cube_YYYYMMDDRR.bin, and
+    once there are more than capacity cycles the oldest ones are removed.
+
+    The stored cubes are memory-mapped, so products that look back over several runs never touch
+    GRIB files:
+
+        laggedCube   a time-lagged ensemble: every member of the last few cycles lined up on the
+                     newest cycle's valid times, so the older runs add members
+        dailyTrends  the ensemble mean daily high, low, dewpoint, and precipitation each cycle
+                     forecast for each day (dprog/dt), for the trend plots in htmlbuilder.py
+'''
+
+import numpy as np
+import os
+import pandas
+import re
+import shutil
+import warnings
+
+from cubestore import memberNames,openCube,readHeader
+from dailyaggregate import dailyCube,dailyvariables
+
+__author__ = 'Jason Godwin'
+__license__ = 'GPL'
+__maintainer__ = 'Jason Godwin'
+__email__ = 'jasonwgodwin@gmail.com'
+__status__ = 'Production'
+
+# cycle name (YYYYMMDDRR) of a cube file header
+def cycleName(header):
+    return header['validtimes'][0].strftime('%Y%m%d%H')
+
+# positions of wanted in have (-1 where missing) and a mask of the ones that were found
+def alignIndex(have,wanted):
+    index = pandas.Index(have).get_indexer(wanted)
+    return np.maximum(index,0),index >= 0
+
+class CycleStore(object):
+    ''' The cube files of the last capacity cycles in directory, oldest first. '''
+
+    def __init__(self,directory,capacity=8):
+        self.directory = directory
+        self.capacity = capacity
+
+    def filename(self,name):
+        return os.path.join(self.directory,'cube_%s.bin' % name)
+
+    # names (YYYYMMDDRR) of the stored cycles, oldest first
+    def cycles(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(match.group(1) for match in \
+            (re.match(r'cube_(\d{10})\.bin$',filename) for filename in os.listdir(self.directory)) \
+            if match is not None)
+
+    # copies a cube file into the store (replacing any earlier copy of the same cycle), then
+    # drops the oldest cycles past capacity. Returns the cycle's name.
+    def add(self,cubefile):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        name = cycleName(readHeader(cubefile)[0])
+        tmpname = '%s.%d.tmp' % (self.filename(name),os.getpid())
+        shutil.copyfile(cubefile,tmpname)
+        os.replace(tmpname,self.filename(name))
+        self.evict()
+        return name
+
+    # removes the oldest cycles until there are no more than capacity
+    def evict(self):
+        for name in self.cycles()[:-self.capacity] if self.capacity > 0 else self.cycles():
+            os.remove(self.filename(name))
+
+    # header and memory-mapped [site, variable, member, lead] array of a stored cycle
+    def open(self,name):
+        return openCube(self.filename(name))
+
+    # time-lagged ensemble from the newest count cycles for the locations with siteids. Every
+    # member of every cycle is lined up on the newest cycle's valid times, and the cycles' members
+    # are put side by side. Returns the valid times, the [site, variable, member, lead] array
+    # (NAN where a cycle doesn't reach a valid time or doesn't have a location or variable), and
+    # the member names (e.g. gep1_2017092700). None if the store is empty.
+    def laggedCube(self,siteids,variables,count=4):
+        names = self.cycles()[-count:][::-1]
+        if not names:
+            return None
+        vtimes = self.open(names[0])[0]['validtimes']
+        parts = []
+        columns = []
+        for name in names:
+            header,data = self.open(name)
+            siteix,sitefound = alignIndex([site['id'] for site in header['sites']],siteids)
+            varix,varfound = alignIndex(header['variables'],variables)
+            leadix,leadfound = alignIndex(header['validtimes'],vtimes)
+            values = np.asarray(data[siteix][:,varix][...,leadix],dtype=np.float32)
+            found = sitefound[:,np.newaxis,np.newaxis,np.newaxis] & \
+                varfound[np.newaxis,:,np.newaxis,np.newaxis] & leadfound
+            parts.append(np.where(found,values,np.nan))
+            columns += ['%s_%s' % (member,name) for member in memberNames(data.shape[2],header)]
+        return vtimes,np.concatenate(parts,axis=2),columns
+
+    # ensemble mean daily values that each of the newest count cycles forecast for every day
+    # (dprog/dt). tzs are the locations' time zones (see dailyaggregate.py). Returns a list with a
+    # dictionary for each location of [cycle, day] DataFrames, one per daily variable, indexed by
+    # each cycle's initial time with NAN for days a cycle didn't cover.
+    def dailyTrends(self,siteids,tzs,count=8):
+        names = self.cycles()[-count:]
+        means = dict((var,[]) for var in dailyvariables)
+        inittimes = []
+        for name in names:
+            header,data = self.open(name)
+            inittimes.append(header['validtimes'][0])
+            siteix,sitefound = alignIndex([site['id'] for site in header['sites']],siteids)
+            cyclemeans = dict((var,{}) for var in dailyvariables)
+            for tz in sorted(set(tzs)):
+                group = [ix for ix,sitetz in enumerate(tzs) if sitetz == tz]
+                daily = dailyCube(data[siteix[group]],header['variables'],header['validtimes'],tz)
+                with warnings.catch_warnings():
+                    warnings.simplefilter('ignore',RuntimeWarning)
+                    for var in dailyvariables:
+                        days,values = daily[var]
+                        values = np.where(sitefound[group][:,np.newaxis],\
+                            np.nanmean(values,axis=1),np.nan)
+                        cyclemeans[var][tz] = (group,days,values)
+            for var in dailyvariables:
+                means[var].append(cyclemeans[var])
+
+        # line every cycle up on the days any of them covered
+        trends = [dict() for siteid in siteids]
+        for var in dailyvariables:
+            alldays = pandas.DatetimeIndex(sorted(set(day for cyclemeans in means[var] \
+                for group,days,values in cyclemeans.values() for day in days)),name='Date')
+            table = np.full((len(siteids),len(names),len(alldays)),np.nan)
+            for c,cyclemeans in enumerate(means[var]):
+                for group,days,values in cyclemeans.values():
+                    dayix = alldays.get_indexer(days)
+                    table[np.ix_(group,[c],dayix)] = values[:,np.newaxis,:]
+            for ix in range(len(siteids)):
+                trends[ix][var] = pandas.DataFrame(table[ix],columns=alldays,\
+                    index=pandas.DatetimeIndex(inittimes,name='InitTime'))
+        return trends
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+''' Daily aggregation for htmlbuilder.py. Turns the 6-hourly (or 3-hourly) [site, variable,
+    member, lead] data into daily highs, lows, mean dewpoints, and precipitation totals for every
+    site and member at once. The lead times are binned into days once per set of valid times and
+    time zone, and each day is reduced with numpy's reduceat over the lead axis, so no Python code
+    runs per row, member, or site.
+
+    The max/min temperature and precipitation at a valid time cover the period since the lead
+    time before it (6 hours, or 3 for 3-hourly lead times), so they go in the day that holds the
+    middle of that period, and the initial time (which has no period) is left out. Dewpoint is a
+    value at the valid time and goes in that time's day. Days start at midnight UTC, or in the
+    site's own time zone (daytimezone in htmlbuilder.py, or a tz column in the station list). A
+    day missing any of its periods is dropped, so the first and last days of the run are only
+    kept if the run covers all of them, whatever the cycle hour.
+'''
+
+import numpy as np
+import pandas
+
+__author__ = 'Jason Godwin'
+__license__ = 'GPL'
+__maintainer__ = 'Jason Godwin'
+__email__ = 'jasonwgodwin@gmail.com'
+__status__ = 'Production'
+
+# how each daily variable is aggregated, and whether its values are for the period before the
+# valid time (True) or at the valid time (False)
+aggregations = {'max_temp':('max',True),'min_temp':('min',True),'dpt':('mean',False),\
+    'precip':('sum',True)}
+
+# variables aggregated to days, in the order htmlbuilder.py uses them
+dailyvariables = ['max_temp','min_temp','dpt','precip']
+
+# day bins already worked out, keyed by valid times, time zone, and period/instant
+_bins = {}
+
+# works out which day each lead time goes in. Returns the days (midnight, local time), the day
+# index of each lead time (-1 for the initial time of a period variable), and the hours of the day
+# each lead time covers: the time since the lead time before it for a period, or until the next
+# one for a value at the valid time (so runs that go from 3 to 6 hour steps partway through are
+# handled too).
+def dayBins(vtimes,tz='UTC',period=True):
+    key = (tuple(vtimes),tz,period)
+    if key in _bins:
+        return _bins[key]
+    times = pandas.DatetimeIndex(vtimes)
+    if len(times) > 1:
+        steps = np.diff(times.values).astype('timedelta64[s]').astype(float) / 3600.0
+        steps = np.concatenate([steps[0:1],steps] if period else [steps,steps[-1:]])
+    else:
+        steps = np.full(len(times),6.0)
+    if period:
+        times = times - pandas.to_timedelta(steps / 2,unit='h')
+    local = times.tz_localize('UTC').tz_convert(tz).tz_localize(None).normalize()
+
+    # the initial time has no period before it
+    used = np.arange(len(times)) >= (1 if period else 0)
+    days,inverse = np.unique(local.values[used],return_inverse=True)
+    bins = np.full(len(times),-1,dtype=int)
+    bins[used] = inverse
+    _bins[key] = (pandas.DatetimeIndex(days),bins,steps)
+    return _bins[key]
+
+# reduces the last (lead) axis of values to days: 'max', 'min', 'mean', or 'sum' over the lead
+# times in each bin from dayBins. Missing values are skipped, and a day with no values is NAN.
+def aggregateDays(values,how,bins):
+    used = np.nonzero(bins >= 0)[0]
+    values = np.asarray(values,dtype=float)[...,used]
+    if len(used) == 0:
+        return values
+    starts = np.concatenate([[0],np.nonzero(np.diff(bins[used]))[0] + 1])
+    valid = ~np.isnan(values)
+    counts = np.add.reduceat(valid,starts,axis=-1)
+    if how == 'max':
+        days = np.fmax.reduceat(values,starts,axis=-1)
+    elif how == 'min':
+        days = np.fmin.reduceat(values,starts,axis=-1)
+    elif how in ('sum','mean'):
+        days = np.add.reduceat(np.where(valid,values,0.0),starts,axis=-1)
+        if how == 'mean':
+            days = days / np.maximum(counts,1)
+    else:
+        raise ValueError('unknown daily aggregation: %s' % how)
+    return np.where(counts > 0,days,np.nan)
+
+# aggregates a [site, variable, member, lead] cube to days in one time zone. Returns a dictionary
+# of (days, [site, member, day] array) for each daily variable. Days missing any of their lead
+# times are dropped, where a lead time with no data at any site or member (e.g. past the end of a
+# run that was cut short) counts as missing.
+def dailyCube(cube,variables,vtimes,tz='UTC'):
+    daily = {}
+    for var in dailyvariables:
+        how,period = aggregations[var]
+        days,bins,steps = dayBins(vtimes,tz,period)
+        values = np.asarray(cube)[:,variables.index(var)]
+        present = (bins >= 0) & ~np.isnan(values).all(axis=(0,1))
+        complete = np.bincount(bins[present],weights=steps[present],minlength=len(days)) >= 24.0
+        daily[var] = (days[complete],aggregateDays(values,how,bins)[...,complete])
+    return daily
+
+# daily DataFrames ([day, member], one per daily variable) for every site in a
+# [site, variable, member, lead] cube. tzs is each site's time zone. Sites in the same time zone
+# are aggregated together. columns are the member names.
+def siteDaily(cube,variables,vtimes,tzs,columns):
+    sitedaily = [None] * len(tzs)
+    for tz in sorted(set(tzs)):
+        ixs = [ix for ix,sitetz in enumerate(tzs) if sitetz == tz]
+        daily = dailyCube(np.asarray(cube)[ixs],variables,vtimes,tz)
+        indexes = [pandas.DatetimeIndex(daily[var][0],name='Date') for var in dailyvariables]
+        for n,ix in enumerate(ixs):
+            sitedaily[ix] = tuple(pandas.DataFrame(np.transpose(daily[var][1][n]),index=index,\
+                columns=columns) for var,index in zip(dailyvariables,indexes))
+    return sitedaily
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+''' Run-to-run cache of the values pulled out of each GRIB file. Entries are keyed by a hash of
+    the file's contents plus the location/interpolation settings, so rerunning a cycle after a
+    partial failure (or reprocessing with the same station list) skips every file that has not
+    changed. The cache directory is trimmed back to a size limit at the end of each run, oldest
+    entries first.
+'''
+
+import hashlib
+import json
+import numpy as np
+import os
+
+__author__ = 'Jason Godwin'
+__license__ = 'GPL'
+__maintainer__ = 'Jason Godwin'
+__email__ = 'jasonwgodwin@gmail.com'
+__status__ = 'Production'
+
+# bump this whenever the extraction math changes so old entries are not reused
+cacheversion = 1
+
+# hash of a file's contents (read in 1 MB blocks)
+def fileDigest(filename):
+    digest = hashlib.sha1()
+    with open(filename,'rb') as f:
+        for block in iter(lambda: f.read(1 << 20),b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# hash of everything besides the file that changes what gets pulled out of it (domain is the map
+# domain, if the map fields are pulled out too)
+def configDigest(sitelats,sitelons,method,variables,domain=None):
+    config = [cacheversion,list(sitelats),list(sitelons),method,list(variables)]
+    if domain is not None:
+        config.append(list(domain))
+    return hashlib.sha1(json.dumps(config).encode('utf-8')).hexdigest()
+
+# cache key for one file under one configuration. The file's name goes in too: it says which
+# member and lead time the contents have to be for, so a copy under the wrong name isn't a hit.
+def cacheKey(filename,config):
+    return hashlib.sha1((fileDigest(filename) + os.path.basename(filename) + config)\
+        .encode('utf-8')).hexdigest()
+
+# path of a cache entry (spread over subdirectories so no single directory gets huge)
+def entryPath(cachedir,key):
+    return os.path.join(cachedir,key[0:2],key + '.npz')
+
+# returns the cached [variable, site] values, initial date/time, and map region (None if there
+# isn't one, see gefsingest.extractRegion) for a key, or None on a miss. Hits get their
+# modification time bumped so eviction drops the least recently used entries.
+def loadEntry(cachedir,key):
+    path = entryPath(cachedir,key)
+    try:
+        with np.load(path) as entry:
+            values = entry['values']
+            initinfo = tuple(str(x) for x in entry['initinfo'])
+            region = dict((name[7:],entry[name]) for name in entry.files \
+                if name.startswith('region_')) or None
+    except (IOError,ValueError,KeyError):
+        return None
+    os.utime(path,None)
+    return values,initinfo,region
+
+# saves the values (and map region) pulled out of a file (written to a temporary name and renamed
+# into place so workers sharing the cache never read half an entry)
+def storeEntry(cachedir,key,values,initinfo,region=None):
+    path = entryPath(cachedir,key)
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path),exist_ok=True)
+    tmpname = '%s.%d.tmp.npz' % (path[:-4],os.getpid())
+    arrays = dict(('region_' + name,array) for name,array in (region or {}).items())
+    np.savez(tmpname,values=values,initinfo=np.array(initinfo),**arrays)
+    os.replace(tmpname,path)
+
+# deletes the least recently used entries until the cache is no bigger than maxbytes. Returns the
+# number of entries removed.
+def evictCache(cachedir,maxbytes):
+    if not os.path.isdir(cachedir):
+        return 0
+    entries = []
+    for root,dirs,files in os.walk(cachedir):
+        for name in files:
+            path = os.path.join(root,name)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime,stat.st_size,path))
+
+    total = sum(size for mtime,size,path in entries)
+    removed = 0
+    for mtime,size,path in sorted(entries):
+        if total <= maxbytes:
+            break
+        os.remove(path)
+        total -= size
+        removed += 1
+    return removed
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+''' Registry of the variables the ingest can produce. Each variable says which GRIB fields
+    (shortName, level) it is computed from, in forecast files and in the analysis (f000) files,
+    and gives a formula that turns the raw values of those fields at the locations (numpy arrays,
+    GRIB units) into the variable in American units. Only the variables in products below are
+    produced, and everything else follows from them: downloader.py only fetches the records
+    those variables need, gefsingest.py only decodes those fields (each one once, however many
+    variables use it) and checks files for just those fields, and ensemblemeans.py writes a cube
+    variable and a CSV file for each one.
+
+    Adding a variable is a register() call below: its fields (with their wgrib inventory names in
+    inventorynames, if they aren't there already), its formula, units, QC limits, and CSV file.
+'''
+
+import numpy as np
+
+__author__ = 'Jason Godwin'
+__license__ = 'GPL'
+__maintainer__ = 'Jason Godwin'
+__email__ = 'jasonwgodwin@gmail.com'
+__status__ = 'Production'
+
+### USER SETTINGS BLOCK ###
+products = ['max_temp','min_temp','dpt','precip','snow','sleet','fzra','rain']  # variables to
+                                    # produce: htmlbuilder.py needs max_temp, min_temp, dpt, and
+                                    # precip, and the ensemblemeans.py plots use the first eight.
+                                    # Also available: heat_index, wind_chill, wind_speed, snowfall
+### END OF USER SETTINGS BLOCK ###
+
+# wgrib inventory variable and level of each GRIB field (shortName, level), for picking the
+# records out of the .idx files (see gribinventory.py)
+inventorynames = {('2t',2):('TMP','2 m above ground'),('2r',2):('RH','2 m above ground'),\
+    ('tmax',2):('TMAX','2 m above ground'),('tmin',2):('TMIN','2 m above ground'),\
+    ('10u',10):('UGRD','10 m above ground'),('10v',10):('VGRD','10 m above ground'),\
+    ('tp',0):('APCP','surface'),('csnow',0):('CSNOW','surface'),('cicep',0):('CICEP','surface'),\
+    ('cfrzr',0):('CFRZR','surface'),('crain',0):('CRAIN','surface')}
+
+# fields the gefsmaps.py regional maps are cut from in analysis (True) and forecast files (see
+# gefsingest.extractRegion)
+mapfields = {True:[('2t',2)],False:[('2t',2),('tp',0)]}
+
+### UNIT CONVERSIONS ###
+# convert temperature in Kelvin to degrees Fahrenheit
+def kelvinToFahrenheit(temperature):
+    return temperature * (9.0 / 5.0) - 459.67
+
+# convert temperature in Kelvin to degrees Celsius
+def kelvinToCelsius(temperature):
+    return temperature - 272.15
+
+# convert temperature in degrees Celsius to degrees Fahrenheit
+def celsiusToFahrenheit(temperature):
+    return 1.8 * temperature + 32.0
+
+# convert millimeters of rainfall to inches of rainfall
+def mmToInches(precipitation):
+    return precipitation * 0.0393701
+
+# convert meters per second to miles per hour
+def msToMph(speed):
+    return speed * 2.23694
+
+### FORMULAS ###
+# computes dewpoint from relative humidity and temperature
+def dewpointCalc(rh,tmp):
+    # first we have to get the saturation vapor pressure from the temperature
+    es = 6.11 * 10**((7.5 * tmp)/(237.3+tmp))
+    return (237.3 * np.log((es*rh)/611)) / (7.5 * np.log(10) - np.log((es*rh)/611))
+
+# dewpoint (F) from 2 m relative humidity (%) and temperature (K)
+def dewpointF(relh_pct,temp_k):
+    return celsiusToFahrenheit(dewpointCalc(relh_pct,kelvinToCelsius(temp_k)))
+
+# 10 m wind speed (mph) from the u and v components (m/s)
+def windSpeed(u_ms,v_ms):
+    return msToMph(np.hypot(u_ms,v_ms))
+
+# NWS heat index (F) from 2 m temperature (K) and relative humidity (%): Steadman's simple
+# formula, and the Rothfusz regression (with its low and high humidity adjustments) wherever that
+# comes out at 80 F or more
+def heatIndex(temp_k,relh_pct):
+    t = kelvinToFahrenheit(temp_k)
+    rh = relh_pct
+    simple = 0.5 * (t + 61.0 + (t - 68.0) * 1.2 + rh * 0.094)
+    full = -42.379 + 2.04901523 * t + 10.14333127 * rh - 0.22475541 * t * rh - \
+        6.83783e-3 * t**2 - 5.481717e-2 * rh**2 + 1.22874e-3 * t**2 * rh + \
+        8.5282e-4 * t * rh**2 - 1.99e-6 * t**2 * rh**2
+    with np.errstate(invalid='ignore'):
+        full -= np.where((rh < 13.0) & (t >= 80.0) & (t <= 112.0),\
+            (13.0 - rh) / 4.0 * np.sqrt(np.clip(17.0 - np.abs(t - 95.0),0.0,None) / 17.0),0.0)
+    full += np.where((rh > 85.0) & (t >= 80.0) & (t <= 87.0),(rh - 85.0) / 10.0 * \
+        (87.0 - t) / 5.0,0.0)
+    return np.where(0.5 * (simple + t) >= 80.0,full,simple)
+
+# NWS wind chill (F) from 2 m temperature (K) and the 10 m wind components (m/s). Only defined at
+# 50 F or colder with more than 3 mph of wind, otherwise the temperature itself.
+def windChill(temp_k,u_ms,v_ms):
+    t = kelvinToFahrenheit(temp_k)
+    v = windSpeed(u_ms,v_ms)
+    power = np.power(np.maximum(v,3.0),0.16)
+    chill = 35.74 + 0.6215 * t - 35.75 * power + 0.4275 * t * power
+    return np.where((t <= 50.0) & (v > 3.0),chill,t)
+
+# snowfall (in) from 6-hour precipitation (mm), the categorical snow flag, and 2 m temperature
+# (K): the liquid falling as snow times a snow-to-liquid ratio from Kuchera's formula, with the
+# 2 m temperature standing in for the warmest temperature in the column
+def snowfall(precip_mm,catsnow,temp_k):
+    ratio = np.where(temp_k > 271.16,12.0 + 2.0 * (271.16 - temp_k),12.0 + (271.16 - temp_k))
+    return mmToInches(precip_mm) * catsnow * np.clip(ratio,0.0,None)
+
+# unchanged values (the categorical precipitation type flags are already 0 or 1)
+def flagValue(flag):
+    return flag
+
+class DerivedVariable(object):
+    ''' A variable the ingest can produce. fields are the (shortName, level) fields formula takes
+        from a forecast file, in order, and analysisfields the ones it takes from an analysis
+        file. With no analysisfields (the 6-hour precipitation and type flags) the variable is 0
+        at the initial time. Values outside qc (min, max) are set to NAN. csvfile is the per
+        location CSV file ensemblemeans.py writes the variable to (None = no CSV file).
+    '''
+
+    def __init__(self,name,units,fields,formula,analysisfields=None,qc=None,csvfile=None):
+        self.name = name
+        self.units = units
+        self.fields = list(fields)
+        self.formula = formula
+        self.analysisfields = list(analysisfields) if analysisfields is not None else None
+        self.qc = qc
+        self.csvfile = csvfile
+
+    # fields needed from an analysis (True) or forecast file
+    def needs(self,analysis):
+        if not analysis:
+            return self.fields
+        return self.analysisfields if self.analysisfields is not None else []
+
+    # the variable at count locations from a dictionary of their raw values by (shortName,
+    # level), QCed
+    def compute(self,raw,analysis,count):
+        if analysis and self.analysisfields is None:
+            return np.zeros(count)
+        values = self.formula(*[raw[key] for key in self.needs(analysis)])
+        if self.qc is not None:
+            lo,hi = self.qc
+            values = np.where((values > hi) | (values < lo),np.nan,values)
+        return values
+
+# every variable that can be produced, by name
+registry = {}
+
+# adds a variable to the registry (see DerivedVariable)
+def register(name,units,fields,formula,analysisfields=None,qc=None,csvfile=None):
+    registry[name] = DerivedVariable(name,units,fields,formula,analysisfields,qc,csvfile)
+
+# the initial time only has the instantaneous fields, so its max/min temperature is the 2 m
+# temperature and nothing has accumulated yet
+register('max_temp','F',[('tmax',2)],kelvinToFahrenheit,[('2t',2)],(-100.0,150.0),'maxtemps.csv')
+register('min_temp','F',[('tmin',2)],kelvinToFahrenheit,[('2t',2)],(-100.0,150.0),'mintemps.csv')
+register('dpt','F',[('2r',2),('2t',2)],dewpointF,[('2r',2),('2t',2)],(-50.0,100.0),'dewpoint.csv')
+register('precip','in',[('tp',0)],mmToInches,csvfile='precip.csv')
+register('snow','flag',[('csnow',0)],flagValue)
+register('sleet','flag',[('cicep',0)],flagValue)
+register('fzra','flag',[('cfrzr',0)],flagValue)
+register('rain','flag',[('crain',0)],flagValue)
+register('heat_index','F',[('2t',2),('2r',2)],heatIndex,[('2t',2),('2r',2)],(-100.0,200.0),\
+    'heatindex.csv')
+register('wind_chill','F',[('2t',2),('10u',10),('10v',10)],windChill,\
+    [('2t',2),('10u',10),('10v',10)],(-150.0,150.0),'windchill.csv')
+register('wind_speed','mph',[('10u',10),('10v',10)],windSpeed,[('10u',10),('10v',10)],\
+    (0.0,250.0),'windspeed.csv')
+register('snowfall','in',[('tp',0),('csnow',0),('2t',2)],snowfall,qc=(0.0,100.0),\
+    csvfile='snowfall.csv')
+
+# the registry entries for a list of variable names (raises ValueError for unknown names)
+def lookup(names):
+    unknown = [name for name in names if name not in registry]
+    if unknown:
+        raise ValueError('unknown variable(s) %s (known: %s)' % (','.join(unknown),\
+            ','.join(sorted(registry))))
+    return [registry[name] for name in names]
+
+# (shortName, level) of every field the variables with names need from an analysis (True) or
+# forecast file, each one once, in the order they are first needed
+def requiredFields(names,analysis):
+    fields = []
+    for variable in lookup(names):
+        fields += [key for key in variable.needs(analysis) if key not in fields]
+    return fields
+
+# (variable, level) inventory names of the fields to download for the variables with names (plus
+# the gefsmaps.py map fields with maps) from an analysis (True) or forecast file
+def downloadFields(names,analysis,maps=False):
+    fields = requiredFields(names,analysis)
+    if maps:
+        fields += [key for key in mapfields[analysis] if key not in fields]
+    return [inventorynames[key] for key in fields]
+
+# units of each of the variables with names
+def variableUnits(names):
+    return dict((variable.name,variable.units) for variable in lookup(names))
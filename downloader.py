@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+''' Downloads the GEFS GRIB fields used by ensemblemeans.py. Replaces the get_inv.pl/get_grib.pl
+    loop in get_grib.sh: for each member and lead time, the .idx inventory is read, the byte
+    ranges of the fields we need are pulled from the GRIB file (planned by gribinventory.py, several
+    ranges per request), and the result is written to grib_gefs_YYYYMMDD_RR_FFF_PP. Files are
+    downloaded concurrently over a pool of threads, each of which keeps its own HTTP connection
+    open between requests. Failed requests are retried with an increasing delay, and each file is
+    written under a temporary name and renamed into place when it is complete, so the GRIB
+    directory never holds half a file.
+
+    usage: python downloader.py YYYYMMDD RR GRIBDIR [--connections N] [--baseurl URL]
+                                [--gap BYTES] [--maxranges N] [--metricsdir DIR] [--profile]
+'''
+
+import argparse
+import concurrent.futures
+import http.client
+import os
+import sys
+import threading
+import time
+import urllib.parse
+
+from derivedvars import downloadFields,products
+from gribinventory import cutRecords,parseInventory,planRequests,rangeHeader,responseParts,\
+    selectFields
+from runlayout import RunLayout,memberName
+from runmetrics import RunMetrics
+
+__author__ = 'Jason Godwin'
+__license__ = 'GPL'
+__maintainer__ = 'Jason Godwin'
+__email__ = 'jasonwgodwin@gmail.com'
+__status__ = 'Production'
+
+### USER SETTINGS BLOCK ###
+baseurl = 'https://www.ftp.ncep.noaa.gov/data/nccf/com/gens/prod'   # NCEP GEFS directory
+gribpath = 'gefs.{date}/{run}/pgrb2/{member}.t{run}z.pgrb2f{hour:02d}'  # GRIB file under baseurl
+# e.g. 'gefs.{date}/{run}/atmos/pgrb2ap5/{member}.t{run}z.pgrb2a.0p50.f{hour:03d}' for the
+# current 0.5 degree GEFS or '.../pgrb2sp25/{member}.t{run}z.pgrb2s.0p25.f{hour:03d}' for 0.25
+connections = 8                     # number of files to download at the same time
+retries = 4                         # number of times to retry a failed request
+backoff = 2.0                       # seconds to wait before the first retry (doubles each retry)
+timeout = 60.0                      # seconds to wait on a stalled connection
+gap = 0                             # fetch up to this many unneeded bytes to save a byte range
+maxranges = 8                       # byte ranges per request (1 = a request for every range)
+fetchmaps = True                    # also fetch the fields for the gefsmaps.py maps (2 m
+                                    # temperature and precipitation) when no variable needs them
+### END OF USER SETTINGS BLOCK ###
+
+# one open HTTP connection per thread and host
+_connections = threading.local()
+
+# url of the GRIB file for one member and lead time (the .idx inventory is the same plus .idx).
+# The member is gec00 for the control run and gep01 on for the others.
+def gribUrl(date,run,hour,pert,baseurl=baseurl,gribpath=gribpath):
+    return '%s/%s' % (baseurl,gribpath.format(date=date,run=run,hour=hour,\
+        member=memberName(pert)))
+
+# local filename for one member and lead time - ensemblemeans.py parses the hour and member out of
+# the last characters, so this has to stay grib_gefs_YYYYMMDD_RR_FFF_PP
+def gribFilename(date,run,hour,pert):
+    return 'grib_gefs_%s_%s_%03d_%02d' % (date,run,hour,pert)
+
+# returns an open connection for this thread to the url's host, reusing it if it is still around
+def getConnection(url):
+    parts = urllib.parse.urlsplit(url)
+    key = (parts.scheme,parts.netloc)
+    pool = getattr(_connections,'pool',None)
+    if pool is None:
+        pool = _connections.pool = {}
+    if key not in pool:
+        if parts.scheme == 'https':
+            pool[key] = http.client.HTTPSConnection(parts.netloc,timeout=timeout)
+        else:
+            pool[key] = http.client.HTTPConnection(parts.netloc,timeout=timeout)
+    return pool[key]
+
+# throws away this thread's connection to the url's host (after an error, so the next try starts
+# with a fresh one)
+def dropConnection(url):
+    parts = urllib.parse.urlsplit(url)
+    pool = getattr(_connections,'pool',{})
+    conn = pool.pop((parts.scheme,parts.netloc),None)
+    if conn is not None:
+        conn.close()
+
+# makes a GET request (optionally with a Range header value, see gribinventory.rangeHeader) over a
+# kept-alive connection and returns the status, response headers, and body. Connection problems
+# and server errors are retried with an increasing delay.
+def fetch(url,byterange=None,retries=retries,backoff=backoff):
+    parts = urllib.parse.urlsplit(url)
+    path = parts.path + ('?' + parts.query if parts.query else '')
+    headers = {'Connection':'keep-alive'}
+    if byterange is not None:
+        headers['Range'] = byterange
+
+    delay = backoff
+    for attempt in range(retries + 1):
+        try:
+            conn = getConnection(url)
+            conn.request('GET',path,headers=headers)
+            response = conn.getresponse()
+            body = response.read()
+            if response.will_close:
+                dropConnection(url)
+            if response.status < 500:
+                return response.status,response.headers,body
+            error = 'HTTP %d' % response.status
+        except (http.client.HTTPException,OSError) as err:
+            dropConnection(url)
+            error = str(err)
+        if attempt < retries:
+            print('%s: %s, retrying in %.0f s' % (url,error,delay))
+            time.sleep(delay)
+            delay *= 2.0
+    raise IOError('%s: %s after %d tries' % (url,error,retries + 1))
+
+# writes data to filename atomically (temporary file in the same directory, then rename)
+def atomicWrite(filename,chunks):
+    tmpname = '%s.part' % filename
+    with open(tmpname,'wb') as f:
+        for chunk in chunks:
+            f.write(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmpname,filename)
+
+# downloads the fields we need for one member and lead time into gribdir: the ones the variables
+# enabled in derivedvars.py need (plus the map fields with fetchmaps). Returns the path of the
+# new file, or None if the file is not on the server (yet). gap and maxranges are passed to
+# gribinventory.planRequests.
+def downloadFile(date,run,hour,pert,gribdir,baseurl=baseurl,gap=gap,maxranges=maxranges):
+    url = gribUrl(date,run,hour,pert,baseurl)
+    status,headers,body = fetch(url + '.idx')
+    if status != 200:
+        print('%s.idx: HTTP %d, skipping' % (url,status))
+        return None
+
+    fields = downloadFields(products,hour == 0,fetchmaps)
+    records = selectFields(parseInventory(body.decode('ascii','replace')),fields)
+    if len(records) == 0:
+        print('%s: no matching grib fields' % url)
+        return None
+    plan = planRequests(records,gap,maxranges)
+    print('%s: %d records, %d bytes in %d requests (%d extra)' % (url,len(records),\
+        plan['planned'],len(plan['requests']),plan['extra']))
+
+    # pull the planned ranges, then cut the records back out of them (dropping anything fetched
+    # in between) and write them out together
+    parts = []
+    for ranges in plan['requests']:
+        status,headers,body = fetch(url,rangeHeader(ranges))
+        if status not in (200,206):
+            raise IOError('%s: HTTP %d' % (url,status))
+        parts += responseParts(status,headers,body)
+    try:
+        chunks = cutRecords(parts,records)
+    except ValueError as err:
+        raise IOError('%s: %s' % (url,err))
+
+    filename = os.path.join(gribdir,gribFilename(date,run,hour,pert))
+    atomicWrite(filename,chunks)
+    return filename
+
+# downloads every member and lead time for a run, connections files at a time (earliest lead
+# times first). Returns the list of files written. If onfile is given, it is called with the path
+# of each file as soon as that file is complete (gefsstream.py uses this to start processing
+# before the whole run is down). hours and perts default to the run layout in runlayout.py.
+def downloadRun(date,run,gribdir,hours=None,perts=None,\
+    connections=connections,baseurl=baseurl,onfile=None,gap=gap,maxranges=maxranges):
+    hours = hours if hours is not None else RunLayout().hours
+    perts = perts if perts is not None else RunLayout().perts
+    if not os.path.isdir(gribdir):
+        os.makedirs(gribdir)
+    jobs = [(date,run,hour,pert,gribdir,baseurl,gap,maxranges) for hour in hours for pert in perts]
+
+    files = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=connections) as executor:
+        futures = dict((executor.submit(downloadFile,*job),job) for job in jobs)
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                filename = future.result()
+            except IOError as err:
+                print('download failed: %s' % err)
+                continue
+            if filename is not None:
+                print(filename)
+                files.append(filename)
+                if onfile is not None:
+                    onfile(filename)
+    return sorted(files)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Download GEFS GRIB files for one run.')
+    parser.add_argument('date',help='run date (YYYYMMDD)')
+    parser.add_argument('run',help='run hour (00, 06, 12, or 18)')
+    parser.add_argument('gribdir',help='directory to save the GRIB files')
+    parser.add_argument('--connections',type=int,default=connections,\
+        help='number of files to download at the same time')
+    parser.add_argument('--baseurl',default=baseurl,help='base url of the GEFS data')
+    parser.add_argument('--gap',type=int,default=gap,\
+        help='merge byte ranges with no more than this many bytes between them')
+    parser.add_argument('--maxranges',type=int,default=maxranges,help='byte ranges per request')
+    parser.add_argument('--metricsdir',help='directory for the per-cycle timing metrics')
+    parser.add_argument('--profile',action='store_true',\
+        help='also write a flamegraph stack profile to the metrics directory')
+    args = parser.parse_args()
+
+    metrics = RunMetrics('downloader',profile=args.profile and args.metricsdir is not None)
+    start = time.time()
+    with metrics.stage('download'):
+        files = downloadRun(args.date,args.run,args.gribdir,connections=args.connections,\
+            baseurl=args.baseurl,gap=args.gap,maxranges=args.maxranges)
+        metrics.addBytes(written=sum(os.path.getsize(f) for f in files))
+    print('downloaded %d files in %.1f s' % (len(files),time.time() - start))
+    if args.metricsdir is not None:
+        metrics.write(args.metricsdir,args.date + args.run)
+    sys.exit(0 if files else 1)
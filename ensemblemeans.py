@@ -1,8 +1,11 @@
 #!/usr/bin/env python
 ''' Ingests GEFS GRIB data and stores high and low temperature data, precipitation data, and
     dewpoint data for a user-specified location. Creates some plots of 6-hourly forecast
-    information, then writes out CSV files containing high/low temperature, precipitation,
-    and dewpoint data for each ensemble member for use in htmlbuilder.py.
+    information, then writes out a binary cube file (and optionally CSV files) containing
+    high/low temperature, precipitation, dewpoint, and precipitation type data for each
+    ensemble member for use in htmlbuilder.py. Given a station list, every location is pulled
+    out of the same pass over the GRIB files. With a map domain set in gefsmaps.py, regional
+    ensemble mean/spread/probability maps are made from the same pass too.
 '''
 
 import datetime
@@ -11,10 +14,19 @@ matplotlib.use('Agg')
 import matplotlib.dates as mdates
 import matplotlib.pyplot as plt
 import numpy as np
-import pandas
 import os
-import pygrib
-import time
+import pandas
+
+import gefsmaps
+from cubestore import writeCube
+from cyclestore import CycleStore
+from derivedvars import registry
+from ensemblestats import EnsembleStats
+from gefsingest import ingest,units,validTimes,variables
+from renderpool import renderJobs
+from runlayout import discoverLayout
+from runmetrics import RunMetrics
+from stations import loadSites
 
 __author__ = 'Jason Godwin'
 __license__ = 'GPL'
@@ -22,45 +34,165 @@ __maintainer__ = 'Jason Godwin'
 __email__ = 'jasonwgodwin@gmail.com'
 __status__ = 'Production'
 
-# converts the user input longitude to the coordinate system used in the GRIB files
-def lonConvert(longitude):
-    # -180 to 0 is between 180 and 360
-    if longitude < 0:
-        return 360.0 + longitude
-    # 0 to 180 are the same
-    else:
-        return longitude
-
-# gets the correct valid times for each GRIB file
-def validTimes(initdate,inithour):
-    date = datetime.datetime.strptime(initdate,'%Y%m%d')
-    # make sure the initial time is four digits
-    if len(inithour) < 4:
-        inithour = "0" + inithour
-    runinit = date + datetime.timedelta(hours=float(inithour[0:2]))
-    return [runinit + datetime.timedelta(hours=x) for x in range(0,385,6)]
-
-# convert temperature in Kelvin to degrees Fahrenheit
-def kelvinToFahrenheit(temperature):
-    return temperature * (9.0 / 5.0) - 459.67
-
-# convert temperature in Kelvin to degrees Celsius
-def kelvinToCelsius(temperature):
-    return temperature - 272.15
-
-# convert temperature in degrees Celsius to degrees Fahrenheit
-def celsiusToFahrenheit(temperature):
-    return 1.8 * temperature + 32.0
-
-# computes dewpoint from relative humidity and temperature
-def dewpointCalc(rh,tmp):
-    # first we have to get the saturation vapor pressure from the temperature
-    es = 6.11 * 10**((7.5 * tmp)/(237.3+tmp))
-    return (237.3 * np.log((es*rh)/611)) / (7.5 * np.log(10) - np.log((es*rh)/611))
-
-# convert millimeters of rainfall to inches of rainfall
-def mmToInches(precipitation):
-    return precipitation * 0.0393701
+### ENSEMBLE MEAN PLOTS ###
+# ensemble mean 6-hourly max/min temperature (ensmean_temp.png)
+def tempPlot(vtimes,max_ensmean,min_ensmean,locname,inittime,savestr):
+    plt.clf()
+    fig = plt.figure(figsize=(12,8))
+    ax = fig.add_subplot(1,1,1)
+    plt.plot(vtimes,max_ensmean,color='r',label='Max Temperature')
+    plt.plot(vtimes,min_ensmean,color='b',label='Min Temperature')
+    plt.grid(which='major',linestyle='-',color='black')
+    plt.grid(which='minor',linestyle='--',color='gray')
+
+    # x axis settings
+    plt.xticks(rotation=90)
+    plt.xlabel('Date/Time (UTC)',fontsize=14)
+    plt.xlim([np.min(vtimes),np.max(vtimes)])
+    ax.xaxis.set_major_locator(mdates.HourLocator(interval=24))
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%d/%H'))
+    ax.xaxis.set_minor_locator(mdates.HourLocator(interval=6))
+
+    # y axis and title
+    plt.yticks(np.arange(0,110,5))
+    plt.ylim([0,110])
+    plt.ylabel('Temperature (degrees Fahrenheit)',fontsize=14)
+    plt.title('GEFS Ensemble Mean 6-Hourly Temperature for %s (init: %s)' % (locname,inittime),\
+        fontsize=16)
+    plt.legend(loc='upper right',fontsize=12)
+    plt.savefig(savestr,bbox_inches='tight')
+    plt.close(fig)
+
+# ensemble mean 6-hourly and run-accumulated precipitation (ensmean_precip.png)
+def precipPlot(vtimes,precip_ensmean,locname,inittime,savestr):
+    fig = plt.figure(figsize=(12,8))
+    ax = fig.add_subplot(1,1,1)
+    plt.bar(vtimes,precip_ensmean,width=0.25,color='g',align='center',label='6-Hour Precipitation')
+    plt.plot(vtimes,np.cumsum(precip_ensmean),color='b',label='Run-Accumulated Precipitation')
+    plt.grid(which='major',linestyle='-',color='black')
+    plt.grid(which='minor',linestyle='--',color='gray')
+
+    # x axis settings
+    plt.xticks(rotation=90)
+    plt.xlabel('Date/Time (UTC)',fontsize=14)
+    plt.xlim([np.min(vtimes),np.max(vtimes)])
+    ax.xaxis.set_major_locator(mdates.HourLocator(interval=24))
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%d/%H'))
+    ax.xaxis.set_minor_locator(mdates.HourLocator(interval=6))
+
+    # y axis and title
+    plt.yticks([0,0.1,0.25,0.50,1,2,3,4])
+    plt.ylim([0,4])
+    plt.ylabel('Precipitation (inches)',fontsize=14)
+    plt.title('GEFS Ensemble Mean Precipitation for %s (init: %s)' % (locname,inittime),fontsize=16)
+    plt.legend(loc='upper left',fontsize=12)
+    plt.savefig(savestr,bbox_inches='tight')
+    plt.close(fig)
+
+# ensemble mean 6-hourly dewpoint (ensmean_dwpt.png)
+def dewpointPlot(vtimes,dpt_ensmean,locname,inittime,savestr):
+    fig = plt.figure(figsize=(12,8))
+    ax = fig.add_subplot(1,1,1)
+    plt.plot(vtimes,dpt_ensmean,color='g',label='Dewpoint')
+    plt.grid(which='major',linestyle='-',color='black')
+    plt.grid(which='minor',linestyle='--',color='gray')
+
+    # x axis settings
+    plt.xticks(rotation=90)
+    plt.xlabel('Date/Time (UTC)',fontsize=14)
+    plt.xlim([np.min(vtimes),np.max(vtimes)])
+    ax.xaxis.set_major_locator(mdates.HourLocator(interval=24))
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%d/%H'))
+    ax.xaxis.set_minor_locator(mdates.HourLocator(interval=6))
+
+    # y axis and title
+    plt.ylim([20,85])
+    plt.yticks(np.arange(20,85,5))
+    plt.ylabel('Dewpoint Temperature (F)',fontsize=14)
+    plt.title('GEFS Ensemble Mean 6-Hourly Dewpoint for %s (init: %s)' % (locname,inittime),fontsize=16)
+    plt.legend(loc='upper right',fontsize=12)
+    plt.savefig(savestr,bbox_inches='tight')
+    plt.close(fig)
+
+# fraction of members with each categorical precipitation type (ptype.png)
+def ptypePlot(vtimes,snowmems,sleetmems,fzramems,rainmems,locname,inittime,savestr):
+    fig = plt.figure(figsize=(12,8))
+    ax = fig.add_subplot(1,1,1)
+    plt.bar(vtimes,snowmems,width=0.25,color='b',label='Snow',align='center')
+    plt.bar(vtimes,sleetmems,width=0.25,color='y',label='Sleet',align='center',bottom=snowmems)
+    plt.bar(vtimes,fzramems,width=0.25,color='r',label='Freezing Rain',align='center',\
+        bottom=snowmems+sleetmems)
+    plt.bar(vtimes,rainmems,width=0.25,color='g',label='Liquid Rain',align='center',\
+        bottom=snowmems+sleetmems+fzramems)
+
+    # grid
+    plt.grid(which='major',linestyle='-',color='black')
+    plt.grid(which='minor',linestyle='--',color='gray')
+
+    # x axis
+    plt.xticks(rotation=90)
+    plt.xlabel('Date/Time (UTC)',fontsize=14)
+    plt.xlim([np.min(vtimes),np.max(vtimes)])
+    ax.xaxis.set_major_locator(mdates.HourLocator(interval=24))
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%d/%H'))
+    ax.xaxis.set_minor_locator(mdates.HourLocator(interval=6))
+
+    # y axis and title
+    plt.ylim([0,1])
+    plt.yticks(np.arange(0,1,0.1))
+    plt.ylabel('Percent of Members',fontsize=14)
+    vals = ax.get_yticks()
+    ax.set_yticklabels(['{:.0f}%'.format(x*100) for x in vals])
+
+    plt.title('GEFS Categorical Precipitation Type for %s (init: %s)' % (locname,inittime),fontsize=16)
+    plt.legend(loc='upper right',fontsize='12')
+    plt.savefig(savestr,bbox_inches='tight')
+    plt.close(fig)
+
+# ensemble mean plots: the plot function, the ensemble statistic and variables it plots, in its
+# argument order ('fraction' is the fraction of members with a precipitation type flag set), and
+# the file it writes
+meanplots = [(tempPlot,'mean',['max_temp','min_temp'],'ensmean_temp.png'),\
+    (precipPlot,'mean',['precip'],'ensmean_precip.png'),\
+    (dewpointPlot,'mean',['dpt'],'ensmean_dwpt.png'),\
+    (ptypePlot,'fraction',['snow','sleet','fzra','rain'],'ptype.png')]
+
+# computes the ensemble means and (optionally) writes the CSV files for one location, and returns
+# the plot jobs for its ensemble mean plots. data is the [member, lead, variable] slice of the
+# ingest cube for the location and columns are the member names for the CSVs (gep1, gep2, ... if
+# not given). Plots whose variables aren't enabled (see derivedvars.py) are left out.
+def siteProducts(data,vtimes,locname,savedir,writecsv=True,stats=None,columns=None):
+    # ensemble mean of each variable and the fraction of members with each precipitation type at
+    # every forecast hour (stats is a [lead, variable] EnsembleStats summary, computed here if
+    # it was not already done for every site at once)
+    if stats is None:
+        stats = EnsembleStats(data,memberaxis=0).summary()
+
+    # initial time information
+    inittime = datetime.datetime.strftime(vtimes[0],'%m/%d %H') + '00 UTC'
+
+    # plot jobs for the ensemble mean plots (run by renderpool.renderJobs)
+    jobs = []
+    for function,statistic,names,filename in meanplots:
+        if all(name in variables for name in names):
+            jobs.append((function,tuple([vtimes] + [stats[statistic][:,variables.index(name)] \
+                for name in names] + [locname,inittime,'%s/%s' % (savedir,filename)])))
+
+    # the CSVs are an optional side output now that htmlbuilder.py reads the cube file
+    if not writecsv:
+        return jobs
+
+    # write ensemble member information to a CSV file for each variable that has one
+    column_headers = columns if columns is not None else \
+        [str('gep' + str(x)) for x in range(1,np.shape(data)[0] + 1)]
+    for var in variables:
+        if registry[var].csvfile is None:
+            continue
+        df = pandas.DataFrame(np.transpose(data[:,:,variables.index(var)]),index=vtimes,\
+            columns=column_headers)
+        df.index.name = 'ValidTime'
+        df.to_csv('%s/%s' % (savedir,registry[var].csvfile))
+    return jobs
 
 ### USER SETTINGS BLOCK ###
 savedir = '/home/jgodwin/Documents/python/python/gefs-plots'            # directory to save output
@@ -68,279 +200,71 @@ directory = '/home/jgodwin/Documents/python/python/gefs-plots/grib/'    # locati
 mylat = 32.896944                   # latitude (decimal degrees, negative for southern hemisphere)
 mylon = -97.038056                  # longitude (decimal degrees, negative for western hemisphere)
 locname = 'Dallas/Fort Worth, TX'   # name for location
+stationfile = None                  # CSV/JSON station list (overrides mylat/mylon/locname)
 testmode = False                    # set to True to run for the first 24 hours only
+nworkers = 1                        # number of ingest processes (1 = serial, useful for debugging)
+interpolation = 'nearest'           # 'nearest' grid point or 'bilinear' interpolation to locations
+gridcache = savedir + '/gridcache'  # where grid index weights are saved between runs (None = off)
+decodecache = savedir + '/decodecache'  # cache of the values pulled from each file (None = off)
+cachesize = 500                     # maximum size of the decode cache (MB)
+cubefile = savedir + '/gefs_cube.bin'   # binary file with every variable for htmlbuilder.py
+cycledir = savedir + '/cycles'      # copies of the last few cycles' cube files (None = off)
+keepcycles = 8                      # number of cycles kept in cycledir
+writecsv = True                     # also write the per-location CSV files
+renderworkers = 1                   # number of plot rendering processes (1 = serial)
+plotcache = savedir + '/plotcache'  # rendered plots reused when their inputs repeat (None = off)
+plotcachesize = 200                 # maximum size of the plot cache (MB)
+lowmemory = False                   # hold one decoded field at a time and keep the data in float32
+memoryceiling = None                # memory limit for the ingest (MB, None = no limit)
+metricsdir = savedir + '/metrics'   # where the per-cycle timing/memory metrics go (None = off)
+profile = False                     # also write a flamegraph stack profile to metricsdir
 ### END OF USER SETTINGS BLOCK ###
 
-# create empty arrays (20 perturbations, 65 valid times)
-max_temp = np.empty([20,65])    # maximum temperature
-min_temp = np.empty([20,65])    # minimum temperature
-dpt = np.empty([20,65])         # dewpoint
-precip = np.empty([20,65])      # precipitation amount
-snow = np.empty([20,65])        # categorical snow flag
-sleet = np.empty([20,65])       # categorical sleet flag
-fzra = np.empty([20,65])        # categorical freezing rain flag
-rain = np.empty([20,65])        # categorical liquid rain flag
-
-# default everything to NAN
-min_temp[:,:] = np.NAN
-max_temp[:,:] = np.NAN
-dpt[:,:] = np.NAN
-precip[:,:] = np.NAN
-snow[:,:] = np.NAN
-sleet[:,:] = np.NAN
-fzra[:,:] = np.NAN
-rain[:,:] = np.NAN
-
-# loop through each GRIB file
-for ix,filename in enumerate(sorted(os.listdir(directory))):
-    print(filename)
-    # get the perturbation and valid hour from the filename
-    pert = float(filename[-2:]) - 1.0
-    hour = float(filename[-6:-3]) / 6.0
-
-    # open the grib file
-    grbs = pygrib.open(directory + filename)
-
-    # check for missing/bad files
-    if os.stat(directory + filename).st_size < 40000:
-        max_temp[int(pert)][int(hour)] = float('nan')
-        min_temp[int(pert)][int(hour)] = float('nan')
-        dpt[int(pert)][int(hour)] = float('nan')
-        precip[int(pert)][int(hour)] = float('nan')
-        snow[int(pert)][int(hour)] = float('nan')
-        sleet[int(pert)][int(hour)] = float('nan')
-        fzra[int(pert)][int(hour)] = float('nan')
-        rain[int(pert)][int(hour)] = float('nan')
-        continue
-
-    # get the data
-    if '_000_' in filename:
-        # temperature data (K) - same as temperature for initial time
-        max_temp_k = grbs.select(name='2 metre temperature')[0].values
-        min_temp_k = max_temp_k
-        temp_k = max_temp_k
-        # relative humidity (%)
-        relh_pct = grbs.select(name='2 metre relative humidity')[0].values
-        # precipitation (mm) - zero for initial time
-        precip_mm = np.zeros(np.shape(max_temp_k))
-        # categorical precipitation flags
-        catsnow = np.zeros(np.shape(max_temp_k))
-        catsleet = np.zeros(np.shape(max_temp_k))
-        catfzra = np.zeros(np.shape(max_temp_k))
-        catrain = np.zeros(np.shape(max_temp_k))
-        # latitude and longitude
-        lats,lons = grbs.select(name='2 metre temperature')[0].latlons()
-    else:
-        # temperature data (K)
-        max_temp_k = grbs.select(name='Maximum temperature')[0].values
-        min_temp_k = grbs.select(name='Minimum temperature')[0].values
-        temp_k = grbs.select(name='2 metre temperature')[0].values
-        # relative humidity (%)
-        relh_pct = grbs.select(name='2 metre relative humidity')[0].values
-        # precipitation (mm)
-        precip_mm = grbs.select(name='Total Precipitation')[0].values
-        # categorical precipitation flags
-        catsnow = grbs.select(name='Categorical snow')[0].values
-        catsleet = grbs.select(name='Categorical ice pellets')[0].values
-        catfzra = grbs.select(name='Categorical freezing rain')[0].values
-        catrain = grbs.select(name='Categorical rain')[0].values
-        # latitude and longitude
-        lats,lons = grbs.select(name='Maximum temperature')[0].latlons()
-
-    # convert to American units
-    max_temp_f = kelvinToFahrenheit(max_temp_k)
-    min_temp_f = kelvinToFahrenheit(min_temp_k)
-    precip_in = mmToInches(precip_mm)
-
-    # convert temperature to Celsius for use in the dewpoint formula
-    temp_c = kelvinToCelsius(temp_k)
-
-    # compute dewpoint from temperature and relative humidity then convert to Fahrenheit
-    dpt_c = dewpointCalc(relh_pct,temp_c)
-    dpt_f = celsiusToFahrenheit(dpt_c)
-
-    # get data at mylat and mylon - round because we're on a 1deg x 1deg grid
-    grblat = np.where(lats==round(mylat))[0][0]
-    mylon = lonConvert(round(mylon))
-    grblon = np.where(lons==mylon)[1][0]
-    # sanity check the values
-    # QC temperature
-    if max_temp_f[grblat,grblon] > 150.0 or max_temp_f[grblat,grblon] < -100.0:
-        max_temp[int(pert)][int(hour)] = float('nan')
-    else:
-        max_temp[int(pert)][int(hour)] = max_temp_f[grblat,grblon]
-
-    if min_temp_f[grblat,grblon] > 150.0 or min_temp_f[grblat,grblon] < -100.0:
-        min_temp[int(pert)][int(hour)] = float('nan')
-    else:
-        min_temp[int(pert)][int(hour)] = min_temp_f[grblat,grblon]
-
-    # QC dewpoint
-    if dpt_f[grblat,grblon] > 100.0 or dpt_f[grblat,grblon] < -50.0:
-        dpt[int(pert)][int(hour)] = float('nan')
-    else:
-        dpt[int(pert)][int(hour)] = dpt_f[grblat,grblon]
-
-    # set everything else
-    precip[int(pert)][int(hour)] = precip_in[grblat,grblon]
-    snow[int(pert)][int(hour)] = catsnow[grblat,grblon]
-    sleet[int(pert)][int(hour)] = catsleet[grblat,grblon]
-    fzra[int(pert)][int(hour)] = catfzra[grblat,grblon]
-    rain[int(pert)][int(hour)] = catrain[grblat,grblon]
-    
-    # kill switch for test mode
-    if testmode and ix >= 20 * 4:
-        break
-
-# compute ensemble mean at each forecast hour
-# initialize everything to zero
-max_ensmean = [0.0] * 65
-min_ensmean = [0.0] * 65
-dpt_ensmean = [0.0] * 65
-precip_ensmean = [0.0] * 65
-snowmems = np.array([0.0] * 65)
-sleetmems = np.array([0.0] * 65)
-fzramems = np.array([0.0] * 65)
-rainmems = np.array([0.0] * 65)
-# actual ensemble mean calculations
-for i in range(0,65):
-    max_ensmean[i] = np.nanmean(max_temp[:,i])
-    min_ensmean[i] = np.nanmean(min_temp[:,i])
-    dpt_ensmean[i] = np.nanmean(dpt[:,i])
-    precip_ensmean[i] = np.nanmean(precip[:,i])
-    snowmems[i] = np.sum(snow[:,i]) / 20.0
-    sleetmems[i] = np.sum(sleet[:,i]) / 20.0
-    fzramems[i] = np.sum(fzra[:,i]) / 20.0
-    rainmems[i] = np.sum(rain[:,i]) / 20.0
-
-# valid/initial time information
-vtimes = validTimes(str(grbs.message(1).dataDate),str(grbs.message(1).dataTime))
-inittime = datetime.datetime.strftime(vtimes[0],'%m/%d %H') + '00 UTC'
-
-### ENSEMBLE MEAN PLOTS ###
-# TEMPERATURE
-plt.clf()
-fig = plt.figure(figsize=(12,8))
-ax = fig.add_subplot(1,1,1)
-plt.plot(vtimes,max_ensmean,color='r',label='Max Temperature')
-plt.plot(vtimes,min_ensmean,color='b',label='Min Temperature')
-plt.grid(which='major',linestyle='-',color='black')
-plt.grid(which='minor',linestyle='--',color='gray')
-
-# x axis settings
-plt.xticks(rotation=90)
-plt.xlabel('Date/Time (UTC)',fontsize=14)
-plt.xlim([np.min(vtimes),np.max(vtimes)])
-ax.xaxis.set_major_locator(mdates.HourLocator(interval=24))
-ax.xaxis.set_major_formatter(mdates.DateFormatter('%d/%H'))
-ax.xaxis.set_minor_locator(mdates.HourLocator(interval=6))
-
-# y axis and title
-plt.yticks(np.arange(0,110,5))
-plt.ylim([0,110])
-plt.ylabel('Temperature (degrees Fahrenheit)',fontsize=14)
-plt.title('GEFS Ensemble Mean 6-Hourly Temperature for %s (init: %s)' % (locname,inittime),\
-    fontsize=16)
-plt.legend(loc='upper right',fontsize=12)
-plt.savefig('%s/ensmean_temp.png' % savedir,bbox_inches='tight')
-plt.close(fig)
-
-# PRECIPITATION
-fig = plt.figure(figsize=(12,8))
-ax = fig.add_subplot(1,1,1)
-plt.bar(vtimes,precip_ensmean,width=0.25,color='g',align='center',label='6-Hour Precipitation')
-plt.plot(vtimes,np.cumsum(precip_ensmean),color='b',label='Run-Accumulated Precipitation')
-plt.grid(which='major',linestyle='-',color='black')
-plt.grid(which='minor',linestyle='--',color='gray')
-
-# x axis settings
-plt.xticks(rotation=90)
-plt.xlabel('Date/Time (UTC)',fontsize=14)
-plt.xlim([np.min(vtimes),np.max(vtimes)])
-ax.xaxis.set_major_locator(mdates.HourLocator(interval=24))
-ax.xaxis.set_major_formatter(mdates.DateFormatter('%d/%H'))
-ax.xaxis.set_minor_locator(mdates.HourLocator(interval=6))
-
-# y axis and title
-plt.yticks([0,0.1,0.25,0.50,1,2,3,4])
-plt.ylim([0,4])
-plt.ylabel('Precipitation (inches)',fontsize=14)
-plt.title('GEFS Ensemble Mean Precipitation for %s (init: %s)' % (locname,inittime),fontsize=16)
-plt.legend(loc='upper left',fontsize=12)
-plt.savefig('%s/ensmean_precip.png' % savedir,bbox_inches='tight')
-plt.close(fig)
-
-### DEWPOINT ###
-fig = plt.figure(figsize=(12,8))
-ax = fig.add_subplot(1,1,1)
-plt.plot(vtimes,dpt_ensmean,color='g',label='Dewpoint')
-plt.grid(which='major',linestyle='-',color='black')
-plt.grid(which='minor',linestyle='--',color='gray')
-
-# x axis settings
-plt.xticks(rotation=90)
-plt.xlabel('Date/Time (UTC)',fontsize=14)
-plt.xlim([np.min(vtimes),np.max(vtimes)])
-ax.xaxis.set_major_locator(mdates.HourLocator(interval=24))
-ax.xaxis.set_major_formatter(mdates.DateFormatter('%d/%H'))
-ax.xaxis.set_minor_locator(mdates.HourLocator(interval=6))
-
-# y axis and title
-plt.ylim([20,85])
-plt.yticks(np.arange(20,85,5))
-plt.ylabel('Dewpoint Temperature (F)',fontsize=14)
-plt.title('GEFS Ensemble Mean 6-Hourly Dewpoint for %s (init: %s)' % (locname,inittime),fontsize=16)
-plt.legend(loc='upper right',fontsize=12)
-plt.savefig('%s/ensmean_dwpt.png' % savedir,bbox_inches='tight')
-plt.close(fig)
-
-# CATEGORICAL PRECIPITATION TYPE
-fig = plt.figure(figsize=(12,8))
-ax = fig.add_subplot(1,1,1)
-plt.bar(vtimes,snowmems,width=0.25,color='b',label='Snow',align='center')
-plt.bar(vtimes,sleetmems,width=0.25,color='y',label='Sleet',align='center',bottom=snowmems)
-plt.bar(vtimes,fzramems,width=0.25,color='r',label='Freezing Rain',align='center',\
-    bottom=snowmems+sleetmems)
-plt.bar(vtimes,rainmems,width=0.25,color='g',label='Liquid Rain',align='center',\
-    bottom=snowmems+sleetmems+fzramems)
-
-# grid
-plt.grid(which='major',linestyle='-',color='black')
-plt.grid(which='minor',linestyle='--',color='gray')
-
-# x axis
-plt.xticks(rotation=90)
-plt.xlabel('Date/Time (UTC)',fontsize=14)
-plt.xlim([np.min(vtimes),np.max(vtimes)])
-ax.xaxis.set_major_locator(mdates.HourLocator(interval=24))
-ax.xaxis.set_major_formatter(mdates.DateFormatter('%d/%H'))
-ax.xaxis.set_minor_locator(mdates.HourLocator(interval=6))
-
-# y axis and title
-plt.ylim([0,1])
-plt.yticks(np.arange(0,1,0.1))
-plt.ylabel('Percent of Members',fontsize=14)
-vals = ax.get_yticks()
-ax.set_yticklabels(['{:.0f}%'.format(x*100) for x in vals])
-
-plt.title('GEFS Categorical Precipitation Type for %s (init: %s)' % (locname,inittime),fontsize=16)
-plt.legend(loc='upper right',fontsize='12')
-plt.savefig('%s/ptype.png' % savedir,bbox_inches='tight')
-plt.close(fig)
-
-# write data out for each ensemble member
-column_headers = [str('gep' + str(x)) for x in range(1,21)]
-max_df = pandas.DataFrame(np.transpose(max_temp),index=vtimes,columns=column_headers)
-max_df.index.name = 'ValidTime'
-min_df = pandas.DataFrame(np.transpose(min_temp),index=vtimes,columns=column_headers)
-min_df.index_name = 'ValidTime'
-precip_df = pandas.DataFrame(np.transpose(precip),index=vtimes,columns=column_headers)
-precip_df.index.name = 'ValidTime'
-dpt_df = pandas.DataFrame(np.transpose(dpt),index=vtimes,columns=column_headers)
-dpt_df.index.name = 'ValidTime'
-
-# write ensemble member information to CSV files
-max_df.to_csv('%s/maxtemps.csv' % savedir)
-min_df.to_csv('%s/mintemps.csv' % savedir)
-precip_df.to_csv('%s/precip.csv' % savedir)
-dpt_df.to_csv('%s/dewpoint.csv' % savedir)
+if __name__ == '__main__':
+    # get the list of locations (just mylat/mylon unless a station list is given)
+    sites = loadSites(stationfile,savedir,{'name':locname,'lat':mylat,'lon':mylon})
+
+    metrics = RunMetrics('ensemblemeans',profile=profile and metricsdir is not None)
+    maps = gefsmaps.MapAccumulator(gefsmaps.domain) if gefsmaps.domain is not None else None
+
+    # members and lead times of the run (see runlayout.py)
+    layout = discoverLayout(os.listdir(directory))
+
+    # decode the GRIB files once and pull out the data at every location
+    with metrics.stage('ingest'):
+        cube,initinfo = ingest(directory,[site['lat'] for site in sites],\
+            [site['lon'] for site in sites],nworkers=nworkers,testmode=testmode,\
+            method=interpolation,cachedir=gridcache,decodecache=decodecache,\
+            cachesize=cachesize * 1024 * 1024,metrics=metrics,lowmemory=lowmemory,\
+            memoryceiling=None if memoryceiling is None else memoryceiling * 1024 * 1024,\
+            maps=maps,layout=layout)
+
+    # valid time information
+    vtimes = validTimes(*initinfo,hours=layout.hours)
+
+    # hand everything off to htmlbuilder.py
+    with metrics.stage('store'):
+        writeCube(cubefile,cube,vtimes,sites,variables,units,layout.columns())
+        metrics.addBytes(written=os.path.getsize(cubefile))
+        if cycledir is not None:
+            CycleStore(cycledir,keepcycles).add(cubefile)
+
+    # ensemble statistics for every location, variable, and lead time in one pass
+    with metrics.stage('statistics'):
+        stats = EnsembleStats(cube,memberaxis=1).summary()
+
+    # CSVs for each location, then render all of the plots
+    with metrics.stage('csv'):
+        jobs = []
+        for ix,site in enumerate(sites):
+            if not os.path.isdir(site['savedir']):
+                os.makedirs(site['savedir'])
+            jobs += siteProducts(cube[ix],vtimes,site['name'],site['savedir'],writecsv,\
+                dict((key,value[ix]) for key,value in stats.items()),layout.columns())
+    if maps is not None:
+        jobs += gefsmaps.mapJobs(maps,vtimes,os.path.join(savedir,gefsmaps.mapfolder),sites)
+    with metrics.stage('plots'):
+        renderJobs(jobs,renderworkers,plotcache,plotcachesize * 1024 * 1024)
+
+    if metricsdir is not None:
+        metrics.write(metricsdir,datetime.datetime.strftime(vtimes[0],'%Y%m%d%H'))
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+''' Ensemble statistics for the GEFS scripts. EnsembleStats takes an array with a member axis
+    (e.g. [site, member, lead] or [member, lead]) and computes the mean, median, spread,
+    percentiles, and exceedance probabilities over the members for every other index at once.
+    Missing members (NAN) are ignored, so there are no Python loops over sites or lead times.
+'''
+
+import numpy as np
+import warnings
+
+__author__ = 'Jason Godwin'
+__license__ = 'GPL'
+__maintainer__ = 'Jason Godwin'
+__email__ = 'jasonwgodwin@gmail.com'
+__status__ = 'Production'
+
+class EnsembleStats(object):
+    ''' NaN-aware statistics over the member axis of an ensemble array. Every result has the
+        shape of the input with the member axis removed (with an extra leading axis for the
+        percentile and threshold functions).
+    '''
+
+    def __init__(self,data,memberaxis=-2):
+        # keep the members along the first axis so every statistic reduces over axis 0
+        self.data = np.moveaxis(np.asarray(data,dtype=float),memberaxis,0)
+        self.nmembers = np.shape(self.data)[0]
+
+    # number of members with data
+    def count(self):
+        return np.sum(~np.isnan(self.data),axis=0)
+
+    # ensemble mean
+    def mean(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore',RuntimeWarning)
+            return np.nanmean(self.data,axis=0)
+
+    # ensemble median
+    def median(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore',RuntimeWarning)
+            return np.nanmedian(self.data,axis=0)
+
+    # ensemble spread (standard deviation of the members)
+    def spread(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore',RuntimeWarning)
+            return np.nanstd(self.data,axis=0)
+
+    # percentiles of the members, one row per percentile in q (0-100)
+    def percentiles(self,q):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore',RuntimeWarning)
+            return np.nanpercentile(self.data,np.atleast_1d(q),axis=0)
+
+    # fraction of all members (missing members count as not exceeding) above each threshold, one
+    # row per threshold
+    def exceedance(self,thresholds):
+        thresholds = np.asarray(thresholds,dtype=float).reshape((-1,) + (1,) * np.ndim(self.data))
+        return np.sum(self.data[np.newaxis] > thresholds,axis=1) / float(self.nmembers)
+
+    # sum of the members divided by the number of members, e.g. the fraction of members with a
+    # categorical precipitation type flag set
+    def fraction(self):
+        return np.nansum(self.data,axis=0) / float(self.nmembers)
+
+    # every statistic in one go, as a dictionary
+    def summary(self,percentiles=(),thresholds=()):
+        stats = {'count':self.count(),'mean':self.mean(),'median':self.median(),\
+            'spread':self.spread(),'fraction':self.fraction()}
+        if len(percentiles) > 0:
+            stats['percentiles'] = self.percentiles(percentiles)
+        if len(thresholds) > 0:
+            stats['exceedance'] = self.exceedance(thresholds)
+        return stats
@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+''' Long-running GEFS cycle daemon. Replaces the cron job around get_grib.sh: instead of starting
+    a fresh interpreter four times a day (importing numpy/pandas/matplotlib/pygrib, rebuilding
+    the grid indexes, and warming up the plotting each time), this stays running with all of
+    that loaded and runs the whole pipeline (download, ingest, products, plots) in-process
+    whenever a new 00/06/12/18Z cycle shows up.
+
+    New cycles are found by polling a source every pollinterval seconds:
+
+        'ncep'   a cycle is ready once the inventory of its last file is on the NCEP server
+        'clock'  a cycle is ready clockdelay hours after it starts (what get_grib.sh assumed)
+        'local'  a cycle is ready once localroot/YYYYMMDDRR/ has a file named 'ready' in it, and
+                 its GRIB files are taken from that directory instead of downloaded (e.g. a run
+                 written by syntheticgrib.py, for testing the daemon offline)
+
+    Ready cycles go into a queue and are run one at a time, oldest first, so a cycle that runs
+    long never has the next one written over it. Each cycle gets its own GRIB directory
+    (gribroot/YYYYMMDDRR), which is removed once its products are out. A cycle that is older than
+    one already finished is dropped, and a cycle that fails is retried on the next poll up to
+    maxattempts times. The finished cycles are kept in statefile so a restart picks up where the
+    last run left off. Uses the settings blocks in ensemblemeans.py and htmlbuilder.py too.
+
+    usage: python gefsdaemon.py [--source ncep|clock|local] [--once] [--cycle YYYYMMDDRR ...]
+'''
+
+import argparse
+import datetime
+import fcntl
+import json
+import os
+import shutil
+import subprocess
+import time
+
+import downloader
+import ensemblemeans
+import gefsmaps
+import htmlbuilder
+from gefsingest import validTimes
+from gefsstream import downloadQueue,publishProducts,streamIngest
+from renderpool import keepPool
+from runlayout import RunLayout
+from runmetrics import RunMetrics
+from stations import loadSites
+
+__author__ = 'Jason Godwin'
+__license__ = 'GPL'
+__maintainer__ = 'Jason Godwin'
+__email__ = 'jasonwgodwin@gmail.com'
+__status__ = 'Production'
+
+### USER SETTINGS BLOCK ###
+source = 'ncep'                     # how new cycles are found: 'ncep', 'clock', or 'local'
+gribroot = ensemblemeans.savedir + '/grib'      # each cycle's GRIB files go in a folder in here
+localroot = ensemblemeans.savedir + '/localgefs'    # cycle folders for the 'local' source
+statefile = ensemblemeans.savedir + '/gefsdaemon.json'  # finished cycles (plus a .lock file)
+pollinterval = 300.0                # seconds between looks for a new cycle
+lookback = 4                        # how many cycles back to look (4 = the last day)
+clockdelay = 6.0                    # hours after the start of a cycle for the 'clock' source
+maxattempts = 3                     # times to try a cycle before giving up on it
+keepgrib = False                    # keep each cycle's GRIB folder after its products are out
+postcommand = None                  # shell command run after each cycle (e.g. the scp of the pngs)
+### END OF USER SETTINGS BLOCK ###
+
+# cycle name (YYYYMMDDRR) of a cycle start time
+def cycleName(cycle):
+    return cycle.strftime('%Y%m%d%H')
+
+# current UTC time as a naive datetime (like the cycle times)
+def utcNow():
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+# the count most recent cycle start times at or before now, oldest first
+def recentCycles(now,count=lookback):
+    latest = now.replace(hour=now.hour // 6 * 6,minute=0,second=0,microsecond=0)
+    return [latest - datetime.timedelta(hours=6 * i) for i in reversed(range(count))]
+
+class NcepSource(object):
+    ''' Cycles on the NCEP server. A cycle is ready once the inventory of its last member and
+        lead time (in the run layout, see runlayout.py) can be fetched, and its files are
+        downloaded as the ingest runs.
+    '''
+
+    def __init__(self,baseurl=downloader.baseurl):
+        self.baseurl = baseurl
+        self.layout = RunLayout()
+
+    def ready(self,cycle):
+        date,run = cycle.strftime('%Y%m%d'),cycle.strftime('%H')
+        try:
+            status,headers,body = downloader.fetch(downloader.gribUrl(date,run,\
+                self.layout.hours[-1],self.layout.perts[-1],self.baseurl) + '.idx',retries=0)
+        except IOError as err:
+            print('%s: %s' % (cycleName(cycle),err))
+            return False
+        return status == 200
+
+    # yields the name of each file in gribdir as soon as it has been downloaded
+    def files(self,cycle,gribdir):
+        return iter(downloadQueue(cycle.strftime('%Y%m%d'),cycle.strftime('%H'),gribdir).get,None)
+
+class ClockSource(NcepSource):
+    ''' Cycles on the NCEP server, assumed ready delay hours after they start. '''
+
+    def __init__(self,delay=clockdelay,baseurl=downloader.baseurl):
+        NcepSource.__init__(self,baseurl)
+        self.delay = delay
+
+    def ready(self,cycle):
+        return utcNow() >= cycle + datetime.timedelta(hours=self.delay)
+
+class LocalSource(object):
+    ''' Cycles already on disk in root/YYYYMMDDRR/ (grib_gefs_* files). A cycle is ready once its
+        folder has a file named 'ready', and its files are linked (or copied) into the cycle's
+        GRIB directory.
+    '''
+
+    def __init__(self,root=localroot):
+        self.root = root
+
+    def ready(self,cycle):
+        return os.path.isfile(os.path.join(self.root,cycleName(cycle),'ready'))
+
+    def files(self,cycle,gribdir):
+        folder = os.path.join(self.root,cycleName(cycle))
+        for filename in sorted(os.listdir(folder)):
+            if not filename.startswith('grib_gefs_'):
+                continue
+            # a retry of a failed cycle finds the files it already linked
+            if os.path.exists(os.path.join(gribdir,filename)):
+                yield filename
+                continue
+            try:
+                os.link(os.path.join(folder,filename),os.path.join(gribdir,filename))
+            except OSError:
+                shutil.copy(os.path.join(folder,filename),os.path.join(gribdir,filename))
+            yield filename
+
+sources = {'ncep':NcepSource,'clock':ClockSource,'local':LocalSource}
+
+# finished cycles and failure counts from the state file
+def loadState(filename):
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (IOError,ValueError):
+        return {'finished':[],'failures':{}}
+
+def saveState(filename,state):
+    # only the last few weeks of finished cycles are worth keeping
+    state['finished'] = sorted(state['finished'])[-120:]
+    tmpname = '%s.tmp' % filename
+    with open(tmpname,'w') as f:
+        json.dump(state,f,indent=2,sort_keys=True)
+    os.replace(tmpname,filename)
+
+# adds the cycles that are ready and not yet finished, queued, or given up on to the queue
+# (oldest first), and drops anything older than the newest finished cycle
+def queueCycles(queue,candidates,state,check):
+    newest = max(state['finished'] or [''])
+    for cycle in candidates:
+        name = cycleName(cycle)
+        if name <= newest or cycle in queue or state['failures'].get(name,0) >= maxattempts:
+            continue
+        if check.ready(cycle):
+            print('%s is ready, queued behind %d cycle(s)' % (name,len(queue)))
+            queue.append(cycle)
+    queue[:] = sorted(cycle for cycle in queue if cycleName(cycle) > newest)
+
+# downloads (or links) and ingests one cycle into its own GRIB directory, publishes the products,
+# and runs the postcommand. The GRIB directory is removed afterwards unless keepgrib is set.
+def runCycle(cycle,sites,check):
+    name = cycleName(cycle)
+    gribdir = os.path.join(gribroot,name) + '/'
+    if not os.path.isdir(gribdir):
+        os.makedirs(gribdir)
+    print('running %s in %s' % (name,gribdir))
+
+    metrics = RunMetrics('gefsdaemon',\
+        profile=ensemblemeans.profile and ensemblemeans.metricsdir is not None)
+    maps = gefsmaps.MapAccumulator(gefsmaps.domain) if gefsmaps.domain is not None else None
+    with metrics.stage('cycle'):
+        cube,initinfo = streamIngest(check.files(cycle,gribdir),gribdir,sites,\
+            publishProducts(sites,htmlbuilder.season,metrics,maps),nworkers=ensemblemeans.nworkers,\
+            method=ensemblemeans.interpolation,cachedir=ensemblemeans.gridcache,\
+            decodecache=ensemblemeans.decodecache,cachesize=ensemblemeans.cachesize * 1024 * 1024,\
+            metrics=metrics,lowmemory=ensemblemeans.lowmemory,maps=maps)
+    if initinfo is None:
+        raise IOError('%s: no GRIB files came in' % name)
+    if ensemblemeans.metricsdir is not None:
+        metrics.write(ensemblemeans.metricsdir,\
+            datetime.datetime.strftime(validTimes(*initinfo)[0],'%Y%m%d%H'))
+
+    if postcommand is not None:
+        subprocess.call(postcommand,shell=True)
+    if not keepgrib:
+        shutil.rmtree(gribdir,ignore_errors=True)
+
+# runs the queued cycles one at a time, recording each one in the state file
+def runQueue(queue,state,sites,check):
+    while queue:
+        cycle = queue.pop(0)
+        name = cycleName(cycle)
+        start = time.time()
+        try:
+            runCycle(cycle,sites,check)
+        except Exception as err:
+            state['failures'][name] = state['failures'].get(name,0) + 1
+            print('%s failed (attempt %d of %d): %s' % (name,state['failures'][name],\
+                maxattempts,err))
+        else:
+            state['finished'].append(name)
+            state['failures'].pop(name,None)
+            print('%s finished in %.1f s' % (name,time.time() - start))
+        saveState(statefile,state)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the GEFS pipeline for each new cycle.')
+    parser.add_argument('--source',default=source,choices=sorted(sources),\
+        help='how new cycles are found')
+    parser.add_argument('--once',action='store_true',\
+        help='run whatever is ready now and exit instead of polling')
+    parser.add_argument('--cycle',nargs='+',default=[],metavar='YYYYMMDDRR',\
+        help='look for these cycles instead of the most recent ones (implies --once)')
+    args = parser.parse_args()
+
+    # only one daemon at a time works on the GRIB directories and the state file
+    statedir = os.path.dirname(os.path.abspath(statefile))
+    if not os.path.isdir(statedir):
+        os.makedirs(statedir)
+    lock = open(statefile + '.lock','w')
+    try:
+        fcntl.flock(lock,fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except (IOError,OSError):
+        parser.error('another gefsdaemon.py is already running')
+
+    check = sources[args.source]()
+    sites = loadSites(ensemblemeans.stationfile,ensemblemeans.savedir,\
+        {'name':ensemblemeans.locname,'lat':ensemblemeans.mylat,'lon':ensemblemeans.mylon})
+    keepPool(ensemblemeans.renderworkers)
+    state = loadState(statefile)
+    queue = []
+
+    if args.cycle:
+        cycles = [datetime.datetime.strptime(name,'%Y%m%d%H') for name in args.cycle]
+        queueCycles(queue,sorted(cycles),state,check)
+        runQueue(queue,state,sites,check)
+    else:
+        while True:
+            queueCycles(queue,recentCycles(utcNow()),state,check)
+            runQueue(queue,state,sites,check)
+            if args.once:
+                break
+            time.sleep(pollinterval)
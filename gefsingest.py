@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+''' GRIB ingest routines for the GEFS scripts. Opens each ensemble member's GRIB file, pulls out
+    the fields the enabled variables need (see derivedvars.py: temperature, dewpoint,
+    precipitation, and precipitation type by default) at each user-specified location, computes
+    the variables, and fills the [site, member, lead, variable] array used by ensemblemeans.py.
+    Files can be processed one at a time (serial mode, handy for debugging) or spread over a pool
+    of worker processes. A low memory mode holds only one decoded field at a time, and a memory
+    ceiling limits how many worker processes are started. With a map accumulator
+    (gefsmaps.MapAccumulator) each file's 2 m temperature and precipitation over the map domain are
+    cut out too and added to the running ensemble maps as the file comes in.
+'''
+
+import datetime
+import multiprocessing
+import numpy as np
+import os
+import pygrib
+import time
+
+from decodecache import cacheKey,configDigest,evictCache,loadEntry,storeEntry
+from derivedvars import kelvinToFahrenheit,lookup,mapfields,mmToInches,products,registry,\
+    requiredFields,variableUnits
+from gribindex import MessageIndex,messageSpans
+from gridindex import cropField,domainWindow,gatherPoints,siteWeights
+from runlayout import RunLayout,discoverLayout,fileParts
+from runmetrics import residentMemory,usage
+
+__author__ = 'Jason Godwin'
+__license__ = 'GPL'
+__maintainer__ = 'Jason Godwin'
+__email__ = 'jasonwgodwin@gmail.com'
+__status__ = 'Production'
+
+# names of the arrays filled by the ingest, in the order processFile returns them (the variables
+# enabled in derivedvars.py)
+variables = list(products)
+
+# units of each variable after conversion (the categorical precipitation type flags are 0 or 1)
+units = variableUnits(variables)
+
+# (shortName, level) of the fields extractPoints reads from analysis (True) and forecast files
+pointfields = {True:requiredFields(variables,True),False:requiredFields(variables,False)}
+
+# variables on the gefsmaps.py regional maps and their units
+mapvariables = ['temp','precip']
+mapunits = {'temp':'F','precip':'in'}
+
+# converts the user input longitude to the coordinate system used in the GRIB files
+def lonConvert(longitude):
+    # -180 to 0 is between 180 and 360
+    if longitude < 0:
+        return 360.0 + longitude
+    # 0 to 180 are the same
+    else:
+        return longitude
+
+# gets the correct valid times for each GRIB file (hours are the lead hours, by default the ones
+# in runlayout.py's settings)
+def validTimes(initdate,inithour,hours=None):
+    date = datetime.datetime.strptime(initdate,'%Y%m%d')
+    # make sure the initial time is four digits
+    if len(inithour) < 4:
+        inithour = "0" + inithour
+    runinit = date + datetime.timedelta(hours=float(inithour[0:2]))
+    hours = hours if hours is not None else RunLayout().hours
+    return [runinit + datetime.timedelta(hours=x) for x in hours]
+
+# pulls the raw values at the given grid cells (indices and weights from gridindex.siteWeights)
+# out of an indexed GRIB file for every field in fields (by default the ones the variables need
+# from an analysis or forecast file, see pointfields). Returns a dictionary of the values by
+# (shortName, level). Nothing is computed on the full grid: each field is decoded once and reduced
+# to the requested points right after, and fields no variable needs are never decoded. With a map
+# window (a gridindex.domainWindow) the window is cut out of the map fields in the same pass and
+# put in crops by (shortName, level), so in low memory mode those fields aren't decoded twice.
+def extractPoints(index,analysis,cells,fields=None,window=None,crops=None):
+    fields = fields if fields is not None else pointfields[analysis]
+    cropped = mapfields[analysis] if window is not None else []
+    raw = {}
+    for key in list(fields) + [key for key in cropped if key not in fields]:
+        field = index.values(*key)
+        if key in fields:
+            raw[key] = gatherPoints(field,cells)
+        if key in cropped:
+            crops[key] = cropField(field,window)
+        del field
+    return raw
+
+# converts the map domain cut out of the 2 m temperature and 6-hour precipitation fields (crops
+# from extractPoints for window) to degrees F and inches (float32 to keep them small). Returns a
+# dictionary with an array for each variable in mapvariables (no precipitation at the initial
+# time) plus the 'lats' and 'lons' of the window.
+def extractRegion(crops,analysis,window):
+    temp = kelvinToFahrenheit(crops[('2t',2)])
+    lo,hi = registry['max_temp'].qc
+    region = {'temp':np.where((temp > hi) | (temp < lo),np.nan,temp).astype(np.float32),\
+        'lats':window[2],'lons':window[3]}
+    if not analysis:
+        region['precip'] = mmToInches(crops[('tp',0)]).astype(np.float32)
+    return region
+
+# computes the variables (in American units, QCed) at count locations from extractPoints' raw
+# values with each one's formula in derivedvars.py. Returns a list of arrays in the same order as
+# names.
+def convertPoints(raw,analysis,count,names=variables):
+    return [variable.compute(raw,analysis,count) for variable in lookup(names)]
+
+# a message on the file's grid to build the site weights from: the first field the variables
+# need, or the file's first message if they don't need any
+def gridMessage(index,analysis):
+    if pointfields[analysis]:
+        return index.message(*pointfields[analysis][0])
+    return next(iter(index.messages.values()))
+
+# fills in the time spent on a file and the process's peak memory use in processFile's stats
+def finishStats(stats,start):
+    stats['seconds'] = time.time() - start
+    stats['peakrss'] = usage()['maxrss']
+
+# decodes a single GRIB file and returns a [variable, site] array of the values at each location
+# along with the file's perturbation number and lead hour, initial date/time (None for missing/bad
+# files), and a dictionary of stats: the seconds of GRIB scanning saved by the message index,
+# whether the values came from the decode cache ('hit', 'miss', or None with no cache), the
+# file's name, the seconds spent on it, its size in bytes, the peak memory use (bytes) of the
+# process so far, and what was wrong with the file (None if nothing, see fileProblem).
+# decodecache is the decode cache directory (None = don't cache). With lowmemory each field is
+# freed as soon as its points are pulled out, so only one decoded field is held at a time instead
+# of every field in the file. If domain (south, north, west, east) is given, the
+# map fields over it are returned too (see extractRegion), otherwise the region is None.
+def processFile(directory,filename,sitelats,sitelons,method='nearest',cachedir=None,\
+    decodecache=None,lowmemory=False,domain=None):
+    start = time.time()
+    date,run,hour,pert = fileParts(filename)
+    values = np.empty([len(variables),len(sitelats)])
+    values[:,:] = np.nan
+    stats = {'saved':0.0,'cache':None,'file':filename,'seconds':0.0,\
+        'bytes':os.stat(directory + filename).st_size,'problem':None}
+
+    # check for bad files: every message has to be whole (the fields are checked once the file
+    # is open)
+    try:
+        messageSpans(directory + filename)
+    except (IOError,ValueError) as err:
+        stats['problem'] = str(err)
+        finishStats(stats,start)
+        return pert,hour,values,None,stats,None
+
+    # skip the decode entirely if this file has been through with the same settings before
+    if decodecache is not None:
+        key = cacheKey(directory + filename,configDigest(sitelats,sitelons,method,variables,\
+            domain))
+        cached = loadEntry(decodecache,key)
+        if cached is not None:
+            stats['cache'] = 'hit'
+            finishStats(stats,start)
+            return pert,hour,cached[0],cached[1],stats,cached[2]
+        stats['cache'] = 'miss'
+
+    # open the grib file
+    grbs = pygrib.open(directory + filename)
+
+    # index the messages once instead of rescanning the file for every field
+    index = MessageIndex(grbs,keepvalues=not lowmemory)
+    analysis = hour == 0
+    needed = pointfields[analysis] + ([key for key in mapfields[analysis] \
+        if key not in pointfields[analysis]] if domain is not None else [])
+    stats['problem'] = index.problem(needed,hour,pert)
+    if stats['problem'] is not None:
+        grbs.close()
+        finishStats(stats,start)
+        return pert,hour,values,None,stats,None
+
+    # get the grid cells and weights for every location (cached by grid definition, which is
+    # the same for every field)
+    cells = siteWeights(gridMessage(index,analysis),sitelats,sitelons,method,cachedir)
+
+    # pull out the grid cells (and the map window) first, then do all of the math on just those
+    # values
+    window = domainWindow(index.message('2t',2),domain) if domain is not None else None
+    crops = {}
+    raw = extractPoints(index,analysis,cells,window=window,crops=crops)
+    values[:,:] = convertPoints(raw,analysis,len(sitelats))
+    region = extractRegion(crops,analysis,window) if window is not None else None
+
+    # initial date/time of the run
+    initinfo = (str(grbs.message(1).dataDate),str(grbs.message(1).dataTime))
+    stats['saved'] = index.timeSaved()
+    grbs.close()
+
+    if decodecache is not None:
+        storeEntry(decodecache,key,values,initinfo,region)
+    finishStats(stats,start)
+    return pert,hour,values,initinfo,stats,region
+
+# worker entry point for the process pool (Pool.imap can only pass a single argument)
+def _processFileStar(args):
+    return processFile(*args)
+
+# what is wrong with the GRIB file at path for lead hour and perturbation pert: no file, a
+# message cut short (gribindex.messageSpans), or a field the ingest needs missing or for the wrong
+# lead time or member (gribindex.MessageIndex.problem). None if nothing is. Nothing is decoded.
+def fileProblem(path,hour,pert):
+    if not os.path.isfile(path):
+        return 'no file'
+    try:
+        messageSpans(path)
+    except (IOError,ValueError) as err:
+        return str(err)
+    grbs = pygrib.open(path)
+    problem = MessageIndex(grbs).problem(pointfields[hour == 0],hour,pert)
+    grbs.close()
+    return problem
+
+# size (bytes) of one decoded float64 field on the grid of the first good file in filenames, or
+# None if there are no good files. Only the first message's header is read.
+def fieldBytes(directory,filenames):
+    for filename in filenames:
+        if fileParts(filename) is not None and \
+            fileProblem(directory + filename,*fileParts(filename)[2:]) is None:
+            grbs = pygrib.open(directory + filename)
+            size = grbs.message(1)['numberOfValues'] * 8
+            grbs.close()
+            return size
+    return None
+
+# number of ingest processes (at most nworkers) that fit in memoryceiling bytes. Each worker is
+# estimated to need as much as this process does now (interpreter, numpy, pygrib) plus the
+# decoded fields it holds at once: one field (and ecCodes' copy of it while decoding) in low
+# memory mode, otherwise every field the variables need from a forecast file (nine by default).
+# Returns the worker count and the per-worker estimate.
+def workerLimit(nworkers,memoryceiling,fieldbytes,lowmemory):
+    base = residentMemory()
+    perworker = base + fieldbytes * (2 if lowmemory else len(pointfields[False]) + 1)
+    fits = int((memoryceiling - base) // perworker)
+    return max(1,min(nworkers,fits)),perworker
+
+# decodes every GRIB file in directory and returns a [site, member, lead, variable] array (the
+# variable axis is in the same order as variables) plus the run's initial date/time. The member
+# and lead axes follow layout (a runlayout.RunLayout, by default discovered from the files), and
+# files outside it are skipped. Every location is pulled out of the same pass over the files.
+# nworkers=1 runs everything serially in this process, otherwise the files are spread over a pool
+# of nworkers processes. testmode only reads the files for the first 24 hours. method is the
+# interpolation method ('nearest' or 'bilinear') and cachedir is where the grid index is saved
+# between runs (None = don't save). decodecache is the decode cache directory (None = off),
+# trimmed to cachesize bytes at the end. metrics is an optional runmetrics.RunMetrics that gets
+# each file's time and size. lowmemory frees each decoded field right after use (see processFile)
+# and keeps the array in float32. memoryceiling (bytes) caps the number of workers so the ingest
+# stays under it (see workerLimit). maps is an optional gefsmaps.MapAccumulator that each file's
+# map fields are added to.
+def ingest(directory,sitelats,sitelons,nworkers=1,testmode=False,method='nearest',cachedir=None,\
+    decodecache=None,cachesize=None,metrics=None,lowmemory=False,memoryceiling=None,maps=None,\
+    layout=None):
+    filenames = sorted(os.listdir(directory))
+    if layout is None:
+        layout = discoverLayout(filenames)
+    filenames = [filename for filename in filenames if layout.indices(filename) is not None]
+    # kill switch for test mode
+    if testmode:
+        filenames = [filename for filename in filenames if fileParts(filename)[2] <= 24]
+
+    # create empty array (sites, members, lead times, variables) defaulted to NAN
+    cube = np.empty([len(sitelats)] + list(layout.shape) + [len(variables)],\
+        dtype=np.float32 if lowmemory else float)
+    cube[:,:,:,:] = np.nan
+    domain = maps.domain if maps is not None else None
+    jobs = [(directory,filename,sitelats,sitelons,method,cachedir,decodecache,lowmemory,domain) \
+        for filename in filenames]
+
+    # fewer workers if they would not all fit under the memory ceiling
+    fieldbytes = fieldBytes(directory,filenames) if memoryceiling is not None else None
+    if fieldbytes is not None:
+        limit,perworker = workerLimit(nworkers,memoryceiling,fieldbytes,lowmemory)
+        print('memory ceiling %.0f MB: %d ingest process(es) at an estimated %.0f MB each' % \
+            (memoryceiling / 1048576.0,limit,perworker / 1048576.0))
+        nworkers = limit
+
+    if nworkers > 1:
+        pool = multiprocessing.Pool(nworkers)
+        results = pool.imap(_processFileStar,jobs,chunksize=4)
+    else:
+        pool = None
+        results = map(_processFileStar,jobs)
+
+    # fill the arrays as the files come back (imap keeps them in sorted filename order, so the
+    # initial time comes from the same file the serial path uses). The pool is shut down however
+    # this ends, so a failed run doesn't leave its workers behind in a long-running process
+    # (gefsdaemon.py).
+    initinfo = None
+    saved = 0.0
+    cachestats = {'hit':0,'miss':0,None:0}
+    peakrss = 0
+    try:
+        for filename,(pert,hour,values,fileinit,stats,region) in zip(filenames,results):
+            print(filename if stats['problem'] is None else '%s: %s' % (filename,stats['problem']))
+            saved += stats['saved']
+            peakrss = max(peakrss,stats['peakrss'])
+            cachestats[stats['cache']] += 1
+            member,lead = layout.memberix[pert],layout.leadix[hour]
+            cube[:,member,lead,:] = np.transpose(values)
+            if maps is not None and region is not None:
+                maps.add(lead,region)
+            if fileinit is not None:
+                initinfo = fileinit
+            if metrics is not None:
+                metrics.fileTime(filename,stats['seconds'])
+                metrics.addBytes(read=stats['bytes'])
+    except BaseException:
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    print('message index saved an estimated %.2f s of GRIB scanning' % saved)
+    print('peak memory of the largest ingest process: %.0f MB' % (peakrss / 1048576.0))
+    if decodecache is not None:
+        removed = evictCache(decodecache,cachesize) if cachesize is not None else 0
+        print('decode cache: %d hits, %d misses, %d old entries evicted' % \
+            (cachestats['hit'],cachestats['miss'],removed))
+
+    return cube,initinfo
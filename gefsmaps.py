@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+''' Regional GEFS ensemble maps. Every GRIB file already holds global fields, so besides the
+    values at each location the ingest can cut a lat/lon box out of the 2 m temperature and
+    6-hour precipitation fields. MapAccumulator keeps a running (Welford) ensemble mean and
+    variance, and a count of the members above each threshold, for every map variable and lead
+    time. Each member is added as soon as its file comes in and then dropped, so only a few
+    running arrays per lead time are kept instead of every member's grid. At the end each
+    variable and lead time gets a map (map_<variable>_fFFF.png) with the ensemble mean, the
+    spread, and the probability of exceeding each threshold. The maps are rendered in parallel,
+    one job per lead time (see renderpool.py).
+
+    Set domain below to turn the maps on for ensemblemeans.py, gefsstream.py, and gefsdaemon.py.
+'''
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import os
+
+from gefsingest import mapunits,mapvariables
+
+__author__ = 'Jason Godwin'
+__license__ = 'GPL'
+__maintainer__ = 'Jason Godwin'
+__email__ = 'jasonwgodwin@gmail.com'
+__status__ = 'Production'
+
+### USER SETTINGS BLOCK ###
+domain = None                       # (south, north, west, east) in degrees, None = no maps
+                                    # e.g. (24.0,50.0,-126.0,-66.0) for the lower 48
+thresholds = {'temp':[32.0],'precip':[0.10,0.50]}   # exceedance thresholds (F and inches)
+maphours = range(0,841,12)          # lead times (hours) to draw maps for
+mapfolder = 'maps'                  # maps go in savedir/mapfolder
+### END OF USER SETTINGS BLOCK ###
+
+# titles and colormaps for each map variable
+titles = {'temp':'2 m Temperature','precip':'6-Hour Precipitation'}
+colormaps = {'temp':'RdYlBu_r','precip':'YlGnBu'}
+
+class MapAccumulator(object):
+    ''' One-pass ensemble mean, spread, and exceedance probability maps for each variable and lead
+        time. add() takes one member's fields at a time and updates the running mean and sum of
+        squared differences (Welford's method) in place, so memory use doesn't grow with the
+        number of members. Missing values (NAN) are skipped in the mean and spread and count as
+        not exceeding in the probabilities, the same as ensemblestats.EnsembleStats.
+    '''
+
+    def __init__(self,domain,thresholds=thresholds):
+        self.domain = tuple(domain)
+        self.thresholds = dict((name,np.atleast_1d(np.asarray(thresholds.get(name,[]),\
+            dtype=float))) for name in mapvariables)
+        self.lats = None
+        self.lons = None
+        # running sums keyed by (variable, lead index)
+        self.sums = {}
+
+    # adds one member's fields for one lead time (a gefsingest.extractRegion dictionary)
+    def add(self,lead,region):
+        if self.lats is None:
+            self.lats = np.asarray(region['lats'])
+            self.lons = np.asarray(region['lons'])
+        for name in mapvariables:
+            if name not in region:
+                continue
+            field = np.asarray(region[name],dtype=float)
+            if (name,lead) not in self.sums:
+                shape = np.shape(field)
+                self.sums[(name,lead)] = {'members':0,'count':np.zeros(shape,dtype=np.int32),\
+                    'mean':np.zeros(shape),'m2':np.zeros(shape),\
+                    'exceed':np.zeros((len(self.thresholds[name]),) + shape,dtype=np.int32)}
+            sums = self.sums[(name,lead)]
+            valid = ~np.isnan(field)
+            sums['members'] += 1
+            sums['count'] += valid
+            delta = np.where(valid,field - sums['mean'],0.0)
+            sums['mean'] += delta / np.maximum(sums['count'],1)
+            sums['m2'] += delta * np.where(valid,field - sums['mean'],0.0)
+            sums['exceed'] += field[np.newaxis] > self.thresholds[name][:,np.newaxis,np.newaxis]
+
+    # lead indices with data for a variable
+    def leads(self,name):
+        return sorted(lead for key,lead in self.sums if key == name)
+
+    # ensemble mean (NAN where no member had data)
+    def mean(self,name,lead):
+        sums = self.sums[(name,lead)]
+        return np.where(sums['count'] > 0,sums['mean'],np.nan)
+
+    # ensemble spread (standard deviation of the members)
+    def spread(self,name,lead):
+        sums = self.sums[(name,lead)]
+        with np.errstate(invalid='ignore',divide='ignore'):
+            return np.sqrt(sums['m2'] / sums['count'])
+
+    # fraction of the members above each threshold, one map per threshold
+    def exceedance(self,name,lead):
+        sums = self.sums[(name,lead)]
+        return sums['exceed'] / float(sums['members'])
+
+# mean, spread, and exceedance probability panels for one variable and lead time
+def mapPlot(lats,lons,mean,spread,probs,thresholds,name,vtime,inittime,sites,savestr):
+    npanels = 2 + len(thresholds)
+    # size the figure to the domain so the equal-aspect panels fill it
+    aspect = (lats.max() - lats.min()) / max(lons.max() - lons.min(),1e-6)
+    fig,axes = plt.subplots(1,npanels,figsize=(6 * npanels,6 * aspect + 2.0),sharey=True,\
+        constrained_layout=True)
+    unit = mapunits[name]
+    panels = [(mean,'Ensemble Mean (%s)' % unit,colormaps[name],None,None),\
+        (spread,'Spread (%s)' % unit,'viridis',0.0,None)]
+    panels += [(100.0 * prob,'Probability > %g %s (%%)' % (threshold,unit),'Blues',0.0,100.0) \
+        for prob,threshold in zip(probs,thresholds)]
+
+    for ax,(field,title,cmap,vmin,vmax) in zip(axes,panels):
+        mesh = ax.pcolormesh(lons,lats,field,cmap=cmap,vmin=vmin,vmax=vmax,shading='nearest')
+        fig.colorbar(mesh,ax=ax,orientation='horizontal')
+        for site in sites:
+            ax.plot(site['x'],site['lat'],'k^',markersize=5)
+        ax.set_xlim([lons.min(),lons.max()])
+        ax.set_ylim([lats.min(),lats.max()])
+        ax.set_aspect('equal')
+        ax.set_title(title,fontsize=12)
+        ax.set_xlabel('Longitude',fontsize=10)
+    axes[0].set_ylabel('Latitude',fontsize=10)
+
+    fig.suptitle('GEFS %s valid %s (init: %s)' % (titles[name],vtime.strftime('%Y-%m-%d %H UTC'),\
+        inittime),fontsize=14)
+    fig.savefig(savestr,bbox_inches='tight')
+    plt.close(fig)
+
+# plot jobs (see renderpool.py) for every map variable and lead time in hours, one job per map.
+# vtimes are the run's valid times and sites are drawn on the maps as triangles.
+def mapJobs(maps,vtimes,savedir,sites=(),hours=maphours):
+    if maps.lats is None:
+        return []
+    if not os.path.isdir(savedir):
+        os.makedirs(savedir)
+    # the window's longitudes run east from its west edge, so put the sites on the same scale
+    west = maps.lons[0]
+    points = [{'lat':site['lat'],'x':west + np.mod(site['lon'] - west,360.0)} for site in sites]
+    inittime = vtimes[0].strftime('%Y-%m-%d %H UTC')
+
+    jobs = []
+    for name in mapvariables:
+        for lead in maps.leads(name):
+            hour = int((vtimes[lead] - vtimes[0]).total_seconds()) // 3600
+            if hour not in hours:
+                continue
+            savestr = os.path.join(savedir,'map_%s_f%03d.png' % (name,hour))
+            jobs.append((mapPlot,(maps.lats,maps.lons,maps.mean(name,lead),maps.spread(name,lead),\
+                maps.exceedance(name,lead),maps.thresholds[name],name,vtimes[lead],inittime,\
+                points,savestr)))
+    return jobs
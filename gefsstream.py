@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+''' Streaming version of the GEFS pipeline. Instead of waiting for get_grib.sh to download the
+    whole run before ensemblemeans.py and htmlbuilder.py start, each (member, lead) file is
+    ingested as soon as it lands in the GRIB directory, either straight from downloader.py or by
+    watching the directory for files written by something else. The ensemble arrays fill in as
+    the files arrive, and the products are republished each time every member is in through one
+    of the milestone lead times, so the day 1-3 plots are out well before the last files are.
+    Uses the settings blocks in ensemblemeans.py and htmlbuilder.py, and the members and lead
+    times in runlayout.py.
+
+    usage: python gefsstream.py YYYYMMDD RR         (download and process the run)
+           python gefsstream.py --watch             (process files as they show up in the
+                                                     GRIB directory)
+'''
+
+import argparse
+import datetime
+import multiprocessing
+import numpy as np
+import os
+import queue
+import threading
+import time
+
+import downloader
+import ensemblemeans
+import gefsmaps
+import htmlbuilder
+from cubestore import writeCube
+from cyclestore import CycleStore
+from dailyaggregate import siteDaily
+from decodecache import evictCache
+from ensemblestats import EnsembleStats
+from htmlpages import SitePages
+from gefsingest import processFile,units,validTimes,variables
+from renderpool import renderJobs
+from runlayout import RunLayout
+from runmetrics import RunMetrics
+from stations import loadSites
+
+__author__ = 'Jason Godwin'
+__license__ = 'GPL'
+__maintainer__ = 'Jason Godwin'
+__email__ = 'jasonwgodwin@gmail.com'
+__status__ = 'Production'
+
+### USER SETTINGS BLOCK ###
+milestones = [72,168,384]           # republish once every member is in through these lead hours
+pollinterval = 5.0                  # seconds between looks at the GRIB directory in watch mode
+idletimeout = 1800.0                # give up watching after this many seconds without a new file
+### END OF USER SETTINGS BLOCK ###
+
+# yields the names of GRIB files as they appear in directory (in-progress .part files are
+# skipped). A writer that doesn't use a .part file (e.g. wget) can hand over a file that is still
+# being written, so a file is offered again each time its size or modification time changes,
+# until it is in ingested (the set of files streamIngest has read without a problem, see its
+# ingested argument). Stops once every expected file is in ingested (or has been offered, with no
+# ingested set) or nothing new shows up for idletimeout seconds.
+def watchDirectory(directory,expected,pollinterval=pollinterval,idletimeout=idletimeout,\
+    ingested=None):
+    offered = {}
+    done = ingested if ingested is not None else offered
+    lastnew = time.time()
+    while len(done) < expected and time.time() - lastnew < idletimeout:
+        new = []
+        for filename in sorted(os.listdir(directory)):
+            if not filename.startswith('grib_gefs_') or filename.endswith('.part') or \
+                (ingested is not None and filename in ingested):
+                continue
+            try:
+                info = os.stat(os.path.join(directory,filename))
+            except OSError:
+                continue
+            if offered.get(filename) != (info.st_size,info.st_mtime):
+                offered[filename] = (info.st_size,info.st_mtime)
+                new.append(filename)
+        for filename in new:
+            yield filename
+        if new:
+            lastnew = time.time()
+        else:
+            time.sleep(pollinterval)
+
+# starts downloader.py in a background thread and returns a queue that gets each file's name as
+# soon as it is complete (followed by None when the download is done)
+def downloadQueue(date,run,directory,connections=downloader.connections):
+    files = queue.Queue()
+    def download():
+        try:
+            downloader.downloadRun(date,run,directory,connections=connections,\
+                onfile=lambda path: files.put(os.path.basename(path)))
+        finally:
+            files.put(None)
+    thread = threading.Thread(target=download,name='downloader')
+    thread.daemon = True
+    thread.start()
+    return files
+
+# passes on the file names in filenames that are part of layout (a runlayout.RunLayout), and
+# says which ones are skipped
+def layoutFiles(filenames,layout):
+    for filename in filenames:
+        if layout.indices(filename) is None:
+            print('%s is not a member and lead time of the run layout, skipping' % filename)
+        else:
+            yield filename
+
+# worker entry point for the process pool (Pool.imap_unordered can only pass a single argument)
+def _processFileStar(args):
+    return processFile(*args)
+
+# ingests files as their names come in from filenames (any iterable, e.g. watchDirectory() or a
+# download queue) and calls publish(cube,initinfo,hour) every time all members are in through one
+# of the milestone lead hours, plus once at the end with hour=None. Returns the final
+# [site, member, lead, variable] array and the run's initial date/time. metrics is an optional
+# runmetrics.RunMetrics that gets each file's time and size. lowmemory and maps are the same as
+# for gefsingest.ingest. layout (a runlayout.RunLayout, by default the configured one) sets the
+# member and lead axes, and files outside it are skipped. A file with a problem (see
+# gefsingest.processFile) leaves its cell empty until the file comes in again. ingested, if
+# given, is a set that gets the name of every file read without a problem (see watchDirectory).
+def streamIngest(filenames,directory,sites,publish,milestones=milestones,nworkers=1,\
+    method='nearest',cachedir=None,decodecache=None,cachesize=None,metrics=None,lowmemory=False,\
+    maps=None,layout=None,ingested=None):
+    layout = layout if layout is not None else RunLayout()
+    sitelats = [site['lat'] for site in sites]
+    sitelons = [site['lon'] for site in sites]
+    cube = np.empty([len(sites)] + list(layout.shape) + [len(variables)],\
+        dtype=np.float32 if lowmemory else float)
+    cube[:,:,:,:] = np.nan
+    arrived = np.zeros(layout.shape,dtype=bool)
+    pending = sorted(milestones)
+    initinfo = None
+    cachestats = {'hit':0,'miss':0,None:0}
+
+    domain = maps.domain if maps is not None else None
+    jobs = ((directory,filename,sitelats,sitelons,method,cachedir,decodecache,lowmemory,domain) \
+        for filename in layoutFiles(filenames,layout))
+    if nworkers > 1:
+        pool = multiprocessing.Pool(nworkers)
+        results = pool.imap_unordered(_processFileStar,jobs)
+    else:
+        pool = None
+        results = map(_processFileStar,jobs)
+
+    # the pool is always shut down, so a failed cycle doesn't leave its workers behind in a
+    # long-running process (gefsdaemon.py)
+    try:
+        for pert,hour,values,fileinit,stats,region in results:
+            cachestats[stats['cache']] += 1
+            if metrics is not None:
+                metrics.fileTime(stats['file'],stats['seconds'])
+                metrics.addBytes(read=stats['bytes'])
+            if stats['problem'] is not None:
+                print('%s: %s' % (stats['file'],stats['problem']))
+                continue
+
+            # update the running arrays (a file read again only replaces its cell)
+            member,lead = layout.memberix[pert],layout.leadix[hour]
+            cube[:,member,lead,:] = np.transpose(values)
+            if maps is not None and region is not None and not arrived[member,lead]:
+                maps.add(lead,region)
+            arrived[member,lead] = True
+            if ingested is not None:
+                ingested.add(stats['file'])
+            if fileinit is not None:
+                initinfo = fileinit
+
+            # republish as soon as every member is in through the next milestone
+            while pending and initinfo is not None and \
+                arrived[:,0:layout.leadsThrough(pending[0])].all():
+                print('all members in through %d h, publishing' % pending[0])
+                publish(cube,initinfo,pending.pop(0))
+    except BaseException:
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    if decodecache is not None:
+        removed = evictCache(decodecache,cachesize) if cachesize is not None else 0
+        print('decode cache: %d hits, %d misses, %d old entries evicted' % \
+            (cachestats['hit'],cachestats['miss'],removed))
+
+    # final products with whatever made it in
+    if initinfo is not None:
+        publish(cube,initinfo,None)
+    return cube,initinfo
+
+# makes the ensemblemeans.py products (and cube file) for every site, plus the htmlbuilder.py
+# products, the web pages, and the maps from maps (a gefsmaps.MapAccumulator, if given) once the
+# run is finished. Each publish is timed as a stage of metrics. layout is the run's
+# runlayout.RunLayout (the configured one if not given).
+def publishProducts(sites,season,metrics,maps=None,layout=None):
+    layout = layout if layout is not None else RunLayout()
+    climo = htmlbuilder.loadClimatology()
+    store = CycleStore(ensemblemeans.cycledir,ensemblemeans.keepcycles) \
+        if ensemblemeans.cycledir is not None else None
+    def publish(cube,initinfo,hour):
+        with metrics.stage('publish %s' % ('final' if hour is None else '%d h' % hour)):
+            publishStage(cube,initinfo,hour)
+    def publishStage(cube,initinfo,hour):
+        vtimes = validTimes(*initinfo,hours=layout.hours)
+        writeCube(ensemblemeans.cubefile,cube,vtimes,sites,variables,units,layout.columns())
+        if hour is None and ensemblemeans.cycledir is not None:
+            store.add(ensemblemeans.cubefile)
+        stats = EnsembleStats(cube,memberaxis=1).summary()
+        jobs = []
+        pages = SitePages(ensemblemeans.savedir)
+        if hour is None:
+            # every site's days at once from the [site, variable, member, lead] cube, and the
+            # time-lagged ensemble and trends from the cycles before
+            tzs = [site.get('tz') or htmlbuilder.daytimezone for site in sites]
+            daily = siteDaily(np.transpose(cube,(0,3,1,2)),variables,vtimes,tzs,layout.columns())
+            history = htmlbuilder.siteHistory(store,sites,tzs)
+        for ix,site in enumerate(sites):
+            if not os.path.isdir(site['savedir']):
+                os.makedirs(site['savedir'])
+            jobs += ensemblemeans.siteProducts(cube[ix],vtimes,site['name'],site['savedir'],\
+                ensemblemeans.writecsv,dict((key,value[ix]) for key,value in stats.items()),\
+                layout.columns())
+            if hour is None:
+                frames = htmlbuilder.cubeFrames(np.transpose(cube[ix],(2,0,1)),variables,vtimes,\
+                    layout.columns())
+                jobs += htmlbuilder.buildSite(daily[ix],vtimes[0],site['savedir'],site['name'],\
+                    site.get('season',season),htmlbuilder.siteClimate(climo,site['id'],daily[ix]))
+                jobs += htmlbuilder.buildHistory(history[ix],vtimes[0],site['savedir'],site['name'])
+                pages.add(site,frames)
+        pages.close()
+        if hour is None and maps is not None:
+            jobs += gefsmaps.mapJobs(maps,vtimes,os.path.join(ensemblemeans.savedir,\
+                gefsmaps.mapfolder),sites)
+        renderJobs(jobs,ensemblemeans.renderworkers,ensemblemeans.plotcache,\
+            ensemblemeans.plotcachesize * 1024 * 1024)
+    return publish
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Process GEFS files as they are downloaded.')
+    parser.add_argument('date',nargs='?',help='run date (YYYYMMDD) to download')
+    parser.add_argument('run',nargs='?',help='run hour (00, 06, 12, or 18) to download')
+    parser.add_argument('--watch',action='store_true',\
+        help='process files written to the GRIB directory by something else')
+    args = parser.parse_args()
+
+    directory = ensemblemeans.directory
+    sites = loadSites(ensemblemeans.stationfile,ensemblemeans.savedir,\
+        {'name':ensemblemeans.locname,'lat':ensemblemeans.mylat,'lon':ensemblemeans.mylon})
+
+    ingested = set()
+    if args.watch:
+        filenames = watchDirectory(directory,RunLayout().filecount(),ingested=ingested)
+    elif args.date and args.run:
+        filenames = iter(downloadQueue(args.date,args.run,directory).get,None)
+    else:
+        parser.error('give a run date and hour, or --watch')
+
+    metrics = RunMetrics('gefsstream',\
+        profile=ensemblemeans.profile and ensemblemeans.metricsdir is not None)
+    maps = gefsmaps.MapAccumulator(gefsmaps.domain) if gefsmaps.domain is not None else None
+    start = time.time()
+    with metrics.stage('stream'):
+        cube,initinfo = streamIngest(filenames,directory,sites,\
+            publishProducts(sites,htmlbuilder.season,metrics,maps),nworkers=ensemblemeans.nworkers,\
+            method=ensemblemeans.interpolation,cachedir=ensemblemeans.gridcache,\
+            decodecache=ensemblemeans.decodecache,cachesize=ensemblemeans.cachesize * 1024 * 1024,\
+            metrics=metrics,lowmemory=ensemblemeans.lowmemory,maps=maps,ingested=ingested)
+    print('finished in %.1f s' % (time.time() - start))
+    if ensemblemeans.metricsdir is not None and initinfo is not None:
+        metrics.write(ensemblemeans.metricsdir,\
+            datetime.datetime.strftime(validTimes(*initinfo)[0],'%Y%m%d%H'))
@@ -1,8 +1,12 @@
 #!/usr/bin/env bash
+# one run per cron call - gefsdaemon.py does the same thing as a long-running process, with a
+# GRIB directory per cycle and a queue for cycles that come in late
 
 # user settings
 GRIBDIR=/home/jgodwin/Documents/python/python/gefs-plots/grib
 PYDIR=/home/jgodwin/Documents/python/python/gefs-plots
+CONNECTIONS=8
+STREAM=0    # set to 1 to process each file as soon as it is downloaded (gefsstream.py)
 
 # clean out the old grib data
 rm $GRIBDIR/*
@@ -24,63 +28,28 @@ then
     RUN=12
 elif [ $HOUR -ge 00 ] && [ $HOUR -lt 6 ]
 then
+    MONTH=$(date -u -d'yesterday' +"%m")
     DATE=$(date -u -d'yesterday' +"%d")
+    YEAR=$(date -u -d'yesterday' +"%Y")
     RUN=18
 else
     echo "Invalid hour!"
 fi
 
-# loop through forecast hours
-for i in {0..384..6}
-    do
-    # loop through each perturbation
-    for j in {1..20}
-        do
-            # make sure the forecast hour is 2+ digits
-            if [ $i -lt 100 ]
-            then
-                fcstHour="0${i}"
-                fcstHour="${fcstHour: -2}"
-            else
-                fcstHour="00${i}"
-                fcstHour="${fcstHour: -3}"
-            fi
-            # make sure the perturbation number is 2 digits
-            pert="0${j}"
-            pert="${pert: -2}"
-            # download the grib files
-            url="https://www.ftp.ncep.noaa.gov/data/nccf/com/gens/prod/gefs."$YEAR""$MONTH""$DATE"/"$RUN"/pgrb2/gep"$pert".t"$RUN"z.pgrb2f"$fcstHour""
-            echo $url
-            if [ $i -eq 0 ]
-            then
-                if [ $i -lt 10 ]
-                then
-                    fcstHour="00${i}"
-                elif [ $i -lt 100 ] && [ $i -ge 10 ]
-                then
-                    fcstHour="0${i}"
-                fi
-                echo "running get_inv.pl"
-                echo $GRIBDIR/grib_gefs_"$YEAR""$MONTH""$DATE"_"$RUN"_"$fcstHour"_"$pert"
-                #perl $PYDIR/get_inv.pl "${url}.idx" | grep ":TMP:" | grep ":2 m above ground" | \
-                perl $PYDIR/get_inv.pl "${url}.idx" | grep -E ":(TMP|RH)" | grep ":2 m above ground" | \
-                perl $PYDIR/get_grib.pl "${url}" $GRIBDIR/grib_gefs_"$YEAR""$MONTH""$DATE"_"$RUN"_"$fcstHour"_"$pert"
-                echo "foo"
-            else
-                if [ $i -lt 10 ]
-                then
-                    fcstHour="00${i}"
-                elif [ $i -lt 100 ] && [ $i -ge 10 ]
-                then
-                    fcstHour="0${i}"
-                fi
-                echo "${url}.idx" | grep -E ":(TMAX|TMIN|APCP|CSNOW|CICEP|CFRZR|CRAIN)" | 
-                perl $PYDIR/get_inv.pl "${url}.idx" | grep -E ":(TMAX|TMIN|TMP|APCP|CSNOW|CICEP|CFRZR|CRAIN|RH)" | grep -E ":2 m above ground|surface" | \
-                perl $PYDIR/get_grib.pl "${url}" $GRIBDIR/grib_gefs_"$YEAR""$MONTH""$DATE"_"$RUN"_"$fcstHour"_"$pert"
-            fi
-        done   
-    done
+if [ $STREAM -eq 1 ]
+then
+    # download and process at the same time, publishing the early lead times first
+    python $PYDIR/gefsstream.py "$YEAR""$MONTH""$DATE" $RUN >& $PYDIR/gefsstream.out
+else
+    # download the grib files (all members and forecast hours, several at a time)
+    python $PYDIR/downloader.py "$YEAR""$MONTH""$DATE" $RUN $GRIBDIR --connections $CONNECTIONS --metricsdir $PYDIR/metrics >& $PYDIR/downloader.out
 
-python $PYDIR/ensemblemeans.py >& $PYDIR/ensemblemeans.out
-python $PYDIR/htmlbuilder.py >& $PYDIR/htmlbuilder.out
+    python $PYDIR/ensemblemeans.py >& $PYDIR/ensemblemeans.out
+
+    # list any missing or cut-short files, then fetch just those again and patch them into the cube
+    # (which also redoes the stored cycle, CSVs, and ensemble mean plots ensemblemeans.py made)
+    python $PYDIR/runcheck.py >& $PYDIR/runcheck.out
+    python $PYDIR/runcheck.py --repair >> $PYDIR/runcheck.out 2>&1
+    python $PYDIR/htmlbuilder.py >& $PYDIR/htmlbuilder.out
+fi
 scp $PYDIR/*.png jgodwin@jasonsweathercenter.com:/var/www/html/gefs/.
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+''' Single-pass GRIB message index. Reads the message headers in a GRIB file once and maps each
+    (shortName, level) pair to its message, so every field can be looked up without rescanning
+    the file and is decoded at most once. Also caches the grid latitudes/longitudes by grid
+    definition so they only get computed once per run instead of once per file.
+
+    Files are also checked here before anything is decoded: messageSpans walks the GRIB2 message
+    headers to make sure the file is nothing but whole messages (a download cut short ends partway
+    through one, which pygrib quietly drops), and MessageIndex.problem checks that the fields a
+    file is supposed to hold are all there for the right lead time and member.
+'''
+
+import os
+import struct
+import time
+
+__author__ = 'Jason Godwin'
+__license__ = 'GPL'
+__maintainer__ = 'Jason Godwin'
+__email__ = 'jasonwgodwin@gmail.com'
+__status__ = 'Production'
+
+# GRIB keys that define a grid (two messages with the same values share latitudes/longitudes)
+gridkeys = ['gridType','Ni','Nj','latitudeOfFirstGridPointInDegrees',\
+    'longitudeOfFirstGridPointInDegrees','latitudeOfLastGridPointInDegrees',\
+    'longitudeOfLastGridPointInDegrees','iDirectionIncrementInDegrees',\
+    'jDirectionIncrementInDegrees','jScansPositively']
+
+# latitude/longitude arrays and the time it took to compute them, keyed by grid definition
+_grids = {}
+
+# start and length (bytes) of every message in a GRIB2 file, read from the message headers
+# without decoding anything. Raises ValueError if the file holds anything but whole GRIB2
+# messages (e.g. a download cut short partway through a message).
+def messageSpans(filename):
+    size = os.path.getsize(filename)
+    spans = []
+    offset = 0
+    with open(filename,'rb') as f:
+        while offset < size:
+            f.seek(offset)
+            head = f.read(16)
+            if len(head) < 16 or head[0:4] != b'GRIB' or head[7] != 2:
+                raise ValueError('no GRIB2 message at byte %d' % offset)
+            length = struct.unpack('>Q',head[8:16])[0]
+            if offset + length > size:
+                raise ValueError('message at byte %d is cut short (%d of %d bytes)' % \
+                    (offset,size - offset,length))
+            f.seek(offset + length - 4)
+            if f.read(4) != b'7777':
+                raise ValueError('message at byte %d has no end marker' % offset)
+            spans.append((offset,length))
+            offset += length
+    return spans
+
+# builds a hashable grid definition from a GRIB message
+def gridKey(grb):
+    return tuple(grb[key] if grb.has_key(key) else None for key in gridkeys)
+
+# returns the latitude and longitude arrays for a message's grid, computing them only the first
+# time a grid is seen. Also returns the seconds saved by not recomputing them (0 on first use).
+def gridLatLons(grb):
+    key = gridKey(grb)
+    if key in _grids:
+        lats,lons,elapsed = _grids[key]
+        return lats,lons,elapsed
+    start = time.time()
+    lats,lons = grb.latlons()
+    _grids[key] = (lats,lons,time.time() - start)
+    return lats,lons,0.0
+
+class MessageIndex(object):
+    ''' Index of the messages in an open pygrib file, keyed by (shortName, level). With
+        keepvalues=False decoded fields are handed back without being kept, so each one can be
+        freed as soon as the caller is done with it (at the cost of decoding it again if it is
+        asked for twice).
+    '''
+
+    def __init__(self,grbs,keepvalues=True):
+        # one pass through the file headers
+        start = time.time()
+        self.messages = {}
+        grbs.seek(0)
+        for grb in grbs:
+            key = (grb.shortName,grb.level)
+            # keep the first message if a field shows up more than once (same as select()[0])
+            if key not in self.messages:
+                self.messages[key] = grb
+        self.scantime = time.time() - start
+        self.lookups = 0
+        self.gridsaved = 0.0
+        self.keepvalues = keepvalues
+        self._values = {}
+
+    # returns the message for a field (raises KeyError if the field is not in the file)
+    def message(self,shortname,level):
+        self.lookups += 1
+        return self.messages[(shortname,level)]
+
+    # returns the decoded values for a field, decoding it only the first time it is asked for
+    def values(self,shortname,level):
+        key = (shortname,level)
+        if not self.keepvalues:
+            return self.message(shortname,level).values
+        if key not in self._values:
+            self._values[key] = self.message(shortname,level).values
+        return self._values[key]
+
+    # returns the grid latitudes/longitudes for a field from the per-run grid cache
+    def latlons(self,shortname,level):
+        lats,lons,saved = gridLatLons(self.message(shortname,level))
+        self.gridsaved += saved
+        return lats,lons
+
+    # what is wrong with the file for one that should hold fields (a list of (shortName, level)
+    # pairs) for lead hour and perturbation pert (either None = don't check), or None if nothing
+    def problem(self,fields,hour=None,pert=None):
+        missing = [key for key in fields if key not in self.messages]
+        if missing:
+            return 'missing %s' % ','.join('%s:%d' % key for key in missing)
+        for shortname,level in fields:
+            grb = self.messages[(shortname,level)]
+            if hour is not None and grb['endStep'] != hour:
+                return '%s:%d is for hour %d, not %d' % (shortname,level,grb['endStep'],hour)
+            if pert is not None and grb.has_key('perturbationNumber') and \
+                grb['perturbationNumber'] != pert:
+                return '%s:%d is for member %d, not %d' % (shortname,level,\
+                    grb['perturbationNumber'],pert)
+        return None
+
+    # estimated seconds saved versus calling grbs.select() for every lookup: each select() scans
+    # the file headers from the start, and each latlons() call rebuilds the grid
+    def timeSaved(self):
+        return max(self.lookups - 1,0) * self.scantime + self.gridsaved
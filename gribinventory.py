@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+''' wgrib inventory (.idx) parsing and byte-range planning for downloader.py. Replaces the
+    get_inv.pl | grep -E | get_grib.pl pipeline from get_grib.sh. An inventory line looks like
+
+        12:509406:d=2017092700:TMP:2 m above ground:6 hour fcst:ENS=+1
+
+    (record number, byte offset, date, variable, level, forecast time, ...). Records are picked by
+    variable and level (the fields the enabled variables in derivedvars.py need), and their byte
+    ranges are merged into as few HTTP requests as possible:
+    ranges closer together than gap bytes become one range (fetching the records in between too,
+    which get cut back out), and up to maxranges ranges go in each multi-range request. The plan
+    says how many bytes will be fetched before anything is downloaded. Everything except the
+    download itself works offline, e.g. on the inventories in examples/inventories:
+
+    usage: python gribinventory.py IDXFILE [--analysis] [--variables NAME,...] [--nomaps]
+                                   [--gap BYTES] [--maxranges N]
+'''
+
+import argparse
+import re
+
+from derivedvars import downloadFields,products
+
+__author__ = 'Jason Godwin'
+__license__ = 'GPL'
+__maintainer__ = 'Jason Godwin'
+__email__ = 'jasonwgodwin@gmail.com'
+__status__ = 'Production'
+
+# reads a wgrib inventory and returns a list of records (dictionaries with the record number,
+# start and end byte, variable, level, forecast time, and the inventory line). The end byte of the
+# last record is None since it runs to the end of the file.
+def parseInventory(text):
+    records = []
+    for line in text.splitlines():
+        fields = line.split(':')
+        if len(fields) < 6 or not fields[1].isdigit():
+            continue
+        records.append({'number':fields[0],'start':int(fields[1]),'variable':fields[3],\
+            'level':fields[4],'forecast':fields[5],'line':line})
+
+    # each record ends where the next one (at a different offset) starts. Sub-messages (record
+    # numbers like 12.1 and 12.2) share an offset, so they share a byte range too.
+    offsets = sorted(set(record['start'] for record in records))
+    ends = dict(zip(offsets,[offset - 1 for offset in offsets[1:]] + [None]))
+    for record in records:
+        record['end'] = ends[record['start']]
+    return records
+
+# picks out the records for fields, a list of (variable, level) pairs (see
+# derivedvars.downloadFields)
+def selectFields(records,fields):
+    fields = set(fields)
+    return [record for record in records if (record['variable'],record['level']) in fields]
+
+# merges the byte ranges of the records into (start, end) ranges, joining ranges with no more
+# than gap bytes between them. Records sharing an offset only count once.
+def mergeRanges(records,gap=0):
+    ranges = []
+    for start,end in sorted(set((record['start'],record['end']) for record in records)):
+        if ranges and ranges[-1][1] is not None and start - ranges[-1][1] - 1 <= gap:
+            ranges[-1] = (ranges[-1][0],end)
+        else:
+            ranges.append((start,end))
+    return ranges
+
+# plans the requests for the records: the merged ranges (see mergeRanges) split into groups of at
+# most maxranges ranges, one group per request. Returns a dictionary with the requests and the
+# byte counts: 'needed' for the records themselves, 'planned' for everything that will be
+# fetched, and 'extra' for the difference. The size of the last record in the file isn't known
+# from the inventory, so if it is wanted it is left out of the counts ('openended' is True).
+def planRequests(records,gap=0,maxranges=1):
+    ranges = mergeRanges(records,gap)
+    requests = [ranges[i:i + maxranges] for i in range(0,len(ranges),maxranges)]
+    # byte counts stop at the start of the open-ended last record
+    last = max([record['start'] for record in records if record['end'] is None] or [None])
+    def size(start,end):
+        return (last if end is None else end + 1) - start
+    needed = sum(size(start,end) for start,end in \
+        set((record['start'],record['end']) for record in records))
+    planned = sum(size(start,end) for start,end in ranges)
+    return {'requests':requests,'needed':needed,'planned':planned,'extra':planned - needed,\
+        'openended':any(end is None for start,end in ranges)}
+
+# value of the HTTP Range header for a list of (start, end) ranges
+def rangeHeader(ranges):
+    return 'bytes=' + ','.join('%d-%s' % (start,'' if end is None else end) \
+        for start,end in ranges)
+
+# splits the body of a response to a range request into (first byte, data) parts. Handles a
+# multipart/byteranges reply (one part per range), a single 206 range, and a 200 reply with the
+# whole file (servers that ignore Range).
+def responseParts(status,headers,body):
+    if status == 200:
+        return [(0,body)]
+    contenttype = headers.get('Content-Type','')
+    boundary = re.search(r'boundary="?([^";]+)"?',contenttype)
+    if not contenttype.startswith('multipart/byteranges') or boundary is None:
+        match = re.match(r'bytes (\d+)-',headers.get('Content-Range',''))
+        if match is None:
+            raise ValueError('range reply without a Content-Range header')
+        return [(int(match.group(1)),body)]
+
+    parts = []
+    delimiter = b'--' + boundary.group(1).encode('ascii')
+    for chunk in body.split(delimiter)[1:]:
+        if chunk.startswith(b'--'):
+            break
+        head,sep,data = chunk.partition(b'\r\n\r\n')
+        match = re.search(br'Content-Range:\s*bytes (\d+)-',head,re.IGNORECASE)
+        if not sep or match is None:
+            raise ValueError('bad part in multipart/byteranges reply')
+        # the part data is followed by the CRLF that starts the next delimiter
+        parts.append((int(match.group(1)),data[:-2] if data.endswith(b'\r\n') else data))
+    return parts
+
+# cuts the bytes for each record out of the fetched parts. Returns the records' data in file
+# order (records sharing an offset only once), dropping anything fetched between them.
+def cutRecords(parts,records):
+    chunks = []
+    for start,end in sorted(set((record['start'],record['end']) for record in records)):
+        for first,data in parts:
+            last = first + len(data) - 1
+            if first <= start <= last and (end is None or end <= last):
+                chunks.append(data[start - first:None if end is None else end - first + 1])
+                break
+        else:
+            raise ValueError('bytes %d-%s were not in the reply' % (start,end))
+    return chunks
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Plan the byte-range requests for a GRIB file.')
+    parser.add_argument('idxfile',help='wgrib inventory (.idx) file')
+    parser.add_argument('--analysis',action='store_true',\
+        help='use the initial time fields')
+    parser.add_argument('--variables',default=','.join(products),\
+        help='comma-separated variables to fetch the fields for (see derivedvars.py)')
+    parser.add_argument('--nomaps',action='store_true',\
+        help='leave out the fields only the gefsmaps.py maps need')
+    parser.add_argument('--gap',type=int,default=0,\
+        help='merge ranges with no more than this many bytes between them')
+    parser.add_argument('--maxranges',type=int,default=1,help='ranges per request')
+    args = parser.parse_args()
+
+    with open(args.idxfile) as f:
+        records = parseInventory(f.read())
+    try:
+        fields = downloadFields(args.variables.split(','),args.analysis,not args.nomaps)
+    except ValueError as err:
+        parser.error(str(err))
+    selected = selectFields(records,fields)
+    for record in selected:
+        print(record['line'])
+    plan = planRequests(selected,args.gap,args.maxranges)
+    for ranges in plan['requests']:
+        print('Range: %s' % rangeHeader(ranges))
+    print('%d of %d records, %d ranges in %d requests: %d bytes needed, %d planned '\
+        '(%d extra)%s' % (len(selected),len(records),sum(len(r) for r in plan['requests']),\
+        len(plan['requests']),plan['needed'],plan['planned'],plan['extra'],\
+        ' plus the last record' if plan['openended'] else ''))
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+''' Grid spatial index for pulling point values out of GRIB fields. For each grid definition, the
+    grid cells (and interpolation weights) for every configured location are worked out once,
+    saved to disk, and reused for every file on that grid, so pulling the points out of a field
+    is just a gather and a weighted sum. Regular lat/lon grids (the 1.0, 0.5, and 0.25 degree
+    GEFS grids) are indexed analytically; anything else falls back to a nearest-neighbour search
+    over the grid's latitudes and longitudes. The rows and columns covering a lat/lon box (for
+    the gefsmaps.py regional maps) are worked out the same way, once per grid.
+'''
+
+import hashlib
+import numpy as np
+import os
+
+from gribindex import gridKey,gridLatLons
+
+__author__ = 'Jason Godwin'
+__license__ = 'GPL'
+__maintainer__ = 'Jason Godwin'
+__email__ = 'jasonwgodwin@gmail.com'
+__status__ = 'Production'
+
+# interpolation methods and the number of grid points each one uses per location
+methods = {'nearest':1,'bilinear':4}
+
+# site weights already loaded/computed in this process, keyed by grid, sites, and method
+_weights = {}
+
+# map domain windows already worked out in this process, keyed by grid and domain
+_windows = {}
+
+# reads the layout of a regular lat/lon grid from a GRIB message (None for any other grid)
+def gridDefinition(grb):
+    if grb['gridType'] != 'regular_ll':
+        return None
+    griddef = {}
+    griddef['nlat'] = grb['Nj']
+    griddef['nlon'] = grb['Ni']
+    griddef['lat1'] = grb['latitudeOfFirstGridPointInDegrees']
+    griddef['lon1'] = grb['longitudeOfFirstGridPointInDegrees']
+    # latitude/longitude step between rows/columns (negative if the grid runs north to south)
+    griddef['dlat'] = grb['jDirectionIncrementInDegrees']
+    if not grb['jScansPositively']:
+        griddef['dlat'] = -griddef['dlat']
+    griddef['dlon'] = grb['iDirectionIncrementInDegrees']
+    if grb['iScansNegatively']:
+        griddef['dlon'] = -griddef['dlon']
+    # global grids wrap around in longitude
+    griddef['cyclic'] = abs(griddef['nlon'] * griddef['dlon']) >= 360.0 - 1e-6
+    return griddef
+
+# computes the flat grid indices and weights for each location on a regular lat/lon grid. Returns
+# two [site, point] arrays (one point per location for nearest, four for bilinear).
+def regularWeights(griddef,sitelats,sitelons,method):
+    # fractional row/column of each location
+    rows = (np.asarray(sitelats,dtype=float) - griddef['lat1']) / griddef['dlat']
+    offsets = np.asarray(sitelons,dtype=float) - griddef['lon1']
+    if griddef['dlon'] < 0:
+        offsets = -offsets
+    cols = np.mod(offsets,360.0) / abs(griddef['dlon'])
+
+    if method == 'nearest':
+        row = np.clip(np.round(rows).astype(int),0,griddef['nlat'] - 1)
+        col = np.round(cols).astype(int)
+        col = np.mod(col,griddef['nlon']) if griddef['cyclic'] else \
+            np.clip(col,0,griddef['nlon'] - 1)
+        return (row * griddef['nlon'] + col)[:,np.newaxis],np.ones([len(row),1])
+
+    # bilinear - the four surrounding grid points weighted by distance
+    row0 = np.clip(np.floor(rows).astype(int),0,griddef['nlat'] - 2)
+    col0 = np.floor(cols).astype(int)
+    fr = np.clip(rows - row0,0.0,1.0)
+    fc = cols - col0
+    if griddef['cyclic']:
+        col0 = np.mod(col0,griddef['nlon'])
+        col1 = np.mod(col0 + 1,griddef['nlon'])
+    else:
+        col0 = np.clip(col0,0,griddef['nlon'] - 2)
+        col1 = col0 + 1
+        fc = np.clip(cols - col0,0.0,1.0)
+    row1 = row0 + 1
+    nlon = griddef['nlon']
+    indices = np.stack([row0 * nlon + col0,row0 * nlon + col1,row1 * nlon + col0,\
+        row1 * nlon + col1],axis=1)
+    weights = np.stack([(1 - fr) * (1 - fc),(1 - fr) * fc,fr * (1 - fc),fr * fc],axis=1)
+    return indices,weights
+
+# nearest grid point for each location on an arbitrary grid, by straight-line distance between
+# points on the unit sphere
+def searchWeights(lats,lons,sitelats,sitelons):
+    def unitVectors(lat,lon):
+        lat = np.radians(lat)
+        lon = np.radians(lon)
+        return np.stack([np.cos(lat) * np.cos(lon),np.cos(lat) * np.sin(lon),np.sin(lat)],axis=-1)
+    grid = unitVectors(lats.ravel(),lons.ravel())
+    sites = unitVectors(np.asarray(sitelats,dtype=float),np.asarray(sitelons,dtype=float))
+    indices = np.array([np.argmax(grid.dot(site)) for site in sites],dtype=int)
+    return indices[:,np.newaxis],np.ones([len(indices),1])
+
+# returns the cached grid indices and weights for every location on a message's grid, computing
+# and saving them to cachedir (if given) the first time the grid/site/method combination is seen
+def siteWeights(grb,sitelats,sitelons,method='nearest',cachedir=None):
+    if method not in methods:
+        raise ValueError('unknown interpolation method: %s' % method)
+    key = (gridKey(grb),tuple(sitelats),tuple(sitelons),method)
+    if key in _weights:
+        return _weights[key]
+
+    # try the copy on disk
+    filename = None
+    if cachedir is not None:
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        filename = os.path.join(cachedir,'grid_%s.npz' % digest)
+        if os.path.exists(filename):
+            cached = np.load(filename)
+            _weights[key] = (cached['indices'],cached['weights'])
+            return _weights[key]
+
+    griddef = gridDefinition(grb)
+    if griddef is not None:
+        indices,weights = regularWeights(griddef,sitelats,sitelons,method)
+    elif method == 'nearest':
+        lats,lons,saved = gridLatLons(grb)
+        indices,weights = searchWeights(lats,lons,sitelats,sitelons)
+    else:
+        raise ValueError('%s interpolation needs a regular lat/lon grid' % method)
+
+    # save it (write to a temporary file first so other processes never see half a file)
+    if filename is not None:
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir,exist_ok=True)
+        tmpname = '%s.%d.tmp.npz' % (filename[:-4],os.getpid())
+        np.savez(tmpname,indices=indices,weights=weights)
+        os.replace(tmpname,filename)
+
+    _weights[key] = (indices,weights)
+    return _weights[key]
+
+# pulls the values at every location out of a field: gather the grid points, then weight them
+def gatherPoints(field,cells):
+    indices,weights = cells
+    return np.sum(np.asarray(field).ravel()[indices] * weights,axis=1)
+
+# returns the rows and columns of a message's grid inside domain (south, north, west, east in
+# degrees, west/east may be negative), plus the latitude of each row and the longitude (-180 to
+# 180, increasing across the window) of each column. Only works on regular lat/lon grids. The
+# window can cross the prime meridian or the date line.
+def domainWindow(grb,domain):
+    key = (gridKey(grb),tuple(domain))
+    if key in _windows:
+        return _windows[key]
+    griddef = gridDefinition(grb)
+    if griddef is None:
+        raise ValueError('maps need a regular lat/lon grid')
+    south,north,west,east = domain
+
+    lats = griddef['lat1'] + griddef['dlat'] * np.arange(griddef['nlat'])
+    rows = np.nonzero((lats >= south) & (lats <= north))[0]
+    # distance east of the west edge of each column, so the window stays in one piece when it
+    # crosses longitude 0 or 180
+    lons = griddef['lon1'] + griddef['dlon'] * np.arange(griddef['nlon'])
+    offsets = np.mod(lons - west,360.0)
+    inside = np.nonzero(offsets <= np.mod(east - west,360.0))[0]
+    cols = inside[np.argsort(offsets[inside],kind='stable')]
+    if len(rows) == 0 or len(cols) == 0:
+        raise ValueError('map domain %s has no grid points' % (domain,))
+
+    _windows[key] = (rows,cols,lats[rows],west + offsets[cols])
+    return _windows[key]
+
+# cuts a domainWindow out of a [lat, lon] field
+def cropField(field,window):
+    rows,cols,lats,lons = window
+    return np.asarray(field)[np.ix_(rows,cols)]
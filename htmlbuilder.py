@@ -1,7 +1,11 @@
 #!/usr/bin/env python
 ''' Creates GEFS plots for a single location. Plots include high temperature, low temperature,
-    dewpoint, and precipitation. Program reads in CSV file created by ensemblemeans.py. Will
-    eventually create some HTML tables.
+    dewpoint, and precipitation. Program reads in the cube file (or the CSV files) created by
+    ensemblemeans.py. Also writes an HTML page with tables of every member for each location,
+    plus an index page (see htmlpages.py). If there is a climatology index (see climatology.py),
+    the normals go on the plots and each variable gets a plot of the departures from normal. Once
+    the cycle store (see cyclestore.py) has earlier cycles in it, there are also time-lagged
+    ensemble box plots and plots of how each day's forecast changed from run to run.
 '''
 
 import calendar
@@ -11,19 +15,37 @@ matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 import numpy
+import os
 import pandas
 
+from climatology import Climatology
+from cubestore import memberNames,openCube,siteIndex
+from cyclestore import CycleStore
+from dailyaggregate import dailyvariables,siteDaily
+from ensemblestats import EnsembleStats
+from htmlpages import SitePages
+from renderpool import renderJobs
+from runmetrics import RunMetrics
+from stations import loadSites
+
 __author__ = 'Jason Godwin'
 __license__  = 'GPL'
 __maintainer__ = 'Jason Godwin'
 __email__ = 'jasonwgodwin@gmail.com'
 __status__ = 'Production'
 
+# draws the climatological normals (if there are any) as a thick dashed line with a legend entry
+def normal_line(ax,normal):
+    if normal is not None:
+        ax.plot(normal.index,normal.values,'k--',linewidth=3,label='Normal')
+        ax.legend(loc='upper right',fontsize=12)
+
 # function for plotting ensemble members
-def plotter(dataset,namestr,savestr,season,inittime):
+def plotter(dataset,namestr,savestr,season,inittime,normal=None):
     fig = plt.figure(figsize=(12,8))
     ax = fig.add_subplot(1,1,1)
     plt.plot(dataset)
+    normal_line(ax,normal)
     plt.grid()
 
     # x axis
@@ -52,10 +74,11 @@ def plotter(dataset,namestr,savestr,season,inittime):
     plt.close(fig)
 
 # function for plotting precipitation in ensemble members
-def precip_plotter(dataset,namestr,savestr,inittime):
+def precip_plotter(dataset,namestr,savestr,inittime,normal=None):
     fig = plt.figure(figsize=(12,8))
     ax = fig.add_subplot(1,1,1)
     plt.plot(numpy.cumsum(dataset))
+    normal_line(ax,None if normal is None else normal.cumsum())
     plt.grid()
 
     # x axis
@@ -74,13 +97,22 @@ def precip_plotter(dataset,namestr,savestr,inittime):
     plt.close(fig)
 
 # box and whisker plot function
-def box_and_whisker(dataset,valid_dates,datatype,unitstr,namestr,savestr,inittime):
+def box_and_whisker(dataset,valid_dates,datatype,unitstr,namestr,savestr,inittime,normal=None):
     # reformat the date labels
     valid_dates = [datetime.datetime.strftime(x,'%a %b-%d') for x in sorted(valid_dates)]
 
+    # box and whiskers from the member percentiles for each day (dataset is [day, member]), with
+    # the whiskers covering the full range of the members
+    pcts = EnsembleStats(dataset,memberaxis=1).percentiles([0,25,50,75,100])
+    boxes = [{'whislo':pcts[0,i],'q1':pcts[1,i],'med':pcts[2,i],'q3':pcts[3,i],\
+        'whishi':pcts[4,i],'fliers':[],'label':label} for i,label in enumerate(valid_dates)]
+
     fig = plt.figure(figsize=(12,8))
     ax = fig.add_subplot(1,1,1)
-    plt.boxplot(numpy.transpose(numpy.array(dataset)),whis='range',labels=valid_dates)
+    ax.bxp(boxes)
+    if normal is not None:
+        ax.plot(numpy.arange(1,len(boxes) + 1),normal.values,'kD',markersize=8,label='Normal')
+        ax.legend(loc='upper right',fontsize=12)
     plt.grid()
 
     # x axis
@@ -104,129 +136,325 @@ def box_and_whisker(dataset,valid_dates,datatype,unitstr,namestr,savestr,inittim
     plt.savefig(savestr,bbox_inches='tight')
     plt.close(fig)
 
+# function for plotting the percent of members containing precipitation
+def precip_percent_plotter(precip,valid_dates,locname,savestr,inittime):
+    # fraction of members with any precipitation each day (precip is [day, member])
+    stats = EnsembleStats(precip,memberaxis=1)
+    precip_members = stats.exceedance([0.0])[0]
+
+    # actual plot routine
+    fig = plt.figure(figsize=(12,8))
+    ax = fig.add_subplot(1,1,1)
+    plt.bar(valid_dates,precip_members,width=0.5,align='center')
+    plt.grid()
+
+    # add ensmble mean values to top of bars
+    rects = ax.patches
+    labels = ['%.02f' % x for x in stats.mean()]
+    for rect,label in zip(rects,labels):
+        height = rect.get_height()
+        ax.text(rect.get_x() + rect.get_width()/2, height + 0.01, label, ha='center', va='bottom',\
+        fontsize=12)
+
+    # x axis
+    plt.xticks(rotation=90)
+    plt.xlim(valid_dates[0],valid_dates[-1])
+    plt.xlabel('Date/Time (UTC)',fontsize=14)
+    ax.xaxis.set_major_locator(mdates.DayLocator(interval=1))
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%a %b-%d'))
+
+    # y axis and title
+    plt.ylabel('Percent of Members',fontsize=14)
+    plt.ylim([0,1])
+    plt.yticks(numpy.arange(0,1,0.1))
+    vals = ax.get_yticks()
+    ax.set_yticklabels(['{:.0f}%'.format(x*100) for x in vals])
+    plt.title('GEFS Members Indicating Precipitation at %s (init: %s)' % (locname,inittime),\
+        fontsize=16)
+    plt.savefig(savestr,bbox_inches='tight')
+    plt.close(fig)
+
+# function for plotting each day's departure from normal (ensemble mean, with the range of the
+# members) and the fraction of members above the 90th (up) and below the 10th (down) percentile
+# of the climatology
+def climo_plotter(anomaly,rank,namestr,unitstr,savestr,inittime):
+    fig,(ax1,ax2) = plt.subplots(2,1,figsize=(12,10),sharex=True)
+    x = numpy.arange(len(anomaly.index))
+
+    # ensemble mean anomaly, red above normal and blue below
+    stats = EnsembleStats(anomaly,memberaxis=1)
+    mean = stats.mean()
+    low,high = stats.percentiles([0,100])
+    ax1.bar(x,mean,width=0.6,color=numpy.where(mean >= 0,'tab:red','tab:blue'))
+    ax1.errorbar(x,mean,yerr=[mean - low,high - mean],fmt='none',ecolor='k',capsize=4)
+    ax1.axhline(0.0,color='k')
+    ax1.grid()
+    ax1.set_ylabel('Departure from Normal (%s)' % unitstr,fontsize=14)
+    ax1.set_title('GEFS Ensemble Daily %s vs. Normal (init: %s)' % (namestr,inittime),fontsize=16)
+
+    # members in the tails of the climatology
+    ranks = numpy.asarray(rank,dtype=float)
+    members = numpy.maximum(numpy.sum(~numpy.isnan(ranks),axis=1),1)
+    below = numpy.sum(ranks < 10.0,axis=1) / members
+    above = numpy.sum(ranks > 90.0,axis=1) / members
+    ax2.bar(x,above,width=0.6,color='tab:red',label='Above 90th percentile')
+    ax2.bar(x,-below,width=0.6,color='tab:blue',label='Below 10th percentile')
+    ax2.axhline(0.0,color='k')
+    ax2.grid()
+    ax2.set_ylim([-1,1])
+    ax2.set_yticks(numpy.arange(-1,1.01,0.25))
+    ax2.set_yticklabels(['{:.0f}%'.format(abs(y) * 100) for y in numpy.arange(-1,1.01,0.25)])
+    ax2.set_ylabel('Percent of Members',fontsize=14)
+    ax2.legend(loc='upper right',fontsize=12)
+
+    # x axis
+    ax2.set_xticks(x)
+    ax2.set_xticklabels([day.strftime('%a %b-%d') for day in anomaly.index],rotation=90)
+    ax2.set_xlabel('Date',fontsize=14)
+    plt.savefig(savestr,bbox_inches='tight')
+    plt.close(fig)
+
+# function for plotting how the ensemble mean for each day changed from run to run (dprog/dt).
+# table is [run, day] with the runs' initial times as the index.
+def trend_plotter(table,namestr,unitstr,savestr,inittime):
+    fig = plt.figure(figsize=(12,8))
+    ax = fig.add_subplot(1,1,1)
+    colors = plt.cm.viridis(numpy.linspace(0.0,0.9,max(len(table.columns),1)))
+    for day,color in zip(table.columns,colors):
+        ax.plot(table.index,table[day].values,'o-',color=color,linewidth=2,\
+            label=day.strftime('%a %b-%d'))
+    plt.grid()
+
+    # x axis
+    plt.xticks(table.index,[run.strftime('%m/%d %HZ') for run in table.index],rotation=90)
+    plt.xlabel('Run (UTC)',fontsize=14)
+
+    # y axis, legend, and title
+    plt.ylabel('Ensemble Mean (%s)' % unitstr,fontsize=14)
+    plt.legend(title='Valid Day',loc='center left',bbox_to_anchor=(1.0,0.5),fontsize=12)
+    plt.title('GEFS Ensemble Mean Daily %s by Run (init: %s)' % (namestr,inittime),fontsize=16)
+    plt.savefig(savestr,bbox_inches='tight')
+    plt.close(fig)
+
+# reads the ensemble member data for one location from the CSVs ensemblemeans.py wrote to savedir
+# (for runs from before the cube file)
+def readCSVs(savedir):
+    # open CSVs containing ensemble information
+    max_temp_df = pandas.read_csv('%s/maxtemps.csv' % savedir,index_col=0)
+    min_temp_df = pandas.read_csv('%s/mintemps.csv' % savedir,index_col=0)
+    dpt_df = pandas.read_csv('%s/dewpoint.csv' % savedir,index_col=0)
+    precip_df = pandas.read_csv('%s/precip.csv' % savedir,index_col=0)
+
+    # convert index strings into datetime objects
+    max_temp_df.index = pandas.to_datetime(max_temp_df.index)
+    min_temp_df.index = pandas.to_datetime(min_temp_df.index)
+    dpt_df.index = pandas.to_datetime(dpt_df.index)
+    precip_df.index = pandas.to_datetime(precip_df.index)
+    return max_temp_df,min_temp_df,dpt_df,precip_df
+
+# builds the same DataFrames as readCSVs from one location's [variable, member, lead] slice of the
+# cube file (no text parsing - the values come straight out of the memory-mapped array). columns
+# are the member names (see cubestore.memberNames).
+def cubeFrames(data,variables,vtimes,columns=None):
+    index = pandas.DatetimeIndex(vtimes,name='ValidTime')
+    column_headers = columns if columns is not None else memberNames(numpy.shape(data)[1])
+    return tuple(pandas.DataFrame(numpy.transpose(data[variables.index(var)]),index=index,\
+        columns=column_headers) for var in ['max_temp','min_temp','dpt','precip'])
+
+# climatology plots: daily variable, title, units, and file name
+climoplots = [('max_temp','High Temperature at %s','F','climo_highs.png'),\
+    ('min_temp','Low Temperature at %s','F','climo_lows.png'),\
+    ('dpt','Mean Dewpoint at %s','F','climo_dwpt.png'),\
+    ('precip','Precipitation at %s','in','climo_precip.png')]
+
+# time-lagged and trend plots: daily variable, title, units, box plot data type, and file name
+historyplots = [('max_temp','High Temperature at %s','degrees Fahrenheit','Temperature',\
+    'highs.png'),('min_temp','Low Temperature at %s','degrees Fahrenheit','Temperature',\
+    'lows.png'),('dpt','Mean Dewpoint at %s','degrees Fahrenheit','Dewpoint','dwpt.png'),\
+    ('precip','Precipitation at %s','inches','Precipitation','precip.png')]
+
+# stacks readCSVs/cubeFrames frames back into a one-site [site, variable, member, lead] cube and
+# aggregates it to days (see dailyaggregate.py) in time zone tz
+def dailySite(frames,tz='UTC'):
+    cube = numpy.stack([numpy.transpose(frame.values) for frame in frames])[numpy.newaxis]
+    return siteDaily(cube,dailyvariables,frames[0].index,[tz],frames[0].columns)[0]
+
+# opens the climatology index (see climatology.py) if there is one
+def loadClimatology(filename=None):
+    filename = climofile if filename is None else filename
+    if filename is None or not os.path.isfile(filename):
+        return None
+    return Climatology(filename)
+
+# compares one location's daily frames (see buildSite) with the climatology. Returns a
+# dictionary of (normals, anomalies, percentile ranks) for each daily variable the climatology
+# has for the location, the normals as a Series by day and the others as [day, member] frames.
+def siteClimate(climo,siteid,daily):
+    climate = {}
+    for var,frame in zip(dailyvariables,daily):
+        if climo is None or not climo.has(siteid,var) or frame.empty:
+            continue
+        normals = climo.normals(siteid,var,frame.index)
+        anomalies,ranks = climo.compare(siteid,var,frame.index,numpy.transpose(frame.values))
+        climate[var] = (pandas.Series(normals,index=frame.index,name='Normal'),\
+            pandas.DataFrame(numpy.transpose(anomalies),index=frame.index,columns=frame.columns),\
+            pandas.DataFrame(numpy.transpose(ranks),index=frame.index,columns=frame.columns))
+    return climate
+
+# drops the plot jobs whose data (the first argument) is an empty DataFrame. A run that doesn't
+# cover a whole day (e.g. a cycle with fewer than 24 hours of lead times) has no complete days, and
+# the plots can't set their axes from an empty index.
+def plottableJobs(jobs):
+    kept = [job for job in jobs if not job[1][0].empty]
+    if len(kept) < len(jobs):
+        print('skipping %d plot(s) with no complete days' % (len(jobs) - len(kept)))
+    return kept
+
+# time-lagged daily frames (like buildSite's) and dprog/dt trend tables (see
+# cyclestore.CycleStore.dailyTrends) for every location from the cycles in store, or (None, None)
+# for each location if there aren't at least two cycles stored
+def siteHistory(store,sites,tzs):
+    if store is None or len(store.cycles()) < 2:
+        return [(None,None)] * len(sites)
+    siteids = [site['id'] for site in sites]
+    vtimes,cube,columns = store.laggedCube(siteids,dailyvariables,lagcycles)
+    lagged = siteDaily(cube,dailyvariables,vtimes,tzs,columns)
+    return list(zip(lagged,store.dailyTrends(siteids,tzs,trendcycles)))
+
+# returns the jobs for one location's time-lagged ensemble box plots (lagged_*.png) and trend
+# plots (trend_*.png) from siteHistory
+def buildHistory(history,initdate,savedir,locname):
+    lagged,trends = history
+    if lagged is None:
+        return []
+    inittime = datetime.datetime.strftime(initdate,'%m/%d %H') + '00 UTC'
+    jobs = []
+    for var,title,unitstr,datatype,name in historyplots:
+        frame = lagged[dailyvariables.index(var)]
+        jobs.append((box_and_whisker,(frame,list(frame.index),datatype,unitstr,\
+            'Time-Lagged %s' % (title % locname),'%s/lagged_%s' % (savedir,name),inittime)))
+        # the days the newest run covers
+        table = trends[var]
+        days = [day for day in table.columns if not numpy.isnan(table[day].values[-1])]
+        jobs.append((trend_plotter,(table[days[:trenddays]],title % locname,unitstr,\
+            '%s/trend_%s' % (savedir,name),inittime)))
+    return plottableJobs(jobs)
+
+# returns the jobs for one location's plots. daily holds the daily high, low, mean dewpoint, and
+# precipitation DataFrames ([day, member], complete days only) from dailyaggregate.siteDaily or
+# dailySite, and initdate is the run's initial time. climate (from siteClimate) adds the normals
+# to the plots plus a plot of the departures from normal for each variable. The location's web
+# page is written separately (htmlpages.SitePages).
+def buildSite(daily,initdate,savedir,locname,season,climate=None):
+    highs,lows,dpts,precip = daily
+    climate = climate or {}
+    normal = dict((var,climate[var][0] if var in climate else None) for var in dailyvariables)
+
+    # days in each product (the periods before the initial time and after the end of the run only
+    # cover part of a day, so those days are already gone)
+    valid_dates = list(precip.index)
+    valid_dates_hi = list(highs.index)
+    valid_dates_lo = list(lows.index)
+    valid_dates_dp = list(dpts.index)
+    inittime = datetime.datetime.strftime(initdate,'%m/%d %H') + '00 UTC'
+
+    # plot forecasts (run by renderpool.renderJobs)
+    jobs = [(plotter,(highs,'High Temperature at %s' % locname,'%s/highs.png' % savedir,season,\
+        inittime,normal['max_temp'])),\
+        (plotter,(lows,'Low Temperature at %s' % locname,'%s/lows.png' % savedir,season,inittime,\
+        normal['min_temp'])),\
+        (plotter,(dpts,'Mean Daily Dewpoint at %s' % locname,'%s/dwpt.png' % savedir,'dwpt',\
+        inittime,normal['dpt'])),\
+        (precip_plotter,(precip,'Run-Total Precip. at %s' % locname,'%s/precip.png' % savedir,\
+        inittime,normal['precip'])),\
+        (precip_percent_plotter,(precip,valid_dates,locname,'%s/precip_percent.png' % savedir,\
+        inittime))]
+
+    # create box and whisker plots
+    jobs += [(box_and_whisker,(highs,valid_dates_hi,'Temperature','degrees Fahrenheit',\
+        'High Temperature at %s' % locname,'%s/box_highs.png' % savedir,inittime,\
+        normal['max_temp'])),\
+        (box_and_whisker,(lows,valid_dates_lo,'Temperature','degrees Fahrenheit',\
+        'Low Temperature at %s' % locname,'%s/box_lows.png' % savedir,inittime,\
+        normal['min_temp'])),\
+        (box_and_whisker,(dpts,valid_dates_dp,'Dewpoint','degrees Fahrenheit',\
+        'Mean Dewpoint at %s' % locname,'%s/box_dwpt.png' % savedir,inittime,normal['dpt'])),\
+        (box_and_whisker,(precip,valid_dates,'Precipitation','inches',\
+        'Total Precip. at %s' % locname,'%s/box_precip.png' % savedir,inittime,\
+        normal['precip']))]
+
+    # departures from normal and percentile ranks against the climatology
+    for var,title,unitstr,name in climoplots:
+        if var in climate:
+            jobs.append((climo_plotter,(climate[var][1],climate[var][2],title % locname,\
+                unitstr,'%s/%s' % (savedir,name),inittime)))
+
+    return plottableJobs(jobs)
+
 ### USER EDIT SECTION ###
 savedir = '/home/jgodwin/Documents/python/python/gefs-plots'  # directory to save pngs
 locname = 'Dallas/Fort Worth, TX'                             # name of location to appear on plots
 season = 'warm'                                               # season to set temperature info
+stationfile = None                                            # CSV/JSON station list (optional)
+cubefile = savedir + '/gefs_cube.bin'                         # cube file from ensemblemeans.py
+renderworkers = 1                                             # plot processes (1 = serial)
+plotcache = savedir + '/plotcache'                            # rendered plot cache (None = off)
+plotcachesize = 200                                           # maximum plot cache size (MB)
+daytimezone = 'UTC'                                           # time zone days start in (or a tz
+                                                              # column in the station list)
+climofile = savedir + '/climatology.bin'                      # climatology.py index (used if it
+                                                              # exists)
+cycledir = savedir + '/cycles'                                # earlier cycles' cubes (see
+                                                              # cyclestore.py, None = off)
+lagcycles = 4                                                 # cycles in the time-lagged ensemble
+trendcycles = 8                                               # cycles in the trend plots
+trenddays = 7                                                 # days in the trend plots
+metricsdir = savedir + '/metrics'                             # timing/memory metrics (None = off)
+profile = False                                               # also write a flamegraph profile
 ### END USER EDIT SECTION ###
 
-# open CSVs containing ensemble information
-max_temp_df = pandas.read_csv('%s/maxtemps.csv' % savedir,index_col=0)
-min_temp_df = pandas.read_csv('%s/mintemps.csv' % savedir,index_col=0)
-dpt_df = pandas.read_csv('%s/dewpoint.csv' % savedir,index_col=0)
-precip_df = pandas.read_csv('%s/precip.csv' % savedir,index_col=0)
-
-# convert index strings into datetime objects
-max_temp_df.index = pandas.to_datetime(max_temp_df.index)
-min_temp_df.index = pandas.to_datetime(min_temp_df.index)
-dpt_df.index = pandas.to_datetime(dpt_df.index)
-precip_df.index = pandas.to_datetime(precip_df.index)
-
-# get individual dates and group max/min/mean values by date
-dates = [datetime.datetime.strftime(i,'%m/%d/%Y') for i in max_temp_df.index]
-highs = max_temp_df.groupby(lambda row: row.date()).max()
-lows = min_temp_df.groupby(lambda row: row.date()).min()
-dpts = dpt_df.groupby(lambda row: row.date()).mean()
-precip = precip_df.groupby(lambda row: row.date()).sum()
-
-# create list of valid dates and model run init time
-valid_dates = [datetime.datetime.strptime(x,'%m/%d/%Y') for x in sorted(set(dates))]
-inittime = datetime.datetime.strftime(max_temp_df.index[0],'%m/%d %H') + '00 UTC'
-
-# truncate highs/lows since we are computing on closed intervals
-# basically, if we don't do this, the 00Z runs will show a spike in high temperatures at the end
-# of the run, and the highs will show a drop at the end of a 12Z run
-if max_temp_df.index[0].hour == 0:
-    lows = lows[0:-2]
-    valid_dates_lo = valid_dates[0:-2]
-    valid_dates_hi = valid_dates
-elif max_temp_df.index[0].hour == 12:
-    highs = highs[0:-2]
-    valid_dates_hi = valid_dates[0:-2]
-    valid_dates_lo = valid_dates
-
-# plot forecasts
-plotter(highs,'High Temperature at %s' % locname,'%s/highs.png' % savedir,season,inittime)
-plotter(lows,'Low Temperature at %s' % locname,'%s/lows.png' % savedir,season,inittime)
-plotter(dpts,'Mean Daily Dewpoint at %s' % locname,'%s/dwpt.png' % savedir,'dwpt',inittime)
-precip_plotter(precip,'Run-Total Precip. at %s' % locname,'%s/precip.png' % savedir,inittime)
-
-### PERCENT OF MEMBERS CONTAINING PRECIPITATION ###
-precip_members = numpy.zeros(17)
-for i in range(numpy.shape(precip)[0]):
-    precip_members[i] = numpy.shape((numpy.where(numpy.array(precip)[i,:]>0)))[1] / 20.0
-
-# actual plot routine
-fig = plt.figure(figsize=(12,8))
-ax = fig.add_subplot(1,1,1)
-plt.bar(valid_dates,precip_members,width=0.5,align='center')
-plt.grid()
-
-# add ensmble mean values to top of bars
-rects = ax.patches
-labels = ['%.02f' % x for x in numpy.nanmean(numpy.array(precip),axis=1)]
-for rect,label in zip(rects,labels):
-    height = rect.get_height()
-    ax.text(rect.get_x() + rect.get_width()/2, height + 0.01, label, ha='center', va='bottom',\
-    fontsize=12)
-
-# x axis
-plt.xticks(rotation=90)
-plt.xlim(valid_dates[0],valid_dates[-1])
-plt.xlabel('Date/Time (UTC)',fontsize=14)
-ax.xaxis.set_major_locator(mdates.DayLocator(interval=1))
-ax.xaxis.set_major_formatter(mdates.DateFormatter('%a %b-%d'))
-
-# y axis and title
-plt.ylabel('Percent of Members',fontsize=14)
-plt.ylim([0,1])
-plt.yticks(numpy.arange(0,1,0.1))
-vals = ax.get_yticks()
-ax.set_yticklabels(['{:.0f}%'.format(x*100) for x in vals])
-plt.title('GEFS Members Indicating Precipitation at %s (init: %s)' % (locname,inittime),\
-    fontsize=16)
-plt.savefig('precip_percent.png',bbox_inches='tight')
-plt.close(fig)
-
-# create box and whisker plots
-box_and_whisker(highs,valid_dates_hi,'Temperature','degrees Fahrenheit','High Temperature at %s' % \
-    locname,'%s/box_highs.png' % savedir,inittime)
-box_and_whisker(lows,valid_dates_lo,'Temperature','degrees Fahrenheit','Low Temperature at %s' % \
-    locname,'%s/box_lows.png' % savedir,inittime)
-box_and_whisker(dpts,valid_dates,'Dewpoint','degrees Fahrenheit','Mean Dewpoint at %s' % locname,\
-    '%s/box_dwpt.png' % savedir,inittime)
-box_and_whisker(precip,valid_dates,'Precipitation','inches','Total Precip. at %s' % locname,\
-    '%s/box_precip.png' % savedir,inittime)
-
-##### vv THIS PART STILL UNDER CONSTRUCTION vv #######
-
-# create the webpage
-html_file = open('%s/dfw.html' % savedir,'w')
-
-# page header
-html_info = """ 
-    <html>
-    <head>
-        <title>GEFS Viewer</title>
-    </head>
-    <body>
-        <h1>GEFS Temperature Plot for DFW</h1>
-        <h2>Initialized: %s UTC</h2>
-    """ % datetime.datetime.strftime(max_temp_df.index[0],'%m/%d/%Y %H:%M')
-
-# create table header
-html_info += ''' 
-    <table border=1 cols=22 width=1200px>
-        <tr><th>Valid Time</th>
-'''
-
-# create columns for each ensemble member
-for i in range(1,21):
-    html_info += ''' 
-        <th>GEP %d</th>
-    ''' % i 
-
-html_info += '<th>Ensemble Mean</th></tr>'
-
-html_file.write(html_info)
-html_file.close()
+if __name__ == '__main__':
+    metrics = RunMetrics('htmlbuilder',profile=profile and metricsdir is not None)
+
+    # use the cube file if ensemblemeans.py wrote one, otherwise fall back to the CSVs
+    header,data = openCube(cubefile) if os.path.exists(cubefile) else (None,None)
+
+    # make the products for every location (just locname unless a station list is given)
+    sites = loadSites(stationfile,savedir,{'name':locname})
+    climo = loadClimatology()
+    tzs = [site.get('tz') or daytimezone for site in sites]
+    with metrics.stage('aggregate'):
+        if data is not None:
+            # every site's days in one go straight from the cube
+            ixs = [siteIndex(header,site['id']) for site in sites]
+            columns = memberNames(data.shape[2],header)
+            frames = [cubeFrames(data[ix],header['variables'],header['validtimes'],columns) \
+                for ix in ixs]
+            daily = siteDaily(data[ixs],header['variables'],header['validtimes'],tzs,columns)
+        else:
+            frames = [readCSVs(site['savedir']) for site in sites]
+            daily = [dailySite(siteframes,tz) for siteframes,tz in zip(frames,tzs)]
+        jobs = []
+        for site,sitedaily,siteframes in zip(sites,daily,frames):
+            jobs += buildSite(sitedaily,siteframes[0].index[0],site['savedir'],site['name'],\
+                site.get('season',season),siteClimate(climo,site['id'],sitedaily))
+
+    # time-lagged ensemble and trends from the earlier cycles
+    with metrics.stage('history'):
+        store = CycleStore(cycledir) if cycledir is not None else None
+        for site,history,siteframes in zip(sites,siteHistory(store,sites,tzs),frames):
+            jobs += buildHistory(history,siteframes[0].index[0],site['savedir'],site['name'])
+
+    # web pages for every location
+    with metrics.stage('html'):
+        pages = SitePages(savedir)
+        for site,siteframes in zip(sites,frames):
+            pages.add(site,siteframes)
+        pages.close()
+
+    # render all of the plots
+    with metrics.stage('plots'):
+        renderJobs(jobs,renderworkers,plotcache,plotcachesize * 1024 * 1024)
+
+    if metricsdir is not None:
+        metrics.write(metricsdir,datetime.datetime.strftime(frames[0][0].index[0],'%Y%m%d%H'))
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+''' HTML pages for the GEFS scripts. Each location gets a page with its plots and a table per
+    variable of every member's 6-hourly values plus the ensemble statistics (mean, median, spread,
+    minimum, maximum), and an index page links all of the locations with a summary of the next
+    24 hours. The page layout comes from a template file (templates/gefs.html) that is read and
+    compiled once into literal text and fields. The pages are then written piece by piece as
+    each location comes in, instead of being built up as one big string. Each page is written
+    under a temporary name and renamed into place, so a web server never serves half a page.
+'''
+
+import html
+import numpy as np
+import os
+import string
+import warnings
+
+from ensemblestats import EnsembleStats
+
+__author__ = 'Jason Godwin'
+__license__ = 'GPL'
+__maintainer__ = 'Jason Godwin'
+__email__ = 'jasonwgodwin@gmail.com'
+__status__ = 'Production'
+
+### USER SETTINGS BLOCK ###
+templatefile = os.path.join(os.path.dirname(os.path.abspath(__file__)),'templates','gefs.html')
+indexname = 'index.html'            # index page (in savedir)
+### END OF USER SETTINGS BLOCK ###
+
+# tables on each location's page: caption, variable (in the order of htmlbuilder's frames), and
+# the format of the values
+tables = [('6-Hour Maximum Temperature (F)',0,'%.0f'),\
+    ('6-Hour Minimum Temperature (F)',1,'%.0f'),('Dewpoint (F)',2,'%.0f'),\
+    ('6-Hour Precipitation (in)',3,'%.2f')]
+
+# ensemble statistic columns after the members
+statistics = ['Mean','Median','Spread','Min','Max']
+
+# what goes in a table cell with no data
+missing = '&ndash;'
+
+# splits a template into its fragments (each one starts at a '<!-- fragment NAME -->' line) and
+# compiles each fragment into a list of (literal text, field name, format spec) pieces. Anything
+# before the first fragment is a comment and is dropped.
+def compileTemplate(text):
+    fragments = {}
+    name = None
+    lines = []
+    for line in text.splitlines(True) + ['<!-- fragment end -->']:
+        if line.strip().startswith('<!-- fragment ') and line.strip().endswith('-->'):
+            if name is not None:
+                fragments[name] = [(literal,field,spec) for literal,field,spec,conversion \
+                    in string.Formatter().parse(''.join(lines))]
+            name = line.strip()[len('<!-- fragment '):-len('-->')].strip()
+            lines = []
+        else:
+            lines.append(line)
+    return fragments
+
+# reads and compiles a template file
+def loadTemplate(filename=templatefile):
+    with open(filename) as f:
+        return compileTemplate(f.read())
+
+# writes one compiled fragment to f, filling in the fields from values
+def writeFragment(f,fragment,values):
+    for literal,field,spec in fragment:
+        f.write(literal)
+        if field is not None:
+            f.write(format(values[field],spec))
+
+# formats a [row, column] array into table cells (with a class, if given), one string of cells
+# per row. Each row is formatted in one go with a format string for the whole row.
+def tableCells(values,fmt,cellclass=None):
+    opening = '<td>' if cellclass is None else '<td class="%s">' % cellclass
+    rowformat = (opening + fmt + '</td>') * np.shape(values)[1]
+    return [(rowformat % tuple(row)).replace('>nan<','>%s<' % missing) for row in values.tolist()]
+
+class SitePages(object):
+    ''' Writes the location pages and the index page for one run. The index page is opened when
+        the first location is added and gets a row for every location; close() finishes it.
+        savedir is where the index page goes.
+    '''
+
+    def __init__(self,savedir,template=None):
+        self.savedir = savedir
+        self.template = template if template is not None else loadTemplate()
+        self.index = None
+        self.count = 0
+
+    # writes the page for one location (a stations.loadSites dictionary) from htmlbuilder's max
+    # temperature, min temperature, dewpoint, and precipitation frames, and adds it to the index.
+    # Returns the page's path.
+    def add(self,site,frames):
+        vtimes = frames[0].index
+        inittime = vtimes[0].strftime('%m/%d/%Y %H:%M UTC')
+        if self.index is None:
+            self.index = self.openPage(os.path.join(self.savedir,indexname))
+            writeFragment(self.index[0],self.template['indexheader'],{'inittime':inittime})
+
+        page = os.path.join(site['savedir'],'%s.html' % site['id'])
+        output = self.openPage(page)
+        f = output[0]
+        name = html.escape(site['name'])
+        writeFragment(f,self.template['siteheader'],{'name':name,'inittime':inittime,\
+            'index':os.path.relpath(os.path.join(self.savedir,indexname),site['savedir'])})
+
+        times = [vtime.strftime('%a %m/%d %HZ') for vtime in vtimes]
+        for caption,var,fmt in tables:
+            frame = frames[var]
+            values = np.asarray(frame.values,dtype=float)
+            stats = EnsembleStats(values,memberaxis=1)
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore',RuntimeWarning)
+                lowhigh = [np.nanmin(values,axis=1),np.nanmax(values,axis=1)]
+            summary = np.stack([stats.mean(),stats.median(),stats.spread()] + lowhigh,axis=1)
+            columns = ''.join('<th>%s</th>' % html.escape(str(column).upper()) \
+                for column in frame.columns) + ''.join('<th>%s</th>' % x for x in statistics)
+            writeFragment(f,self.template['tableheader'],{'caption':caption,'columns':columns})
+            for time,members,extra in zip(times,tableCells(values,fmt),\
+                tableCells(summary,fmt,'stat')):
+                writeFragment(f,self.template['tablerow'],{'time':time,'cells':members + extra})
+            writeFragment(f,self.template['tablefooter'],{})
+        writeFragment(f,self.template['sitefooter'],{})
+        self.closePage(*output)
+
+        writeFragment(self.index[0],self.template['indexrow'],dict(self.outlook(frames),\
+            page=html.escape(os.path.relpath(page,self.savedir)),name=name,\
+            lat='%.3f' % site['lat'] if 'lat' in site else missing,\
+            lon='%.3f' % site['lon'] if 'lon' in site else missing))
+        self.count += 1
+        return page
+
+    # ensemble mean high, low, and precipitation over the next 24 hours (the periods ending after
+    # the initial time and no more than 24 hours after it) and for the whole run, formatted for
+    # the index page. Members with no data over a period are left out of its mean.
+    def outlook(self,frames):
+        highs,lows,dpts,precip = [np.asarray(frame.values,dtype=float) for frame in frames]
+        hours = (frames[0].index - frames[0].index[0]).total_seconds() / 3600.0
+        day = np.nonzero((hours > 0) & (hours <= 24))[0]
+        def total(values):
+            return np.where(np.isnan(values).all(axis=0),np.nan,np.nansum(values,axis=0))
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore',RuntimeWarning)
+            members = [np.nanmax(highs[day],axis=0),np.nanmin(lows[day],axis=0),\
+                total(precip[day]),total(precip)]
+        means = [float(EnsembleStats(values,memberaxis=0).mean()) for values in members]
+        return dict((key,missing if np.isnan(value) else fmt % value) for key,value,fmt in \
+            zip(['high','low','precip','runprecip'],means,['%.0f','%.0f','%.2f','%.2f']))
+
+    # finishes the index page
+    def close(self):
+        if self.index is not None:
+            writeFragment(self.index[0],self.template['indexfooter'],{'count':self.count})
+            self.closePage(*self.index)
+            self.index = None
+
+    # opens a page under a temporary name, returning the file, the temporary name, and the name
+    def openPage(self,filename):
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        tmpname = '%s.%d.tmp' % (filename,os.getpid())
+        return open(tmpname,'w',encoding='utf-8',buffering=1 << 16),tmpname,filename
+
+    # closes a page and renames it into place
+    def closePage(self,f,tmpname,filename):
+        f.close()
+        os.replace(tmpname,filename)
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+''' Content-addressed cache of rendered plots. Every plot job (see renderpool.py) gets a key made
+    from a hash of everything that goes into its image: the plot function's code, the settings it
+    reads from its module (colormaps, titles, limits), the code and settings of every function and
+    class from these scripts that it uses (e.g. htmlbuilder.normal_line or EnsembleStats, and
+    whatever they use in turn), the matplotlib version, and all of its arguments (the data slices,
+    labels, and limits) except the file names it writes to. Library code (numpy, matplotlib
+    apart from its version) isn't followed. When a
+    job's key is already in the cache its images are copied out instead of being drawn again,
+    e.g. on a rerun after a download hiccup or for a location whose values didn't change. After
+    a job is drawn its images are copied into the cache. The cache directory is trimmed to a
+    size limit at the end of each render, least recently used entries first (the same as the
+    decode cache).
+
+    Arguments the key can't be worked out for (anything without a stable value, like an open
+    file) just make the job skip the cache.
+'''
+
+import datetime
+import hashlib
+import json
+import matplotlib
+import numpy as np
+import os
+import pandas
+import shutil
+import sys
+import types
+
+__author__ = 'Jason Godwin'
+__license__ = 'GPL'
+__maintainer__ = 'Jason Godwin'
+__email__ = 'jasonwgodwin@gmail.com'
+__status__ = 'Production'
+
+# bump this to throw away every cached image (e.g. after changing a font or the dpi, or a
+# library the plots use other than matplotlib)
+cacheversion = 1
+
+# directory of the scripts: the key follows the functions and classes defined in modules here
+scriptdir = os.path.dirname(os.path.abspath(__file__))
+
+# file types a plot job's output arguments end in
+imagetypes = ('.png','.jpg','.svg','.pdf')
+
+# whether a job argument is the name of a file it writes
+def isOutput(arg):
+    return isinstance(arg,str) and arg.lower().endswith(imagetypes)
+
+# the names of the files a job writes
+def outputPaths(args):
+    return [arg for arg in args if isOutput(arg)]
+
+# adds a value to a hash. Arrays, frames, and series add their dtype, shape, and bytes (or their
+# items for object arrays), and containers add every item. Raises TypeError for anything else.
+def digestValue(digest,value):
+    if value is None or isinstance(value,(bool,int,float,str,bytes,range)):
+        digest.update(('%s:%r;' % (type(value).__name__,value)).encode('utf-8'))
+    elif isinstance(value,(datetime.datetime,datetime.date,pandas.Timestamp)):
+        digest.update(('time:%s;' % value.isoformat()).encode('utf-8'))
+    elif isinstance(value,(np.ndarray,np.generic)):
+        value = np.asarray(value)
+        digest.update(('array:%s:%s;' % (value.dtype.str,value.shape)).encode('utf-8'))
+        if value.dtype == object:
+            for item in value.ravel():
+                digestValue(digest,item)
+        else:
+            digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value,pandas.DataFrame):
+        digest.update(b'frame;')
+        for part in (value.values,value.index,value.columns):
+            digestValue(digest,part)
+    elif isinstance(value,pandas.Series):
+        digest.update(b'series;')
+        for part in (value.values,value.index,value.name):
+            digestValue(digest,part)
+    elif isinstance(value,pandas.Index):
+        digestValue(digest,np.asarray(value))
+    elif isinstance(value,(list,tuple)):
+        digest.update(('%s:%d;' % (type(value).__name__,len(value))).encode('utf-8'))
+        for item in value:
+            digestValue(digest,item)
+    elif isinstance(value,dict):
+        digest.update(('dict:%d;' % len(value)).encode('utf-8'))
+        for key in sorted(value,key=repr):
+            digestValue(digest,key)
+            digestValue(digest,value[key])
+    else:
+        raise TypeError('no cache key for a %s' % type(value).__name__)
+
+# adds a function's code (and the code of any functions defined in it) to a hash. Returns the
+# global names the code uses.
+def digestCode(digest,code):
+    digest.update(code.co_code)
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const,types.CodeType):
+            names |= digestCode(digest,const)
+        else:
+            digest.update(repr(const).encode('utf-8'))
+    digest.update(repr(code.co_names).encode('utf-8'))
+    return names
+
+# whether a function or class is defined in one of the scripts (not in a library)
+def isScript(value):
+    module = sys.modules.get(getattr(value,'__module__',None))
+    filename = getattr(module,'__file__',None)
+    return filename is not None and os.path.dirname(os.path.abspath(filename)) == scriptdir
+
+# adds a function's code and defaults to a hash, along with the settings it reads from its module
+# (plain values only) and, followed once each (seen), the functions and classes from the scripts
+# it uses. Raises TypeError for a setting that can't be hashed.
+def digestFunction(digest,function,seen):
+    if function in seen:
+        return
+    seen.add(function)
+    digestValue(digest,'%s.%s' % (function.__module__,function.__qualname__))
+    names = digestCode(digest,function.__code__)
+    digestValue(digest,function.__defaults__)
+    for name in sorted(names):
+        value = function.__globals__.get(name)
+        if isinstance(value,(bool,int,float,str,list,tuple,dict)):
+            digestValue(digest,name)
+            digestValue(digest,value)
+        elif isinstance(value,types.FunctionType) and isScript(value):
+            digestFunction(digest,value,seen)
+        elif isinstance(value,type) and isScript(value):
+            digestClass(digest,value,seen)
+
+# adds a class from the scripts to a hash: its plain-valued class attributes and the code of its
+# methods (see digestFunction), and the same for its base classes from the scripts
+def digestClass(digest,cls,seen):
+    if cls in seen:
+        return
+    seen.add(cls)
+    digestValue(digest,'%s.%s' % (cls.__module__,cls.__qualname__))
+    for base in cls.__bases__:
+        if isScript(base):
+            digestClass(digest,base,seen)
+    for name,value in sorted(vars(cls).items()):
+        if isinstance(value,(staticmethod,classmethod)):
+            value = value.__func__
+        if isinstance(value,property):
+            for method in (value.fget,value.fset,value.fdel):
+                if method is not None:
+                    digestFunction(digest,method,seen)
+        elif isinstance(value,types.FunctionType):
+            digestFunction(digest,value,seen)
+        elif isinstance(value,(bool,int,float,str,list,tuple,dict)):
+            digestValue(digest,name)
+            digestValue(digest,value)
+
+# cache key of a plot job, or None if it can't be cached (or doesn't write any files)
+def jobKey(job):
+    function,args = job
+    if not outputPaths(args):
+        return None
+    digest = hashlib.sha1(('%d:%s;' % (cacheversion,matplotlib.__version__)).encode('utf-8'))
+    try:
+        digestFunction(digest,function,set())
+        for arg in args:
+            digestValue(digest,'<output>' if isOutput(arg) else arg)
+    except TypeError:
+        return None
+    return digest.hexdigest()
+
+# path of a cached image (spread over subdirectories so no single directory gets huge) and of
+# the entry's description
+def entryPath(cachedir,key,number):
+    return os.path.join(cachedir,key[0:2],'%s_%d.img' % (key,number))
+
+def infoPath(cachedir,key):
+    return os.path.join(cachedir,key[0:2],key + '.json')
+
+# copies a file under a temporary name and renames it into place
+def copyFile(source,destination):
+    if not os.path.isdir(os.path.dirname(os.path.abspath(destination))):
+        os.makedirs(os.path.dirname(os.path.abspath(destination)),exist_ok=True)
+    tmpname = '%s.%d.tmp' % (destination,os.getpid())
+    shutil.copyfile(source,tmpname)
+    os.replace(tmpname,destination)
+
+# copies a cached job's images to the job's output files. Returns the seconds the job took to
+# draw when it was cached, or None on a miss. Hits get their modification times bumped so
+# eviction drops the least recently used entries.
+def loadEntry(cachedir,key,outputs):
+    paths = [entryPath(cachedir,key,number) for number in range(len(outputs))]
+    try:
+        with open(infoPath(cachedir,key)) as f:
+            info = json.load(f)
+        if info['outputs'] != len(outputs):
+            return None
+        for path,output in zip(paths,outputs):
+            copyFile(path,output)
+    except (IOError,OSError,ValueError,KeyError):
+        return None
+    for path in paths + [infoPath(cachedir,key)]:
+        os.utime(path,None)
+    return info['seconds']
+
+# copies a job's images into the cache, along with how long they took to draw
+def storeEntry(cachedir,key,outputs,seconds):
+    for number,output in enumerate(outputs):
+        copyFile(output,entryPath(cachedir,key,number))
+    tmpname = '%s.%d.tmp' % (infoPath(cachedir,key),os.getpid())
+    with open(tmpname,'w') as f:
+        json.dump({'outputs':len(outputs),'seconds':seconds},f)
+    os.replace(tmpname,infoPath(cachedir,key))
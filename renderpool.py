@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+''' Plot render scheduler for the GEFS scripts. A plot job is a (function, args) tuple, e.g.
+    (plotter, (highs, namestr, savestr, season, inittime)) from htmlbuilder.py or
+    (tempPlot, (vtimes, ...)) from ensemblemeans.py. renderJobs runs a list of them either one
+    after another in this process or on a pool of worker processes. Each worker sets up the Agg
+    backend and draws a throwaway figure once when it starts (fonts, text layout caches), so the
+    real plots don't pay for that. The plot functions are the same either way, so the images are
+    identical to the serial render. A long-running process (gefsdaemon.py) can call keepPool
+    once to start a warmed pool that every later renderJobs call reuses. With a cache directory,
+    jobs whose inputs haven't changed since they were last drawn are copied out of the render
+    cache instead (see rendercache.py).
+'''
+
+import functools
+import io
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import multiprocessing
+import time
+
+import rendercache
+from decodecache import evictCache
+
+__author__ = 'Jason Godwin'
+__license__ = 'GPL'
+__maintainer__ = 'Jason Godwin'
+__email__ = 'jasonwgodwin@gmail.com'
+__status__ = 'Production'
+
+# long-lived worker pool (see keepPool), None when every renderJobs call starts its own
+_pool = None
+
+# sets up a worker: Agg backend, plus one throwaway figure to load the fonts and fill the caches
+def warmWorker():
+    matplotlib.use('Agg')
+    fig = plt.figure(figsize=(12,8))
+    ax = fig.add_subplot(1,1,1)
+    ax.plot([0,1],[0,1],label='warm')
+    ax.set_title('warm',fontsize=16)
+    ax.legend(fontsize=12)
+    fig.savefig(io.BytesIO(),format='png',bbox_inches='tight')
+    plt.close(fig)
+
+# runs one plot job and returns how long it took
+def renderJob(job):
+    function,args = job
+    start = time.time()
+    function(*args)
+    return time.time() - start
+
+# runs one plot job unless its images are in the render cache in cachedir. Returns how long it
+# took, whether it was a cache 'hit' or 'miss' (None if it couldn't be cached), and the render
+# time a hit saved.
+def cachedJob(job,cachedir):
+    start = time.time()
+    key = rendercache.jobKey(job)
+    if key is None:
+        # the cache keys off the image files a job's arguments name, so a job that builds its
+        # file names itself can never be cached
+        if not rendercache.outputPaths(job[1]):
+            print('warning: %s has no output file argument, not cached' % job[0].__name__)
+        return renderJob(job),None,0.0
+    outputs = rendercache.outputPaths(job[1])
+    saved = rendercache.loadEntry(cachedir,key,outputs)
+    if saved is not None:
+        return time.time() - start,'hit',saved
+    seconds = renderJob(job)
+    rendercache.storeEntry(cachedir,key,outputs,seconds)
+    return time.time() - start,'miss',0.0
+
+# starts a pool of nworkers warmed render processes that renderJobs keeps using until the process
+# exits (nworkers 1 just warms this process)
+def keepPool(nworkers):
+    global _pool
+    if nworkers > 1 and _pool is None:
+        _pool = multiprocessing.Pool(nworkers,initializer=warmWorker)
+    elif nworkers <= 1:
+        warmWorker()
+
+# renders every job in jobs, on nworkers processes (1 = serially in this process), or on the pool
+# started by keepPool if there is one. With a cachedir, unchanged jobs come out of the render cache
+# and the cache is trimmed to cachesize bytes afterwards. Returns the total render time summed
+# over all of the jobs.
+def renderJobs(jobs,nworkers=1,cachedir=None,cachesize=None):
+    run = renderJob if cachedir is None else functools.partial(cachedJob,cachedir=cachedir)
+    if _pool is not None and len(jobs) > 1:
+        results = _pool.map(run,jobs,chunksize=1)
+    elif nworkers > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(min(nworkers,len(jobs)),initializer=warmWorker)
+        try:
+            results = pool.map(run,jobs,chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [run(job) for job in jobs]
+    if cachedir is None:
+        return sum(results)
+
+    stats = {'hit':0,'miss':0,None:0}
+    for elapsed,status,saved in results:
+        stats[status] += 1
+    removed = evictCache(cachedir,cachesize) if cachesize is not None else 0
+    print('render cache: %d hits, %d misses, %d uncached, %.1f s of rendering saved, %d old '\
+        'entries evicted' % (stats['hit'],stats['miss'],stats[None],\
+        sum(saved for elapsed,status,saved in results),removed))
+    return sum(elapsed for elapsed,status,saved in results)
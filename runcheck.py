@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+''' Completeness check and repair for a run's GRIB files. Every (member, lead) file the run should
+    have is checked by its message inventory instead of its size: the file has to be there, hold
+    nothing but whole GRIB2 messages, and have every field the ingest reads for the right lead
+    time and member (see gefsingest.fileProblem). Nothing is decoded, so the check takes a few
+    seconds for a whole run. The cells that fail go in a JSON manifest.
+
+    A missing or bad file used to leave its cell NAN for the whole cycle. With --repair, only the
+    cells in the manifest are downloaded again, checked, decoded, and written into the existing
+    cube file in place (it is memory-mapped read/write), so the rest of the run isn't touched.
+    The manifest is then rewritten with whatever is still missing. ensemblemeans.py has already
+    stored the cube in the cycle store and written the CSV files and ensemble mean plots by then,
+    so after a repair those are redone from the patched cube too. Rerun htmlbuilder.py afterwards
+    to remake its products. The gefsmaps.py maps are not patched.
+
+    usage: python runcheck.py [--date YYYYMMDD --run RR] [--gribdir DIR] [--manifest FILE]
+                              [--repair] [--nofetch] [--baseurl URL]
+'''
+
+import argparse
+import json
+import numpy as np
+import os
+import time
+
+import downloader
+import ensemblemeans
+from cubestore import memberNames,openCube,siteIndex
+from cyclestore import CycleStore
+from gefsingest import fileProblem,processFile,variables
+from renderpool import renderJobs
+from runlayout import RunLayout,columnPert,discoverLayout,fileParts
+from stations import loadSites
+
+__author__ = 'Jason Godwin'
+__license__ = 'GPL'
+__maintainer__ = 'Jason Godwin'
+__email__ = 'jasonwgodwin@gmail.com'
+__status__ = 'Production'
+
+### USER SETTINGS BLOCK ###
+manifestfile = ensemblemeans.savedir + '/manifest.json'  # list of missing/bad files (the GRIB
+                                                         # directory and cube file are the ones in
+                                                         # ensemblemeans.py)
+### END OF USER SETTINGS BLOCK ###
+
+# checks every file of a run (date YYYYMMDD, run RR) in directory against layout (a
+# runlayout.RunLayout) and returns the manifest: the cycle, the number of files expected, and a
+# cell for every file that is missing or bad, with its perturbation number, lead hour, file name,
+# status ('missing' or 'corrupt'), and what is wrong with it
+def checkRun(directory,layout,date,run):
+    cells = []
+    for hour in layout.hours:
+        for pert in layout.perts:
+            filename = downloader.gribFilename(date,run,hour,pert)
+            problem = fileProblem(os.path.join(directory,filename),hour,pert)
+            if problem is not None:
+                cells.append({'pert':pert,'lead':hour,'file':filename,\
+                    'status':'missing' if problem == 'no file' else 'corrupt','problem':problem})
+    return {'cycle':date + run,'directory':directory,'expected':layout.filecount(),\
+        'checked':time.strftime('%Y-%m-%dT%H:%M:%SZ',time.gmtime()),'cells':cells}
+
+# writes a manifest under a temporary name and renames it into place
+def writeManifest(filename,manifest):
+    tmpname = '%s.%d.tmp' % (filename,os.getpid())
+    with open(tmpname,'w') as f:
+        json.dump(manifest,f,indent=2)
+    os.replace(tmpname,filename)
+
+def readManifest(filename):
+    with open(filename) as f:
+        return json.load(f)
+
+# run date and hour (YYYYMMDD, RR) and layout of a cube file's header
+def cubeLayout(header):
+    vtimes = header['validtimes']
+    hours = [int((vtime - vtimes[0]).total_seconds()) // 3600 for vtime in vtimes]
+    perts = [columnPert(name) for name in memberNames(header['shape'][2],header)]
+    return vtimes[0].strftime('%Y%m%d'),vtimes[0].strftime('%H'),RunLayout(perts,hours)
+
+# downloads (unless fetch is False), checks, and decodes the files of the cells in a manifest,
+# and writes their values into the cube file in place. method and cachedir are the same as for
+# gefsingest.ingest. Returns the manifest with the cells that are still missing or bad, and the
+# number of cells repaired. Raises ValueError if the manifest is for another run, or if the cube
+# has variables that aren't enabled any more (see derivedvars.py): their fields aren't downloaded
+# or decoded, so they can't be repaired.
+def repairRun(manifest,cubefile,method='nearest',cachedir=None,fetch=True,\
+    baseurl=downloader.baseurl):
+    header,data = openCube(cubefile,'r+')
+    date,run,layout = cubeLayout(header)
+    if manifest['cycle'] != date + run:
+        raise ValueError('the manifest is for %s but %s is for %s' % (manifest['cycle'],\
+            cubefile,date + run))
+    disabled = [var for var in header['variables'] if var not in variables]
+    if disabled and manifest['cells']:
+        raise ValueError('%s has variable(s) %s that are no longer in derivedvars.products, so '\
+            'they can\'t be repaired: enable them again or rerun ensemblemeans.py' % (cubefile,\
+            ','.join(disabled)))
+    directory = os.path.join(manifest['directory'],'')
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    sitelats = [site['lat'] for site in header['sites']]
+    sitelons = [site['lon'] for site in header['sites']]
+    varixs = [variables.index(var) for var in header['variables']]
+
+    remaining = []
+    repaired = 0
+    for cell in manifest['cells']:
+        pert,hour = cell['pert'],cell['lead']
+        if pert not in layout.memberix or hour not in layout.leadix:
+            print('%s is not in %s, skipping' % (cell['file'],cubefile))
+            remaining.append(cell)
+            continue
+        if fetch:
+            try:
+                downloader.downloadFile(date,run,hour,pert,directory,baseurl)
+            except IOError as err:
+                print('download failed: %s' % err)
+        problem = fileProblem(directory + cell['file'],hour,pert)
+        if problem is not None:
+            print('%s: %s' % (cell['file'],problem))
+            remaining.append(dict(cell,status='missing' if problem == 'no file' else 'corrupt',\
+                problem=problem))
+            continue
+        result = processFile(directory,cell['file'],sitelats,sitelons,method,cachedir)
+        values,stats = result[2],result[4]
+        if stats['problem'] is not None:
+            print('%s: %s' % (cell['file'],stats['problem']))
+            remaining.append(dict(cell,status='corrupt',problem=stats['problem']))
+            continue
+        data[:,:,layout.memberix[pert],layout.leadix[hour]] = np.transpose(values[varixs])
+        repaired += 1
+        print('%s: repaired' % cell['file'])
+    data.flush()
+    del data
+    return dict(manifest,cells=remaining,\
+        checked=time.strftime('%Y-%m-%dT%H:%M:%SZ',time.gmtime())),repaired
+
+# redoes what ensemblemeans.py made from a cube file before it was repaired: the cycle store's
+# copy of the cube (cycledir and keepcycles as in ensemblemeans.py), and the CSV files (with
+# writecsv) and ensemble mean plots of the sites (see stations.loadSites) that are in the cube.
+# Enabled variables the cube doesn't have are NAN.
+def refreshProducts(cubefile,sites,cycledir=None,keepcycles=8,writecsv=True,renderworkers=1,\
+    plotcache=None,plotcachesize=None):
+    if cycledir is not None:
+        CycleStore(cycledir,keepcycles).add(cubefile)
+    header,data = openCube(cubefile)
+    ids = [site['id'] for site in header['sites']]
+    jobs = []
+    for site in sites:
+        if site['id'] not in ids:
+            print('%s is not in %s, skipping' % (site['id'],cubefile))
+            continue
+        # the site's [member, lead, variable] slice in the order of the enabled variables
+        ix = siteIndex(header,site['id'])
+        sitedata = np.full(header['shape'][2:] + [len(variables)],np.nan)
+        for n,var in enumerate(variables):
+            if var in header['variables']:
+                sitedata[:,:,n] = data[ix,header['variables'].index(var)]
+        jobs += ensemblemeans.siteProducts(sitedata,header['validtimes'],site['name'],\
+            site['savedir'],writecsv,columns=memberNames(header['shape'][2],header))
+    del data
+    renderJobs(jobs,renderworkers,plotcache,plotcachesize)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check a run\'s GRIB files and repair the gaps.')
+    parser.add_argument('--date',help='run date (YYYYMMDD), by default the cube file\'s run')
+    parser.add_argument('--run',help='run hour (00, 06, 12, or 18)')
+    parser.add_argument('--gribdir',default=ensemblemeans.directory,help='GRIB file directory')
+    parser.add_argument('--manifest',default=manifestfile,\
+        help='manifest file to write (and to repair from)')
+    parser.add_argument('--repair',action='store_true',\
+        help='download and ingest the cells in the manifest again and patch the cube file')
+    parser.add_argument('--nofetch',action='store_true',\
+        help='repair from files already in the GRIB directory instead of downloading them')
+    parser.add_argument('--baseurl',default=downloader.baseurl,help='base url of the GEFS data')
+    args = parser.parse_args()
+
+    if args.repair:
+        try:
+            manifest,repaired = repairRun(readManifest(args.manifest),ensemblemeans.cubefile,\
+                ensemblemeans.interpolation,ensemblemeans.gridcache,not args.nofetch,args.baseurl)
+        except ValueError as err:
+            parser.error(str(err))
+        if repaired:
+            sites = loadSites(ensemblemeans.stationfile,ensemblemeans.savedir,\
+                {'name':ensemblemeans.locname,'lat':ensemblemeans.mylat,\
+                'lon':ensemblemeans.mylon})
+            refreshProducts(ensemblemeans.cubefile,sites,ensemblemeans.cycledir,\
+                ensemblemeans.keepcycles,ensemblemeans.writecsv,ensemblemeans.renderworkers,\
+                ensemblemeans.plotcache,ensemblemeans.plotcachesize * 1024 * 1024)
+    else:
+        # the run in the GRIB directory (or the cube file's run), checked against the cube file's
+        # layout when it is for the same run
+        filenames = os.listdir(args.gribdir) if os.path.isdir(args.gribdir) else []
+        found = sorted(parts for parts in map(fileParts,filenames) if parts)
+        cube = cubeLayout(openCube(ensemblemeans.cubefile)[0]) \
+            if os.path.exists(ensemblemeans.cubefile) else None
+        if args.date and args.run:
+            date,run = args.date,args.run
+        elif found:
+            date,run = found[0][0:2]
+        elif cube is not None:
+            date,run = cube[0:2]
+        else:
+            parser.error('no GRIB files in %s, give a --date and --run' % args.gribdir)
+        if cube is not None and cube[0:2] == (date,run):
+            layout = cube[2]
+        else:
+            layout = discoverLayout(filenames)
+        manifest = checkRun(args.gribdir,layout,date,run)
+
+    writeManifest(args.manifest,manifest)
+    print('%s: %d of %d files missing or bad, manifest written to %s' % (manifest['cycle'],\
+        len(manifest['cells']),manifest['expected'],args.manifest))
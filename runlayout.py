@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+''' Layout of a GEFS run: which ensemble members and lead times it has. The scripts used to assume
+    the old GEFS (gep01-gep20 out to 384 hours every 6 hours) everywhere. The current GEFS has 31
+    members (the control run gec00 plus gep01-gep30) and runs out to 840 hours, so the members and
+    lead hours now come from here instead: from the settings below, widened to whatever else is in
+    the grib_gefs_YYYYMMDD_RR_FFF_PP files on disk. The ingest arrays, the cube file's member
+    axis, the member names in the CSVs and pages, and the files downloader.py fetches are all
+    sized from a RunLayout.
+'''
+
+import re
+
+__author__ = 'Jason Godwin'
+__license__ = 'GPL'
+__maintainer__ = 'Jason Godwin'
+__email__ = 'jasonwgodwin@gmail.com'
+__status__ = 'Production'
+
+### USER SETTINGS BLOCK ###
+members = list(range(1,21))         # perturbation numbers (0 = the control run); the current
+                                    # GEFS is list(range(0,31))
+maxlead = 384                       # last lead time (hours); 840 for the current GEFS
+leadstep = 6                        # hours between lead times
+### END OF USER SETTINGS BLOCK ###
+
+# grib_gefs_YYYYMMDD_RR_FFF_PP (the lead hour has at least three digits)
+filepattern = re.compile(r'grib_gefs_(\d{8})_(\d{2})_(\d{3,})_(\d{2})$')
+
+# NCEP name of a member: gec00 for the control run, gep01-gep30 for the perturbations
+def memberName(pert):
+    return 'gec%02d' % pert if pert == 0 else 'gep%02d' % pert
+
+# column name of a member in the CSVs, pages, and cube file (gep1, ... as they have always been,
+# and gec0 for the control run)
+def memberColumn(pert):
+    return 'gec%d' % pert if pert == 0 else 'gep%d' % pert
+
+# perturbation number of a member column name (the inverse of memberColumn)
+def columnPert(column):
+    return int(column[3:])
+
+# run date, run hour, lead hour, and perturbation number of a GRIB file name (None if it isn't one)
+def fileParts(filename):
+    match = filepattern.search(filename)
+    if match is None:
+        return None
+    return match.group(1),match.group(2),int(match.group(3)),int(match.group(4))
+
+class RunLayout(object):
+    ''' The members (perturbation numbers) and lead hours of a run, and where each one goes on the
+        member and lead axes of the ingest arrays. Defaults to the settings above.
+    '''
+
+    def __init__(self,perts=None,hours=None):
+        self.perts = sorted(perts if perts is not None else members)
+        self.hours = sorted(hours if hours is not None else range(0,maxlead + 1,leadstep))
+        self.memberix = dict((pert,ix) for ix,pert in enumerate(self.perts))
+        self.leadix = dict((hour,ix) for ix,hour in enumerate(self.hours))
+        self.shape = (len(self.perts),len(self.hours))
+
+    # member column names, in member axis order
+    def columns(self):
+        return [memberColumn(pert) for pert in self.perts]
+
+    # (member, lead) indices of a GRIB file, or None if the file isn't part of the layout
+    def indices(self,filename):
+        parts = fileParts(filename)
+        if parts is None or parts[3] not in self.memberix or parts[2] not in self.leadix:
+            return None
+        return self.memberix[parts[3]],self.leadix[parts[2]]
+
+    # number of lead times out to (and including) hour
+    def leadsThrough(self,hour):
+        return sum(1 for x in self.hours if x <= hour)
+
+    # number of files in a whole run
+    def filecount(self):
+        return self.shape[0] * self.shape[1]
+
+# layout of a run with the GRIB files in filenames: the configured members and lead times plus
+# any others found in the files (so a run with more members or lead times than the settings just
+# gets bigger, while a file missing from the run still has a slot to be filled in later, see
+# runcheck.py)
+def discoverLayout(filenames):
+    found = [parts for parts in (fileParts(filename) for filename in filenames) if parts]
+    configured = RunLayout()
+    return RunLayout(set(configured.perts) | set(parts[3] for parts in found),\
+        set(configured.hours) | set(parts[2] for parts in found))
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+''' Timing and memory instrumentation for the GEFS scripts. Each script keeps a RunMetrics and
+    wraps its stages (download, ingest, statistics, plots, HTML build, ...) in metrics.stage(),
+    which records the wall clock and CPU time, the data read and written, and the peak memory
+    use. The ingest also records how long each GRIB file took, so the slowest ones stand out.
+    At the end the results are written to metricsdir/YYYYMMDDHH.json, one file per cycle, with
+    a section for each script that ran on it. That makes it easy to see which stage got slower
+    when a cycle runs late.
+
+    With profile=True a background thread also samples the main thread's call stack every few
+    milliseconds and writes the counts to metricsdir/YYYYMMDDHH_<script>.folded in the folded
+    stack format used by flamegraph.pl and speedscope (worker processes are not sampled).
+'''
+
+import collections
+import contextlib
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+__author__ = 'Jason Godwin'
+__license__ = 'GPL'
+__maintainer__ = 'Jason Godwin'
+__email__ = 'jasonwgodwin@gmail.com'
+__status__ = 'Production'
+
+# resource usage of this process and its (finished) worker processes. CPU time is in seconds, the
+# block counts are 512 byte blocks actually read from/written to disk (page cache hits don't
+# count), and maxrss is the peak resident set size in bytes.
+def usage():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return {'wall':time.perf_counter(),\
+        'cpu':own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime,\
+        'inblock':own.ru_inblock + children.ru_inblock,\
+        'oublock':own.ru_oublock + children.ru_oublock,\
+        'maxrss':own.ru_maxrss * scale,'childrss':children.ru_maxrss * scale}
+
+# current resident set size of this process in bytes (the peak so far where /proc is missing)
+def residentMemory():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError,OSError,ValueError):
+        return usage()['maxrss']
+
+class StackSampler(threading.Thread):
+    ''' Samples the call stack of a thread at a fixed interval and counts each distinct stack.
+        Stacks are rooted at the metrics stage running at the time of the sample.
+    '''
+
+    def __init__(self,metrics,interval=0.005):
+        threading.Thread.__init__(self,name='stacksampler')
+        self.daemon = True
+        self.metrics = metrics
+        self.interval = interval
+        self.target = threading.current_thread().ident
+        self.counts = collections.Counter()
+        self.running = threading.Event()
+
+    def run(self):
+        self.running.set()
+        while self.running.is_set():
+            frame = sys._current_frames().get(self.target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('%s (%s)' % (code.co_name,os.path.basename(code.co_filename)))
+                frame = frame.f_back
+            stack.append(self.metrics.current or 'main')
+            self.counts[';'.join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.running.clear()
+        self.join()
+
+    # one "stack count" line per distinct stack
+    def folded(self):
+        return ''.join('%s %d\n' % (stack,count) for stack,count in sorted(self.counts.items()))
+
+class RunMetrics(object):
+    ''' Stage timings, file timings, and memory use for one script's run over one cycle. name is
+        the script (the section of the metrics file it writes), and slowest is the number of
+        slowest files kept in the report.
+    '''
+
+    def __init__(self,name,slowest=10,profile=False):
+        self.name = name
+        self.slowest = slowest
+        self.started = time.strftime('%Y-%m-%dT%H:%M:%SZ',time.gmtime())
+        self.begin = usage()
+        self.stages = []
+        self.open = []
+        self.files = []
+        self.current = None
+        self.sampler = None
+        if profile:
+            self.sampler = StackSampler(self)
+            self.sampler.start()
+
+    # times the code in a with block as a stage (stages can be nested)
+    @contextlib.contextmanager
+    def stage(self,name):
+        entry = {'name':name,'read':0,'written':0}
+        self.open.append(entry)
+        outer = self.current
+        self.current = name if outer is None else outer + ';' + name
+        before = usage()
+        try:
+            yield entry
+        finally:
+            after = usage()
+            self.current = outer
+            self.open.remove(entry)
+            entry['wall'] = after['wall'] - before['wall']
+            entry['cpu'] = after['cpu'] - before['cpu']
+            entry['diskread'] = 512 * (after['inblock'] - before['inblock'])
+            entry['diskwritten'] = 512 * (after['oublock'] - before['oublock'])
+            entry['peakrss'] = max(after['maxrss'],after['childrss'])
+            self.stages.append(entry)
+            print('%s: %.2f s wall, %.2f s CPU, peak RSS %.0f MB' % (name,entry['wall'],\
+                entry['cpu'],entry['peakrss'] / 1048576.0))
+
+    # adds to the bytes read/written by the running stage(s), e.g. the size of each file read by
+    # a worker process or written by the script
+    def addBytes(self,read=0,written=0):
+        for entry in self.open:
+            entry['read'] += read
+            entry['written'] += written
+
+    # records how long one input file took to process
+    def fileTime(self,filename,seconds):
+        self.files.append((seconds,filename))
+
+    # everything recorded so far as a dictionary
+    def summary(self):
+        end = usage()
+        return {'started':self.started,'wall':end['wall'] - self.begin['wall'],\
+            'cpu':end['cpu'] - self.begin['cpu'],'peakrss':end['maxrss'],\
+            'peakworkerrss':end['childrss'],'files':len(self.files),\
+            'slowestfiles':[{'file':filename,'seconds':seconds} for seconds,filename in \
+                sorted(self.files,reverse=True)[0:self.slowest]],\
+            'stages':self.stages}
+
+    # adds this run's section to metricsdir/<cycle>.json (cycle is YYYYMMDDHH), keeping the
+    # sections written by the other scripts, plus the folded stack profile if one was taken
+    def write(self,metricsdir,cycle):
+        if not os.path.isdir(metricsdir):
+            os.makedirs(metricsdir,exist_ok=True)
+        filename = os.path.join(metricsdir,'%s.json' % cycle)
+        try:
+            with open(filename) as f:
+                report = json.load(f)
+        except (IOError,ValueError):
+            report = {'cycle':cycle,'runs':{}}
+        report['runs'][self.name] = self.summary()
+
+        tmpname = '%s.%d.tmp' % (filename,os.getpid())
+        with open(tmpname,'w') as f:
+            json.dump(report,f,indent=2,sort_keys=True)
+        os.replace(tmpname,filename)
+
+        if self.sampler is not None:
+            self.sampler.stop()
+            with open(os.path.join(metricsdir,'%s_%s.folded' % (cycle,self.name)),'w') as f:
+                f.write(self.sampler.folded())
+            self.sampler = None
+        return filename
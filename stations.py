@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+''' Reads the list of locations to make GEFS products for. Station lists can be CSV files with a
+    header row (id,name,lat,lon) or JSON files holding a list of objects with the same keys. The
+    id is optional and is only used to name each location's output directory. Any other columns
+    (like season or tz) are kept for the scripts that use them.
+'''
+
+import csv
+import json
+import os
+import re
+
+__author__ = 'Jason Godwin'
+__license__ = 'GPL'
+__maintainer__ = 'Jason Godwin'
+__email__ = 'jasonwgodwin@gmail.com'
+__status__ = 'Production'
+
+# makes a directory-friendly id out of a location name (Dallas/Fort Worth, TX -> dallas_fort_worth_tx)
+def siteId(name):
+    return re.sub('[^a-z0-9]+','_',name.lower()).strip('_')
+
+# reads a CSV or JSON station list and returns a list of dictionaries with id, name, lat, and lon
+def readStations(stationfile):
+    if stationfile.lower().endswith('.json'):
+        with open(stationfile) as f:
+            rows = json.load(f)
+    else:
+        with open(stationfile) as f:
+            rows = list(csv.DictReader(f))
+
+    sites = []
+    for row in rows:
+        site = dict(row)
+        site['name'] = str(row['name']).strip()
+        site['lat'] = float(row['lat'])
+        site['lon'] = float(row['lon'])
+        site['id'] = str(row.get('id') or siteId(site['name'])).strip()
+        sites.append(site)
+
+    # duplicate ids would write over each other's output
+    ids = [site['id'] for site in sites]
+    if len(set(ids)) != len(ids):
+        raise ValueError('duplicate station ids in %s' % stationfile)
+    return sites
+
+# returns the list of locations to process along with where each one's output goes. Without a
+# station list, the single default location writes straight to savedir like it always has. With
+# a station list, each location gets its own savedir/<id> subdirectory.
+def loadSites(stationfile,savedir,default):
+    if stationfile is None:
+        site = dict(default)
+        site.setdefault('id',siteId(site['name']))
+        site['savedir'] = savedir
+        return [site]
+
+    sites = readStations(stationfile)
+    for site in sites:
+        site['savedir'] = os.path.join(savedir,site['id'])
+    return sites
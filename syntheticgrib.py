@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+''' Synthetic GEFS GRIB2 files for testing and benchmarking the scripts without downloading a run.
+    Writes one grib_gefs_YYYYMMDD_RR_FFF_PP file per member and lead time with the same fields
+    (and the same GRIB2 product/grid templates) that downloader.py pulls from NCEP: 2 m
+    temperature, relative humidity, and 10 m wind at the analysis time, plus 6-hour max/min
+    temperature, precipitation, and the categorical precipitation type flags at every forecast
+    hour, so every variable in derivedvars.py can be computed from them. The data
+    are smooth latitude-dependent fields with random noise, on a global regular lat/lon grid at
+    any resolution. Everything is encoded here with numpy and struct (simple packing, 16 bits per
+    value), so no GRIB writing library is needed.
+
+    usage: python syntheticgrib.py GRIBDIR [--members 20|31] [--leads 65] [--resolution 1.0]
+                                   [--stride N]
+'''
+
+import argparse
+import datetime
+import numpy as np
+import os
+import struct
+
+from downloader import gribFilename
+
+__author__ = 'Jason Godwin'
+__license__ = 'GPL'
+__maintainer__ = 'Jason Godwin'
+__email__ = 'jasonwgodwin@gmail.com'
+__status__ = 'Production'
+
+# GRIB2 (discipline, category, number) of each field, with the statistical process for the
+# 6-hour fields (0 = average, 1 = accumulation, 2 = maximum, 3 = minimum, None = instantaneous)
+# and the decimal scale factor used to pack it
+fields = {'2t':(0,0,0,None,2),'2r':(0,1,1,None,1),'tmax':(0,0,4,2,2),'tmin':(0,0,5,3,2),\
+    'tp':(0,1,8,1,2),'csnow':(0,1,36,0,0),'cicep':(0,1,35,0,0),'cfrzr':(0,1,34,0,0),\
+    'crain':(0,1,33,0,0),'10u':(0,2,2,None,2),'10v':(0,2,3,None,2)}
+
+# fields in the analysis (f000) files and the forecast files
+analysis_fields = ['2t','2r','10u','10v']
+forecast_fields = ['tmax','tmin','2t','2r','10u','10v','tp','csnow','cicep','cfrzr','crain']
+
+# signed integers in GRIB2 are sign and magnitude, not two's complement
+def signMagnitude(value,nbytes):
+    value = int(round(value))
+    if value < 0:
+        value = -value | (1 << (8 * nbytes - 1))
+    return value.to_bytes(nbytes,'big')
+
+# section 3: regular lat/lon grid starting at 90N 0E, scanning west to east and north to south
+def gridSection(nlat,nlon,resolution):
+    lat2 = 90.0 - (nlat - 1) * resolution
+    lon2 = (nlon - 1) * resolution
+    template = bytes([6,0]) + bytes(4) + bytes([0]) + bytes(4) + bytes([0]) + bytes(4)
+    template += struct.pack('>IIII',nlon,nlat,0,0) + signMagnitude(90e6,4) + \
+        signMagnitude(0,4) + bytes([48]) + signMagnitude(lat2 * 1e6,4) + \
+        signMagnitude(lon2 * 1e6,4) + struct.pack('>II',int(round(resolution * 1e6)),\
+        int(round(resolution * 1e6))) + bytes([0])
+    body = bytes([0]) + struct.pack('>I',nlat * nlon) + bytes([0,0]) + struct.pack('>H',0) + \
+        template
+    return struct.pack('>IB',5 + len(body),3) + body
+
+# section 4: individual ensemble forecast (template 4.1), or an ensemble forecast over a time
+# interval (template 4.11) for the max/min/accumulated/averaged fields
+def productSection(name,initdate,lead,pert,nmembers):
+    discipline,category,number,process,scale = fields[name]
+    if name in ['2t','2r','tmax','tmin']:
+        surface,level = 103,2       # 2 m above ground
+    elif name in ['10u','10v']:
+        surface,level = 103,10      # 10 m above ground
+    else:
+        surface,level = 1,0         # surface
+    start = lead if process is None else lead - 6
+    body = bytes([category,number,4,0,0]) + struct.pack('>H',0) + bytes([0,1]) + \
+        struct.pack('>I',start) + bytes([surface,0]) + struct.pack('>I',level) + \
+        bytes([255,0]) + struct.pack('>I',0)
+    # ensemble information: the control run (member 0) is unperturbed, the rest positive
+    body += bytes([0 if pert == 0 else 3,pert,nmembers])
+    if process is not None:
+        end = initdate + datetime.timedelta(hours=lead)
+        body += struct.pack('>HBBBBB',end.year,end.month,end.day,end.hour,0,0) + bytes([1]) + \
+            struct.pack('>I',0) + bytes([process,2,1]) + struct.pack('>I',6) + bytes([255]) + \
+            struct.pack('>I',0)
+    return struct.pack('>IBHH',9 + len(body),4,0,1 if process is None else 11) + body
+
+# sections 5 through 7: simple packing (template 5.0) with 16 bits per value
+def dataSections(values,scale):
+    scaled = np.asarray(values,dtype=np.float64).ravel() * 10.0**scale
+    reference = float(np.float32(np.floor(scaled.min())))
+    binary = 0
+    while (scaled.max() - reference) / 2.0**binary > 65535:
+        binary += 1
+    packed = np.round((scaled - reference) / 2.0**binary).clip(0,65535).astype('>u2').tobytes()
+    section5 = struct.pack('>IBIH',21,5,scaled.size,0) + struct.pack('>f',reference) + \
+        signMagnitude(binary,2) + signMagnitude(scale,2) + bytes([16,0])
+    section6 = struct.pack('>IBB',6,6,255)
+    section7 = struct.pack('>IB',5 + len(packed),7) + packed
+    return section5 + section6 + section7
+
+# encodes one field as a complete GRIB2 message
+def encodeMessage(name,values,initdate,lead,pert,nmembers,resolution):
+    nlat,nlon = np.shape(values)
+    section1 = struct.pack('>IBHHBBBHBBBBBBB',21,1,7,0,2,1,1,initdate.year,initdate.month,\
+        initdate.day,initdate.hour,0,0,0,3 if pert == 0 else 4)
+    body = section1 + gridSection(nlat,nlon,resolution) + \
+        productSection(name,initdate,lead,pert,nmembers) + dataSections(values,fields[name][4])
+    return b'GRIB' + bytes([0,0,fields[name][0],2]) + struct.pack('>Q',16 + len(body) + 4) + \
+        body + b'7777'
+
+# made-up but reasonable looking values (GRIB units) for every field on an nlat x nlon grid
+def syntheticFields(names,nlat,nlon,lead,random):
+    lats = np.linspace(90.0,-90.0,nlat)[:,np.newaxis]
+    lons = np.linspace(0.0,360.0,nlon,endpoint=False)[np.newaxis,:]
+    # temperature (K) warmest in the tropics with a diurnal-ish wave and member noise
+    temp = 250.0 + 50.0 * np.cos(np.deg2rad(lats)) + \
+        5.0 * np.sin(np.deg2rad(lons + 15.0 * lead)) + random.normal(0.0,2.0,(nlat,nlon))
+    values = {'2t':temp,'tmax':temp + np.abs(random.normal(3.0,1.0,(nlat,nlon))),\
+        'tmin':temp - np.abs(random.normal(3.0,1.0,(nlat,nlon))),\
+        '2r':np.clip(random.normal(60.0,20.0,(nlat,nlon)),1.0,100.0),\
+        'tp':np.clip(random.gamma(0.5,4.0,(nlat,nlon)) - 1.0,0.0,None)}
+    # exactly one precipitation type where it is precipitating, snow where it is cold
+    raining = values['tp'] > 0.0
+    cold = temp < 271.0
+    values['csnow'] = (raining & cold).astype(float)
+    values['cicep'] = (raining & cold & (random.random_sample((nlat,nlon)) > 0.8)).astype(float)
+    values['csnow'] -= values['cicep']
+    values['cfrzr'] = (raining & ~cold & (temp < 273.15)).astype(float)
+    values['crain'] = (raining & (temp >= 273.15)).astype(float)
+    # westerlies outside the tropics (m/s)
+    values['10u'] = 8.0 * np.sin(np.deg2rad(2.0 * lats)) ** 2 + random.normal(0.0,3.0,(nlat,nlon))
+    values['10v'] = random.normal(0.0,3.0,(nlat,nlon))
+    return [values[name] for name in names]
+
+# the perturbation numbers in a run: 20 members are gep01-gep20, 31 members add the control
+# (gec00) to gep01-gep30
+def memberNumbers(nmembers):
+    if nmembers == 31:
+        return list(range(0,31))
+    return list(range(1,nmembers + 1))
+
+# writes one synthetic file for every member and lead time to directory and returns the file
+# names. resolution is the grid spacing in degrees. seed makes the data repeatable. With stride
+# only every stride-th file (in lead time, then member order) is written, for runs too big to
+# write out whole.
+def writeRun(directory,date='20170927',run='00',nmembers=20,nleads=65,resolution=1.0,seed=0,\
+    stride=1):
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    initdate = datetime.datetime.strptime(date + run,'%Y%m%d%H')
+    nlat = int(round(180.0 / resolution)) + 1
+    nlon = int(round(360.0 / resolution))
+    filenames = []
+    count = 0
+    for lead in range(0,6 * nleads,6):
+        names = analysis_fields if lead == 0 else forecast_fields
+        for pert in memberNumbers(nmembers):
+            count += 1
+            if (count - 1) % stride != 0:
+                continue
+            random = np.random.RandomState(seed * 100003 + lead * 101 + pert)
+            messages = [encodeMessage(name,values,initdate,lead,pert,nmembers,resolution) \
+                for name,values in zip(names,syntheticFields(names,nlat,nlon,lead,random))]
+            filename = gribFilename(date,run,lead,pert)
+            with open(os.path.join(directory,filename),'wb') as f:
+                f.write(b''.join(messages))
+            filenames.append(filename)
+    return filenames
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a run of synthetic GEFS GRIB2 files.')
+    parser.add_argument('gribdir',help='directory to write the files to')
+    parser.add_argument('--date',default='20170927',help='run date (YYYYMMDD)')
+    parser.add_argument('--run',default='00',help='run hour (00, 06, 12, or 18)')
+    parser.add_argument('--members',type=int,default=20,choices=[20,31],\
+        help='number of members (31 includes the control run)')
+    parser.add_argument('--leads',type=int,default=65,help='number of 6-hourly lead times')
+    parser.add_argument('--resolution',type=float,default=1.0,help='grid spacing (degrees)')
+    parser.add_argument('--seed',type=int,default=0,help='random seed')
+    parser.add_argument('--stride',type=int,default=1,help='write only every Nth file')
+    args = parser.parse_args()
+
+    filenames = writeRun(args.gribdir,args.date,args.run,args.members,args.leads,\
+        args.resolution,args.seed,args.stride)
+    print('wrote %d files to %s' % (len(filenames),args.gribdir))
@@ -0,0 +1,120 @@
+''' Test setup: the scripts are flat modules in the directory above, so put it on the path, and
+    give every test a small synthetic GEFS run (see syntheticgrib.py) to work on.
+'''
+
+import http.server
+import os
+import sys
+import threading
+
+import pygrib
+import pytest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import derivedvars
+import downloader
+import gribindex
+import runlayout
+import syntheticgrib
+
+# writes a synthetic run (20 members at 10 degrees, so it only takes a moment) and returns its
+# directory (with the trailing slash the ingest expects)
+@pytest.fixture
+def gribdir(tmp_path):
+    directory = str(tmp_path / 'grib') + '/'
+    syntheticgrib.writeRun(directory,nmembers=20,nleads=3,resolution=10.0)
+    return directory
+
+# a local web server for a directory that answers Range requests the way NCEP's does (a single
+# range as a 206 with Content-Range, several as multipart/byteranges). failures is how many
+# requests to answer with a 503 first, and requests records the path and Range header of each one.
+class RangeHandler(http.server.SimpleHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def reply(self,status,body=b'',headers=()):
+        self.send_response(status)
+        for name,value in headers:
+            self.send_header(name,value)
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append((self.path,self.headers.get('Range')))
+        if server.failures > 0:
+            server.failures -= 1
+            return self.reply(503)
+        path = os.path.join(server.root,self.path.lstrip('/'))
+        if not os.path.isfile(path):
+            return self.reply(404)
+        with open(path,'rb') as f:
+            data = f.read()
+        byterange = self.headers.get('Range')
+        if byterange is None:
+            return self.reply(200,data)
+        ranges = []
+        for spec in byterange.split('=',1)[1].split(','):
+            first,last = spec.split('-')
+            ranges.append((int(first),int(last) if last else len(data) - 1))
+        if len(ranges) == 1:
+            first,last = ranges[0]
+            return self.reply(206,data[first:last + 1],[('Content-Range','bytes %d-%d/%d' % \
+                (first,last,len(data)))])
+        body = b''
+        for first,last in ranges:
+            body += b'\r\n--BOUNDARY\r\nContent-Type: application/octet-stream\r\n' + \
+                ('Content-Range: bytes %d-%d/%d\r\n\r\n' % (first,last,len(data))).encode() + \
+                data[first:last + 1]
+        body += b'\r\n--BOUNDARY--\r\n'
+        self.reply(206,body,[('Content-Type','multipart/byteranges; boundary=BOUNDARY')])
+
+    def log_message(self,*args):
+        pass
+
+# serves a directory on a free local port and returns the server (stopped after the test). Its
+# url is server.url.
+@pytest.fixture
+def rangeserver(tmp_path):
+    server = http.server.ThreadingHTTPServer(('127.0.0.1',0),RangeHandler)
+    server.root = str(tmp_path / 'www')
+    server.url = 'http://127.0.0.1:%d' % server.server_address[1]
+    server.failures = 0
+    server.requests = []
+    os.makedirs(server.root)
+    thread = threading.Thread(target=server.serve_forever,daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+# copies a synthetic GRIB file into the server's directory where downloader.gribUrl looks for it,
+# with a wgrib inventory, and an unwanted record (a copy of the first message, listed as 500 mb
+# heights) after the second one. Returns the bytes of the messages in the file, by inventory
+# (variable, level).
+def publishFile(server,gribdir,filename):
+    date,run,hour,pert = runlayout.fileParts(filename)
+    path = os.path.join(server.root,downloader.gribpath.format(date=date,run=run,hour=hour,\
+        member=runlayout.memberName(pert)))
+    os.makedirs(os.path.dirname(path),exist_ok=True)
+    with open(os.path.join(gribdir,filename),'rb') as f:
+        data = f.read()
+    grbs = pygrib.open(os.path.join(gribdir,filename))
+    keys = [(grb.shortName,grb.level) for grb in grbs]
+    grbs.close()
+    messages = [(derivedvars.inventorynames[key],data[start:start + length]) \
+        for key,(start,length) in zip(keys,gribindex.messageSpans(os.path.join(gribdir,filename)))]
+    messages.insert(2,(('HGT','500 mb'),messages[0][1]))
+
+    lines = []
+    body = b''
+    for number,((variable,level),message) in enumerate(messages):
+        lines.append('%d:%d:d=%s%s:%s:%s:%d hour fcst:ENS=+%d' % (number + 1,len(body),date,run,\
+            variable,level,hour,pert))
+        body += message
+    with open(path,'wb') as f:
+        f.write(body)
+    with open(path + '.idx','w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return dict(messages)
@@ -0,0 +1,83 @@
+''' Tests for the day binning and daily aggregation (dailyaggregate.py). '''
+
+import datetime
+
+import numpy as np
+import pandas
+import pytest
+
+import htmlbuilder
+from dailyaggregate import dailyCube,dailyvariables,dayBins,siteDaily
+
+# 6-hourly valid times for a run starting at hour on 9/27 with nleads lead times
+def validTimes(hour,nleads):
+    init = datetime.datetime(2017,9,27,hour)
+    return [init + datetime.timedelta(hours=6 * lead) for lead in range(nleads)]
+
+# day of the month each lead time goes in (None for the initial time) for the 6-hour periods
+# (max/min temperature and precipitation) and the dewpoint at the valid time
+periodbins = {0:[None,27,27,27,27,28,28,28,28],6:[None,27,27,27,28,28,28,28,29],\
+    12:[None,27,27,28,28,28,28,29,29],18:[None,27,28,28,28,28,29,29,29]}
+instantbins = {0:[27,27,27,27,28,28,28,28,29],6:[27,27,27,28,28,28,28,29,29],\
+    12:[27,27,28,28,28,28,29,29,29],18:[27,28,28,28,28,29,29,29,29]}
+
+# the day of the month of each lead time from dayBins
+def binDays(vtimes,period):
+    days,bins,steps = dayBins(vtimes,period=period)
+    return [days[ix].day if ix >= 0 else None for ix in bins]
+
+@pytest.mark.parametrize('hour',[0,6,12,18])
+def test_period_bins(hour):
+    # the 18-00Z period (valid at 00Z) goes in the day before its valid time
+    assert binDays(validTimes(hour,9),True) == periodbins[hour]
+
+@pytest.mark.parametrize('hour',[0,6,12,18])
+def test_instant_bins(hour):
+    # dewpoint goes in the day of its valid time
+    assert binDays(validTimes(hour,9),False) == instantbins[hour]
+
+# a one-site, one-member cube of the daily variables with the lead time as the value
+def leadCube(nleads):
+    return np.tile(np.arange(nleads,dtype=float),(1,len(dailyvariables),1,1))
+
+@pytest.mark.parametrize('hour',[0,6,12,18])
+def test_complete_days(hour):
+    vtimes = validTimes(hour,13)
+    daily = dailyCube(leadCube(13),dailyvariables,vtimes)
+    for var in dailyvariables:
+        days,values = daily[var]
+        bins = dict(zip(vtimes,binDays(vtimes,var != 'dpt')))
+        expected = [day for day in (27,28,29,30) \
+            if sum(bins[vtime] == day for vtime in vtimes) == 4]
+        assert [day.day for day in days] == expected
+        for day,value in zip(days,values[0,0]):
+            leads = [lead for lead,vtime in enumerate(vtimes) if bins[vtime] == day.day]
+            how = {'max_temp':max,'min_temp':min,'dpt':np.mean,'precip':sum}[var]
+            assert value == how(leads)
+
+def test_00z_period_in_previous_day():
+    # a high, low, and precipitation valid at 00Z 9/28 count toward 9/27
+    vtimes = validTimes(0,9)
+    cube = np.zeros((1,len(dailyvariables),1,9))
+    cube[0,:,0,4] = 10.0
+    daily = dailyCube(cube,dailyvariables,vtimes)
+    for var in ['max_temp','precip']:
+        days,values = daily[var]
+        assert list(days.day) == [27,28]
+        assert list(values[0,0]) == [10.0,0.0]
+    cube[0,:,0,4] = -10.0
+    days,values = dailyCube(cube,dailyvariables,vtimes)['min_temp']
+    assert list(values[0,0]) == [-10.0,0.0]
+
+# a run with fewer than 24 hours of lead times (or one that doesn't cover any day completely)
+@pytest.mark.parametrize('hour,nleads',[(0,1),(0,2),(0,3),(12,5)])
+def test_short_run(tmp_path,hour,nleads):
+    vtimes = validTimes(hour,nleads)
+    daily = siteDaily(leadCube(nleads),dailyvariables,vtimes,['UTC'],['GEC00'])[0]
+    assert all(frame.empty for frame in daily)
+    assert htmlbuilder.buildSite(daily,vtimes[0],str(tmp_path),'Test','warm') == []
+
+    # nor any time-lagged or trend plots
+    trends = dict((var,pandas.DataFrame(index=pandas.DatetimeIndex(vtimes[:1]))) \
+        for var in dailyvariables)
+    assert htmlbuilder.buildHistory((daily,trends),vtimes[0],str(tmp_path),'Test') == []
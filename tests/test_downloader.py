@@ -0,0 +1,73 @@
+''' Tests for the byte-range downloader (downloader.py) against a local range server. '''
+
+import os
+
+import pytest
+
+import derivedvars
+import downloader
+from conftest import publishFile
+
+# the file downloader.downloadFile should write: just the records the enabled variables (and the
+# maps) need, in the order they are in on the server
+def expectedBytes(messages,analysis):
+    fields = derivedvars.downloadFields(derivedvars.products,analysis,downloader.fetchmaps)
+    return b''.join(message for key,message in messages.items() if key in fields)
+
+@pytest.mark.parametrize('maxranges',[1,8])
+@pytest.mark.parametrize('hour',[0,6])
+def test_download_is_byte_identical(gribdir,rangeserver,tmp_path,hour,maxranges):
+    filename = downloader.gribFilename('20170927','00',hour,1)
+    messages = publishFile(rangeserver,gribdir,filename)
+    outdir = str(tmp_path / 'out')
+    os.makedirs(outdir)
+    path = downloader.downloadFile('20170927','00',hour,1,outdir,rangeserver.url,\
+        maxranges=maxranges)
+    with open(path,'rb') as f:
+        assert f.read() == expectedBytes(messages,hour == 0)
+    assert not os.path.exists(path + '.part')
+
+def test_gap_fetches_the_record_in_between_and_cuts_it_out(gribdir,rangeserver,tmp_path):
+    filename = downloader.gribFilename('20170927','00',6,1)
+    messages = publishFile(rangeserver,gribdir,filename)
+    path = downloader.downloadFile('20170927','00',6,1,str(tmp_path),rangeserver.url,\
+        gap=10 ** 7,maxranges=1)
+    # one request for the inventory and one range for the whole file
+    assert len(rangeserver.requests) == 2
+    with open(path,'rb') as f:
+        assert f.read() == expectedBytes(messages,False)
+
+def test_server_errors_are_retried(gribdir,rangeserver,tmp_path,monkeypatch):
+    monkeypatch.setattr(downloader.time,'sleep',lambda seconds: None)
+    filename = downloader.gribFilename('20170927','00',6,1)
+    messages = publishFile(rangeserver,gribdir,filename)
+    rangeserver.failures = downloader.retries
+    path = downloader.downloadFile('20170927','00',6,1,str(tmp_path),rangeserver.url)
+    with open(path,'rb') as f:
+        assert f.read() == expectedBytes(messages,False)
+
+def test_gives_up_after_retries(gribdir,rangeserver,tmp_path,monkeypatch):
+    monkeypatch.setattr(downloader.time,'sleep',lambda seconds: None)
+    publishFile(rangeserver,gribdir,downloader.gribFilename('20170927','00',6,1))
+    rangeserver.failures = downloader.retries + 1
+    outdir = str(tmp_path / 'out')
+    os.makedirs(outdir)
+    with pytest.raises(IOError):
+        downloader.downloadFile('20170927','00',6,1,outdir,rangeserver.url)
+    assert len(rangeserver.requests) == downloader.retries + 1
+    assert os.listdir(outdir) == []
+
+def test_missing_file_is_skipped(rangeserver,tmp_path):
+    assert downloader.downloadFile('20170927','00',6,1,str(tmp_path),rangeserver.url) is None
+
+def test_download_run(gribdir,rangeserver,tmp_path):
+    for hour in [0,6]:
+        for pert in [1,2]:
+            publishFile(rangeserver,gribdir,downloader.gribFilename('20170927','00',hour,pert))
+    landed = []
+    files = downloader.downloadRun('20170927','00',str(tmp_path / 'run'),hours=[0,6,12],\
+        perts=[1,2],connections=3,baseurl=rangeserver.url,onfile=landed.append)
+    assert [os.path.basename(path) for path in files] == ['grib_gefs_20170927_00_000_01',\
+        'grib_gefs_20170927_00_000_02','grib_gefs_20170927_00_006_01',\
+        'grib_gefs_20170927_00_006_02']
+    assert sorted(landed) == files
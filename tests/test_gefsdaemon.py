@@ -0,0 +1,91 @@
+''' Tests for the cycle queue and state file of the daemon (gefsdaemon.py). '''
+
+import datetime
+import os
+
+import pytest
+
+import gefsdaemon
+
+# a source with every cycle ready
+class AlwaysReady(object):
+    def ready(self,cycle):
+        return True
+
+cycles = [datetime.datetime(2017,9,27,hour) for hour in (0,6,12)]
+
+@pytest.fixture
+def statefile(tmp_path,monkeypatch):
+    filename = str(tmp_path / 'gefsdaemon.json')
+    monkeypatch.setattr(gefsdaemon,'statefile',filename)
+    return filename
+
+# makes runCycle fail for the cycles in failing and records the ones it ran
+@pytest.fixture
+def runs(monkeypatch):
+    runs = {'ran':[],'failing':set()}
+    def runCycle(cycle,sites,check):
+        runs['ran'].append(gefsdaemon.cycleName(cycle))
+        if gefsdaemon.cycleName(cycle) in runs['failing']:
+            raise IOError('no GRIB files came in')
+    monkeypatch.setattr(gefsdaemon,'runCycle',runCycle)
+    return runs
+
+# one poll of the daemon: load the state file, queue what's ready, and run it
+def poll(candidates=cycles):
+    state = gefsdaemon.loadState(gefsdaemon.statefile)
+    queue = []
+    gefsdaemon.queueCycles(queue,candidates,state,AlwaysReady())
+    gefsdaemon.runQueue(queue,state,[],AlwaysReady())
+    return gefsdaemon.loadState(gefsdaemon.statefile)
+
+def test_failed_cycle_is_retried_then_given_up(statefile,runs):
+    runs['failing'].add('2017092700')
+    for attempt in range(1,gefsdaemon.maxattempts + 1):
+        state = poll(cycles[:1])
+        assert state['failures'] == {'2017092700':attempt}
+        assert state['finished'] == []
+    # given up: not run again on the next poll, even after a restart
+    runs['ran'] = []
+    state = poll(cycles[:1])
+    assert runs['ran'] == []
+    assert state['failures'] == {'2017092700':gefsdaemon.maxattempts}
+
+def test_retry_that_succeeds_clears_the_failures(statefile,runs):
+    runs['failing'].add('2017092700')
+    poll(cycles[:1])
+    runs['failing'].clear()
+    state = poll(cycles[:1])
+    assert state == {'finished':['2017092700'],'failures':{}}
+
+def test_finished_cycles_are_not_run_again(statefile,runs):
+    poll()
+    assert runs['ran'] == ['2017092700','2017092706','2017092712']
+    runs['ran'] = []
+    poll()
+    assert runs['ran'] == []
+
+def test_cycles_older_than_the_newest_finished_are_dropped(statefile,runs):
+    poll(cycles[2:])
+    runs['ran'] = []
+    state = poll()
+    assert runs['ran'] == []
+    assert state['finished'] == ['2017092712']
+
+def test_unreadable_state_file_starts_over(statefile):
+    with open(statefile,'w') as f:
+        f.write('{not json')
+    assert gefsdaemon.loadState(statefile) == {'finished':[],'failures':{}}
+
+def test_local_source_retry_reuses_linked_files(tmp_path):
+    folder = tmp_path / 'local' / '2017092700'
+    folder.mkdir(parents=True)
+    for name in ['grib_gefs_20170927_00_000_01','grib_gefs_20170927_00_006_01','ready']:
+        (folder / name).write_bytes(b'GRIB')
+    gribdir = str(tmp_path / 'grib')
+    os.makedirs(gribdir)
+    source = gefsdaemon.LocalSource(str(tmp_path / 'local'))
+    assert source.ready(cycles[0])
+    first = list(source.files(cycles[0],gribdir))
+    assert list(source.files(cycles[0],gribdir)) == first == ['grib_gefs_20170927_00_000_01',\
+        'grib_gefs_20170927_00_006_01']
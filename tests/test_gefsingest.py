@@ -0,0 +1,51 @@
+''' Tests for the GRIB ingest (gefsingest.py). '''
+
+import multiprocessing
+
+import numpy as np
+import pytest
+
+import gefsingest
+from gribindex import MessageIndex
+
+# the sites used throughout (inside the map domain below)
+sitelats = [32.9,40.0]
+sitelons = [-97.0,-105.0]
+domain = (20.0,50.0,-130.0,-60.0)
+
+# counts the fields MessageIndex decodes for every (shortName, level)
+def countDecodes(monkeypatch):
+    counts = {}
+    values = MessageIndex.values
+    def counted(self,shortname,level):
+        counts[(shortname,level)] = counts.get((shortname,level),0) + 1
+        return values(self,shortname,level)
+    monkeypatch.setattr(MessageIndex,'values',counted)
+    return counts
+
+def test_lowmemory_decodes_each_field_once(gribdir,monkeypatch):
+    filename = 'grib_gefs_20170927_00_006_01'
+    full = gefsingest.processFile(gribdir,filename,sitelats,sitelons,domain=domain)
+    counts = countDecodes(monkeypatch)
+    low = gefsingest.processFile(gribdir,filename,sitelats,sitelons,lowmemory=True,domain=domain)
+
+    # the map fields are cut out in the same pass as the points
+    assert counts[('2t',2)] == 1
+    assert counts[('tp',0)] == 1
+    assert max(counts.values()) == 1
+    np.testing.assert_array_equal(low[2],full[2])
+    for name in gefsingest.mapvariables:
+        np.testing.assert_array_equal(low[5][name],full[5][name])
+
+def test_analysis_region_has_no_precipitation(gribdir):
+    region = gefsingest.processFile(gribdir,'grib_gefs_20170927_00_000_01',sitelats,sitelons,\
+        lowmemory=True,domain=domain)[5]
+    assert 'temp' in region and 'precip' not in region
+
+def test_failed_worker_shuts_down_pool(gribdir,monkeypatch):
+    def failing(*args):
+        raise ValueError('worker failed')
+    monkeypatch.setattr(gefsingest,'processFile',failing)
+    with pytest.raises(ValueError,match='worker failed'):
+        gefsingest.ingest(gribdir,sitelats,sitelons,nworkers=2)
+    assert multiprocessing.active_children() == []
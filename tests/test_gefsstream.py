@@ -0,0 +1,60 @@
+''' Tests for the streaming ingest (gefsstream.py). '''
+
+import multiprocessing
+import os
+import shutil
+import threading
+
+import numpy as np
+import pytest
+
+import gefsstream
+from runlayout import RunLayout
+
+sites = [{'id':'dfw','name':'Dallas/Fort Worth, TX','lat':32.9,'lon':-97.0}]
+layout = RunLayout([1,2],[0,6])
+latefile = 'grib_gefs_20170927_00_006_02'
+
+def test_watch_rereads_file_still_being_written(gribdir,tmp_path):
+    # every file but one is complete when the watch starts, and that one is cut short until its
+    # writer (with no .part file) finishes it
+    watchdir = str(tmp_path / 'watch') + '/'
+    os.makedirs(watchdir)
+    for filename in os.listdir(gribdir):
+        if layout.indices(filename) is not None and filename != latefile:
+            shutil.copy(gribdir + filename,watchdir + filename)
+    with open(gribdir + latefile,'rb') as f:
+        data = f.read()
+    with open(watchdir + latefile,'wb') as f:
+        f.write(data[:len(data) // 2])
+    def finish():
+        with open(watchdir + latefile,'ab') as f:
+            f.write(data[len(data) // 2:])
+    writer = threading.Timer(0.5,finish)
+
+    published = []
+    def publish(cube,initinfo,hour):
+        published.append((hour,np.isnan(cube[0,:,:,0]).any()))
+    ingested = set()
+    writer.start()
+    try:
+        cube,initinfo = gefsstream.streamIngest(gefsstream.watchDirectory(watchdir,\
+            layout.filecount(),pollinterval=0.05,idletimeout=10.0,ingested=ingested),watchdir,\
+            sites,publish,milestones=[6],layout=layout,ingested=ingested)
+    finally:
+        writer.join()
+
+    # the cell is filled once the file is whole, and nothing was published without it
+    assert latefile in ingested and len(ingested) == layout.filecount()
+    assert not np.isnan(cube[0,layout.memberix[2],layout.leadix[6]]).any()
+    assert published == [(6,False),(None,False)]
+
+def test_failed_publish_shuts_down_pool(gribdir):
+    # the first publish fails while the workers still have files to read
+    def publish(cube,initinfo,hour):
+        raise IOError('disk full')
+    filenames = sorted(os.listdir(gribdir))
+    with pytest.raises(IOError,match='disk full'):
+        gefsstream.streamIngest(filenames,gribdir,sites,publish,milestones=[0],nworkers=2,\
+            layout=RunLayout(range(1,21),[0,6,12]))
+    assert multiprocessing.active_children() == []
@@ -0,0 +1,80 @@
+''' Tests for the inventory parsing and byte-range planning (gribinventory.py). '''
+
+import os
+
+import pytest
+
+from gribinventory import cutRecords,mergeRanges,parseInventory,planRequests,rangeHeader,\
+    responseParts,selectFields
+
+# records at 0-99, 100-199 (two sub-messages), 250-299, 300-999, and 1000 to the end
+inventory = '''1:0:d=2017092700:TMP:2 m above ground:6 hour fcst:ENS=+1
+2.1:100:d=2017092700:UGRD:10 m above ground:6 hour fcst:ENS=+1
+2.2:100:d=2017092700:VGRD:10 m above ground:6 hour fcst:ENS=+1
+3:250:d=2017092700:TMP:surface:6 hour fcst:ENS=+1
+4:300:d=2017092700:APCP:surface:0-6 hour acc fcst:ENS=+1
+5:1000:d=2017092700:CRAIN:surface:0-6 hour ave fcst:ENS=+1
+'''
+
+def records(*numbers):
+    return [record for record in parseInventory(inventory) if record['number'] in numbers]
+
+def test_parse_ends():
+    ends = dict((record['number'],record['end']) for record in parseInventory(inventory))
+    assert ends == {'1':99,'2.1':249,'2.2':249,'3':299,'4':999,'5':None}
+
+def test_select_fields_matches_variable_and_level_together():
+    selected = selectFields(parseInventory(inventory),[('TMP','2 m above ground'),\
+        ('APCP','surface')])
+    assert [record['number'] for record in selected] == ['1','4']
+
+def test_merge_adjacent_and_shared_offsets():
+    # 1 and 2 touch, and 2.1/2.2 share a range
+    assert mergeRanges(records('1','2.1','2.2','4')) == [(0,249),(300,999)]
+
+@pytest.mark.parametrize('gap,expected',[(0,[(0,99),(250,299)]),(149,[(0,99),(250,299)]),\
+    (150,[(0,299)])])
+def test_merge_gap(gap,expected):
+    # 150 bytes between 99 and 250
+    assert mergeRanges(records('1','3'),gap) == expected
+
+def test_plan_groups_ranges_by_maxranges():
+    plan = planRequests(records('1','3','5'),gap=0,maxranges=2)
+    assert plan['requests'] == [[(0,99),(250,299)],[(1000,None)]]
+    assert plan['openended']
+    # the open-ended last record isn't counted
+    assert plan['needed'] == plan['planned'] == 150
+    assert plan['extra'] == 0
+
+def test_plan_counts_extra_bytes_from_the_gap():
+    plan = planRequests(records('1','3'),gap=200,maxranges=1)
+    assert plan['requests'] == [[(0,299)]]
+    assert (plan['needed'],plan['planned'],plan['extra']) == (150,300,150)
+    assert not plan['openended']
+
+def test_plan_one_request_per_range():
+    plan = planRequests(records('1','3','4'),maxranges=1)
+    assert plan['requests'] == [[(0,99)],[(250,999)]]
+
+def test_range_header():
+    assert rangeHeader([(0,99),(1000,None)]) == 'bytes=0-99,1000-'
+
+def test_multipart_reply_is_cut_back_to_the_records():
+    data = os.urandom(1200)
+    body = b''
+    for first,last in [(0,299),(1000,1199)]:
+        body += b'\r\n--XYZ\r\nContent-Range: bytes %d-%d/1200\r\n\r\n' % (first,last) + \
+            data[first:last + 1]
+    body += b'\r\n--XYZ--\r\n'
+    parts = responseParts(206,{'Content-Type':'multipart/byteranges; boundary=XYZ'},body)
+    assert parts == [(0,data[0:300]),(1000,data[1000:])]
+    # the record in between (100-249) is dropped
+    assert cutRecords(parts,records('1','3','5')) == [data[0:100],data[250:300],data[1000:]]
+
+def test_single_range_and_whole_file_replies():
+    data = os.urandom(500)
+    assert responseParts(206,{'Content-Range':'bytes 250-299/500'},data[250:300]) == \
+        [(250,data[250:300])]
+    assert cutRecords(responseParts(200,{},data),records('3')) == [data[250:300]]
+    with pytest.raises(ValueError):
+        cutRecords([(0,data[0:200])],records('3'))
@@ -0,0 +1,99 @@
+''' Tests for the plot render cache (renderpool.py and rendercache.py). '''
+
+import datetime
+import os
+
+import numpy as np
+import pandas
+
+import ensemblemeans
+import ensemblestats
+import htmlbuilder
+import rendercache
+import renderpool
+
+# a one-location [member, lead, variable] slice with every variable enabled in the ingest
+def siteData(nleads=9):
+    random = np.random.RandomState(0)
+    data = random.uniform(0.0,1.0,(4,nleads,len(ensemblemeans.variables)))
+    init = datetime.datetime(2017,9,27,0)
+    vtimes = [init + datetime.timedelta(hours=6 * lead) for lead in range(nleads)]
+    return data,vtimes
+
+def test_mean_plots_are_cached(tmp_path,capsys):
+    data,vtimes = siteData()
+    savedir = str(tmp_path / 'site')
+    os.makedirs(savedir)
+    jobs = ensemblemeans.siteProducts(data,vtimes,'Test',savedir,writecsv=False)
+    assert len(jobs) == len(ensemblemeans.meanplots)
+    assert all(rendercache.jobKey(job) is not None for job in jobs)
+    assert sorted(path for job in jobs for path in rendercache.outputPaths(job[1])) == \
+        sorted(os.path.join(savedir,plot[3]) for plot in ensemblemeans.meanplots)
+
+    # drawn the first time, then copied out of the cache
+    cachedir = str(tmp_path / 'cache')
+    renderpool.renderJobs(jobs,1,cachedir)
+    assert '0 hits, 4 misses, 0 uncached' in capsys.readouterr().out
+    for name in os.listdir(savedir):
+        os.remove(os.path.join(savedir,name))
+    renderpool.renderJobs(jobs,1,cachedir)
+    assert '4 hits, 0 misses, 0 uncached' in capsys.readouterr().out
+    assert sorted(os.listdir(savedir)) == sorted(plot[3] for plot in ensemblemeans.meanplots)
+
+# a plot job that builds its own file name
+def namelessPlot(savedir):
+    open(os.path.join(savedir,'plot.png'),'w').close()
+
+def test_warns_without_output_path(tmp_path,capsys):
+    renderpool.renderJobs([(namelessPlot,(str(tmp_path),))],1,str(tmp_path / 'cache'))
+    out = capsys.readouterr().out
+    assert 'warning: namelessPlot has no output file argument, not cached' in out
+    assert '0 hits, 0 misses, 1 uncached' in out
+
+# the plot jobs buildSite makes for a location with a few days of random data
+def siteJobs(savedir):
+    random = np.random.RandomState(0)
+    days = pandas.date_range('2017-09-27',periods=4,name='Date')
+    daily = tuple(pandas.DataFrame(random.uniform(0.0,1.0,(4,5)),index=days,\
+        columns=['gep%d' % member for member in range(1,6)]) for var in range(4))
+    return htmlbuilder.buildSite(daily,days[0],savedir,'Test','warm')
+
+# replaces a function's code with the code of source's function of the same name
+def editFunction(monkeypatch,function,source):
+    namespace = {}
+    exec(source,function.__globals__.copy(),namespace)
+    monkeypatch.setattr(function,'__code__',namespace[function.__name__].__code__)
+
+def test_key_follows_helpers(tmp_path,monkeypatch):
+    jobs = siteJobs(str(tmp_path))
+    keys = [rendercache.jobKey(job) for job in jobs]
+    assert None not in keys
+
+    # plotter and precip_plotter draw the normals with normal_line
+    editFunction(monkeypatch,htmlbuilder.normal_line,\
+        'def normal_line(ax,normal):\n    return None\n')
+    edited = [rendercache.jobKey(job) for job in jobs]
+    for job,key,newkey in zip(jobs,keys,edited):
+        assert (newkey != key) == (job[0] in (htmlbuilder.plotter,htmlbuilder.precip_plotter))
+    monkeypatch.undo()
+
+    # precip_percent_plotter and box_and_whisker use EnsembleStats
+    editFunction(monkeypatch,ensemblestats.EnsembleStats.percentiles,\
+        'def percentiles(self,q):\n    return None\n')
+    edited = [rendercache.jobKey(job) for job in jobs]
+    for job,key,newkey in zip(jobs,keys,edited):
+        assert (newkey != key) == (job[0] in (htmlbuilder.box_and_whisker,\
+            htmlbuilder.precip_percent_plotter))
+    monkeypatch.undo()
+    assert [rendercache.jobKey(job) for job in jobs] == keys
+
+def test_key_follows_helper_settings(tmp_path,monkeypatch):
+    job = siteJobs(str(tmp_path))[0]
+    # a setting a helper reads (plotter only reads it through normal_line)
+    editFunction(monkeypatch,htmlbuilder.normal_line,'def normal_line(ax,normal):\n'\
+        '    if normal is not None:\n'\
+        '        ax.plot(normal.index,normal.values,linewidth=normalwidth)\n')
+    monkeypatch.setattr(htmlbuilder,'normalwidth',3,raising=False)
+    key = rendercache.jobKey(job)
+    monkeypatch.setattr(htmlbuilder,'normalwidth',2)
+    assert rendercache.jobKey(job) != key
@@ -0,0 +1,84 @@
+''' Tests for the run check and repair (runcheck.py). '''
+
+import os
+import shutil
+
+import numpy as np
+import pandas
+import pytest
+
+import runcheck
+from cubestore import openCube,writeCube
+from cyclestore import CycleStore
+from gefsingest import ingest,units,validTimes,variables
+from runlayout import RunLayout
+from syntheticgrib import memberNumbers
+
+sites = [{'id':'dfw','name':'Dallas/Fort Worth, TX','lat':32.9,'lon':-97.0},\
+    {'id':'den','name':'Denver, CO','lat':40.0,'lon':-105.0}]
+badfile = 'grib_gefs_20170927_00_006_03'
+
+# ingests the synthetic run into a cube file the way ensemblemeans.py does, with badfile's cell
+# left NAN as if it had not come in. Returns the cube file, the [site, variable, member, lead]
+# cube from the whole run, and the manifest of the run with the file moved out of the way (it is
+# put back for the repair).
+@pytest.fixture
+def brokenRun(gribdir,tmp_path):
+    layout = RunLayout(memberNumbers(20),[0,6,12])
+    cube,initinfo = ingest(gribdir,[site['lat'] for site in sites],\
+        [site['lon'] for site in sites],layout=layout)
+    full = np.transpose(cube,(0,3,1,2)).astype(np.float32)
+    cube[:,layout.memberix[3],layout.leadix[6]] = np.nan
+    cubefile = str(tmp_path / 'gefs_cube.bin')
+    writeCube(cubefile,cube,validTimes(*initinfo,hours=layout.hours),sites,variables,units,\
+        layout.columns())
+    shutil.move(gribdir + badfile,str(tmp_path / badfile))
+    manifest = runcheck.checkRun(gribdir,layout,'20170927','00')
+    assert [cell['file'] for cell in manifest['cells']] == [badfile]
+    shutil.move(str(tmp_path / badfile),gribdir + badfile)
+    return cubefile,full,manifest
+
+def test_repair_patches_cube(brokenRun):
+    cubefile,full,manifest = brokenRun
+    manifest,repaired = runcheck.repairRun(manifest,cubefile,fetch=False)
+    assert repaired == 1 and manifest['cells'] == []
+    np.testing.assert_array_equal(openCube(cubefile)[1],full)
+
+def test_decode_problem_stays_in_manifest(brokenRun,monkeypatch):
+    cubefile,full,manifest = brokenRun
+    processFile = runcheck.processFile
+    def failing(*args,**kwargs):
+        result = processFile(*args,**kwargs)
+        return result[0:4] + (dict(result[4],problem='message 3 cut short'),) + result[5:]
+    monkeypatch.setattr(runcheck,'processFile',failing)
+    before = np.array(openCube(cubefile)[1])
+    manifest,repaired = runcheck.repairRun(manifest,cubefile,fetch=False)
+    assert repaired == 0
+    assert [(cell['file'],cell['status'],cell['problem']) for cell in manifest['cells']] == \
+        [(badfile,'corrupt','message 3 cut short')]
+    np.testing.assert_array_equal(openCube(cubefile)[1],before)
+
+def test_refuses_disabled_variables(brokenRun,monkeypatch):
+    cubefile,full,manifest = brokenRun
+    monkeypatch.setattr(runcheck,'variables',[var for var in variables if var != 'dpt'])
+    with pytest.raises(ValueError,match='dpt that are no longer in derivedvars.products'):
+        runcheck.repairRun(manifest,cubefile,fetch=False)
+
+def test_refresh_products(brokenRun,tmp_path):
+    cubefile,full,manifest = brokenRun
+    cycledir = str(tmp_path / 'cycles')
+    CycleStore(cycledir).add(cubefile)
+    runcheck.repairRun(manifest,cubefile,fetch=False)
+    for site in sites:
+        site = dict(site,savedir=str(tmp_path / site['id']))
+        os.makedirs(site['savedir'])
+        runcheck.refreshProducts(cubefile,[site],cycledir)
+
+        # the CSVs and plots are redone from the patched cube
+        temps = pandas.read_csv(os.path.join(site['savedir'],'maxtemps.csv'),index_col=0)
+        assert not temps.isnull().values.any()
+        assert 'ensmean_temp.png' in os.listdir(site['savedir'])
+
+    # and so is the cycle store's copy
+    store = CycleStore(cycledir)
+    np.testing.assert_array_equal(store.open(store.cycles()[-1])[1],full)